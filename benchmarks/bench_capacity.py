@@ -0,0 +1,60 @@
+"""
+Measure the capacity simulator on random pod groups, e.g. an exam with
+thousands of students over many course ids.
+
+usage:
+    PYTHONPATH=. python benchmarks/bench_capacity.py [--groups 2000]
+    [--max-pods 60] [--repeat 5]
+"""
+
+import argparse
+import random
+import timeit
+
+from e2xhub.capacity import NodePool, simulate
+
+CPU_GUARANTEES = [100, 250, 500, 1000]
+MEM_GUARANTEES = [2**30 // 4, 2**30, 2 * 2**30]
+
+
+def pod_groups(n_groups, max_pods, seed=0):
+    rng = random.Random(seed)
+    c8m64 = {"key": "flavor", "operator": "In", "values": ["c8m64"]}
+    flavors = [[], [{"matchExpressions": [c8m64]}]]
+    return [
+        {
+            "course_id_slug": f"Course{k}+student+Course{k}-SS24",
+            "pods": rng.randint(1, max_pods),
+            "cpu": rng.choice(CPU_GUARANTEES),
+            "memory": rng.choice(MEM_GUARANTEES),
+            "node_selector_terms": rng.choice(flavors),
+        }
+        for k in range(n_groups)
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--groups", type=int, default=2000)
+    parser.add_argument("--max-pods", type=int, default=60)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    node_pools = [
+        NodePool("c4m32", {"flavor": "c4m32"}, 4000, 30 * 2**30, max_nodes=50),
+        NodePool("c8m64", {"flavor": "c8m64"}, 8000, 62 * 2**30),
+    ]
+    groups = pod_groups(args.groups, args.max_pods)
+    report = simulate(groups, node_pools)
+    duration = min(
+        timeit.repeat(
+            lambda: simulate(groups, node_pools), number=1, repeat=args.repeat
+        )
+    )
+    nodes = {name: pool["nodes"] for name, pool in report["pools"].items()}
+    print(f"{report['pods']} pods in {args.groups} groups: {duration * 1000:.1f} ms")
+    print(f"nodes: {nodes}, unschedulable groups: {len(report['unschedulable'])}")
+
+
+if __name__ == "__main__":
+    main()
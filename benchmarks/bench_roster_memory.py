@@ -0,0 +1,99 @@
+"""
+Compare the memory use of course members stored as sets of usernames with
+compact rosters (interned usernames, sorted id arrays).
+
+Usernames are created anew for every course id like they are when each csv
+file is parsed, so the set layout holds one string per enrollment while the
+rosters hold one string per user.
+
+usage:
+    PYTHONPATH=. python benchmarks/bench_roster_memory.py [--course-ids 2000]
+    [--members 500] [--users 50000]
+"""
+
+import argparse
+import gc
+import timeit
+import tracemalloc
+
+from e2xhub.roster import RosterStore, union_members
+
+
+def course_usernames(k, n_members, n_users):
+    start = (k * n_members // 3) % n_users
+    # formatted anew on every call, like the strings parsed from a csv file
+    return [f"user{(start + i) % n_users:07d}" for i in range(n_members)]
+
+
+def measure(build):
+    gc.collect()
+    tracemalloc.start()
+    value = build()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return value, size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--course-ids", type=int, default=2000)
+    parser.add_argument("--members", type=int, default=500)
+    parser.add_argument("--users", type=int, default=50000)
+    args = parser.parse_args()
+
+    def build_sets():
+        return [
+            set(course_usernames(k, args.members, args.users))
+            for k in range(args.course_ids)
+        ]
+
+    def build_rosters():
+        store = RosterStore()
+        return [
+            store.roster(course_usernames(k, args.members, args.users))
+            for k in range(args.course_ids)
+        ]
+
+    sets, sets_size = measure(build_sets)
+    rosters, rosters_size = measure(build_rosters)
+    assert all(s == r for s, r in zip(sets, rosters))
+
+    probe = course_usernames(args.course_ids // 2, 1, args.users)[0]
+    set_lookup = min(
+        timeit.repeat(lambda: [probe in s for s in sets], number=10, repeat=5)
+    )
+    roster_lookup = min(
+        timeit.repeat(lambda: [probe in r for r in rosters], number=10, repeat=5)
+    )
+    set_union = min(timeit.repeat(lambda: union_members(sets), number=1, repeat=3))
+    roster_union = min(
+        timeit.repeat(lambda: union_members(rosters), number=1, repeat=3)
+    )
+    assert union_members(sets) == union_members(rosters)
+
+    enrollments = args.course_ids * args.members
+    print(
+        f"{args.course_ids} course ids x {args.members} members, "
+        f"{len(union_members(sets))} distinct users"
+    )
+    print(
+        f"sets of usernames: {sets_size / 2**20:9.1f} MiB "
+        f"({sets_size / enrollments:5.1f} bytes per enrollment)"
+    )
+    print(
+        f"compact rosters:   {rosters_size / 2**20:9.1f} MiB "
+        f"({rosters_size / enrollments:5.1f} bytes per enrollment)"
+    )
+    print(f"memory saved:      {1 - rosters_size / sets_size:9.1%}")
+    print(
+        f"membership test in all course ids: sets {set_lookup / 10 * 1000:.3f} ms, "
+        f"rosters {roster_lookup / 10 * 1000:.3f} ms"
+    )
+    print(
+        f"union of all course ids:           sets {set_union * 1000:.1f} ms, "
+        f"rosters {roster_union * 1000:.1f} ms"
+    )
+
+
+if __name__ == "__main__":
+    main()
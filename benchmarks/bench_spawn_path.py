@@ -0,0 +1,226 @@
+"""
+Benchmark the spawn hot path on synthetic course trees.
+
+For each scale a synthetic nbgrader.course_dir is generated and the following
+operations are measured:
+
+    catalog               get_course_config_and_user
+    profile_list          E2xHub.configure_profile_list
+    pre_spawn             E2xHub.configure_pre_spawn_hook
+
+cold runs use a new E2xHub (empty in-process caches, the OS page cache is warm),
+warm runs reuse it. Cached profile lists are measured separately from warm
+rebuilds for users not seen before. Peak memory of the cold runs is measured
+with tracemalloc in separate runs, file opens are counted with an audit hook.
+
+The results are written as json so they can be compared across releases.
+
+usage:
+    PYTHONPATH=. python benchmarks/bench_spawn_path.py [--scale small medium]
+    [--courses 100 --users 500] [--repeat 5] [--output results.json]
+"""
+
+import argparse
+import datetime
+import json
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import synthetic
+
+from e2xhub import E2xHub, __version__
+from e2xhub.catalog import CourseCatalog
+from e2xhub.utils import get_course_config_and_user
+
+# courses, students per course id
+SCALES = {
+    "small": (10, 50),
+    "medium": (100, 500),
+    "large": (1000, 5000),
+}
+
+
+class OpenCounter:
+    """
+    Count the files opened while active, using the "open" audit event
+    """
+
+    def __init__(self):
+        self.active = False
+        self.count = 0
+        sys.addaudithook(self._hook)
+
+    def _hook(self, event, args):
+        if self.active and event == "open":
+            self.count += 1
+
+    def measure(self, func):
+        self.count = 0
+        self.active = True
+        try:
+            func()
+        finally:
+            self.active = False
+        return self.count
+
+
+def stats(durations):
+    return {
+        "min_s": min(durations),
+        "median_s": statistics.median(durations),
+        "mean_s": statistics.mean(durations),
+        "max_s": max(durations),
+        "runs": len(durations),
+    }
+
+
+def timed_runs(func, repeat, setup=None):
+    """
+    Durations of repeat calls of func, setup() is called before each call and
+    its result passed to func
+    """
+    durations = []
+    for _ in range(repeat):
+        state = setup() if setup is not None else None
+        start = time.perf_counter()
+        func(state)
+        durations.append(time.perf_counter() - start)
+    return durations
+
+
+def peak_memory(func, setup=None):
+    state = setup() if setup is not None else None
+    tracemalloc.start()
+    try:
+        func(state)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def bench_scale(server_cfg, spawns, repeat, opens):
+    results = {}
+
+    def catalog(catalog):
+        get_course_config_and_user(server_cfg, catalog=catalog)
+
+    def profile_list(hub, spawn=spawns[0]):
+        hub.configure_profile_list(synthetic.make_spawner(spawn[0]), server_cfg)
+
+    def pre_spawn(hub, spawn=spawns[0]):
+        hub.configure_pre_spawn_hook(synthetic.make_spawner(*spawn), server_cfg)
+
+    # cold: new catalog or hub for every run
+    for name, func, setup in [
+        ("catalog", catalog, CourseCatalog),
+        ("profile_list", profile_list, E2xHub),
+        ("pre_spawn", pre_spawn, E2xHub),
+    ]:
+        results[f"{name}_cold"] = stats(timed_runs(func, repeat, setup))
+        results[f"{name}_cold"]["peak_memory_bytes"] = peak_memory(func, setup)
+        state = setup()
+        results[f"{name}_cold"]["file_opens"] = opens.measure(lambda: func(state))
+
+    # warm: caches filled by a first call
+    catalog_state = CourseCatalog()
+    catalog(catalog_state)
+    results["catalog_warm"] = stats(timed_runs(catalog, repeat, lambda: catalog_state))
+    results["catalog_warm"]["file_opens"] = opens.measure(
+        lambda: catalog(catalog_state)
+    )
+
+    hub = E2xHub()
+    profile_list(hub)
+    results["profile_list_warm_cached"] = stats(
+        timed_runs(profile_list, repeat, lambda: hub)
+    )
+    results["profile_list_warm_cached"]["file_opens"] = opens.measure(
+        lambda: profile_list(hub)
+    )
+
+    # users not seen before, the catalog is warm but the profile is rebuilt
+    users = iter(spawns * (repeat // len(spawns) + 2))
+    results["profile_list_warm_uncached"] = stats(
+        timed_runs(
+            lambda hub: profile_list(hub, next(users)),
+            repeat,
+            lambda: hub.profile_cache.invalidate() or hub,
+        )
+    )
+
+    pre_spawns = iter(spawns * (repeat // len(spawns) + 2))
+    pre_spawn(hub)
+    results["pre_spawn_warm"] = stats(
+        timed_runs(lambda hub: pre_spawn(hub, next(pre_spawns)), repeat, lambda: hub)
+    )
+    results["pre_spawn_warm"]["file_opens"] = opens.measure(lambda: pre_spawn(hub))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument(
+        "--scale",
+        nargs="+",
+        choices=sorted(SCALES),
+        default=["small", "medium"],
+        help="predefined scales, ignored if --courses and --users are given",
+    )
+    parser.add_argument("--courses", type=int, help="number of courses")
+    parser.add_argument("--users", type=int, help="students per course id")
+    parser.add_argument("--semesters", type=int, default=2)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", help="json file, printed if not given")
+    args = parser.parse_args()
+
+    if args.courses and args.users:
+        scales = {f"{args.courses}x{args.users}": (args.courses, args.users)}
+    else:
+        scales = {name: SCALES[name] for name in args.scale}
+
+    opens = OpenCounter()
+    report = {
+        "meta": {
+            "e2xhub_version": __version__,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "date": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "repeat": args.repeat,
+        },
+        "scales": {},
+    }
+    for name, (n_courses, n_users) in scales.items():
+        with tempfile.TemporaryDirectory(prefix="e2xhub-bench-") as root:
+            start = time.perf_counter()
+            server_cfg = synthetic.make_tree(
+                root, n_courses, n_users, n_semesters=args.semesters
+            )
+            print(
+                f"{name}: {n_courses} courses x {n_users} users generated in "
+                f"{time.perf_counter() - start:.1f} s",
+                file=sys.stderr,
+            )
+            spawns = synthetic.sample_spawns(
+                n_courses, n_users, n_semesters=args.semesters
+            )
+            report["scales"][name] = {
+                "courses": n_courses,
+                "users_per_course_id": n_users,
+                "semesters": args.semesters,
+                "results": bench_scale(server_cfg, spawns, args.repeat, opens),
+            }
+
+    output = json.dumps(report, indent=1)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Benchmark the yaml loaders on the shapes of the server and course configs.
+
+Compares yaml.safe_load (pure Python SafeLoader), the libyaml CSafeLoader used
+by utils.load_yaml and the compiled json cache of utils.load_yaml_compiled on
+config/config.yaml and on a generated course config.
+
+usage:
+    python benchmarks/bench_yaml_loaders.py [--config config/config.yaml]
+    [--repeat 50]
+"""
+
+import argparse
+import os
+import tempfile
+import timeit
+
+import yaml
+
+from e2xhub.utils import load_yaml, load_yaml_compiled
+
+COURSE_CONFIG = """\
+course_name: Demo
+course_id: Demo-SS21
+choice_display_name: Demo SS21
+image: ghcr.io/digiklausur/docker-stacks/notebook:latest
+pullPolicy: IfNotPresent
+course_exchange:
+  personalized_inbound: true
+  personalized_outbound: true
+  personalized_feedback: true
+course_cmds:
+  - python -m e2xgrader activate teacher --sys-prefix
+extra_profile_description:
+  - <span style="color:orange;">Demo Course SS21 profile for development</span>
+resources:
+  cpu_guarantee: 0.1
+  cpu_limit: 2.0
+  mem_guarantee: 1G
+  mem_limit: 2G
+  node_affinity:
+    matchExpressions:
+    - key: "hub.jupyter.org/node-purpose"
+      operator: In
+      values:
+       - "user"
+"""
+
+
+def safe_load(yaml_file):
+    with open(yaml_file, "r") as infile:
+        return yaml.safe_load(infile)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument(
+        "--config",
+        default=os.path.join(os.path.dirname(__file__), "..", "config", "config.yaml"),
+    )
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    print(f"libyaml available: {yaml.__with_libyaml__}")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        course_file = os.path.join(tmp_dir, "Demo-SS21.yaml")
+        with open(course_file, "w") as outfile:
+            outfile.write(COURSE_CONFIG)
+        cache_dir = os.path.join(tmp_dir, "compiled")
+
+        for name, yaml_file in [
+            ("server config", args.config),
+            ("course", course_file),
+        ]:
+            # warm up the compiled cache
+            load_yaml_compiled(yaml_file, cache_dir)
+            loaders = [
+                ("SafeLoader", lambda: safe_load(yaml_file)),
+                ("CSafeLoader", lambda: load_yaml(yaml_file)),
+                ("compiled json", lambda: load_yaml_compiled(yaml_file, cache_dir)),
+            ]
+            print(f"{name} ({os.path.getsize(yaml_file)} bytes)")
+            baseline = None
+            for loader_name, loader in loaders:
+                elapsed = min(timeit.repeat(loader, number=1, repeat=args.repeat))
+                baseline = baseline or elapsed
+                print(
+                    f"  {loader_name:14s} {elapsed * 1000:8.3f} ms"
+                    f"  ({baseline / elapsed:5.1f}x)"
+                )
+
+
+if __name__ == "__main__":
+    main()
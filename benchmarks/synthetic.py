@@ -0,0 +1,150 @@
+"""
+Synthetic nbgrader.course_dir trees and a fake spawner for the benchmarks.
+
+The tree has one yaml and one csv member list per course id, like a real
+course_dir:
+
+    <root>/courses/<course_name>/<role>/<course_id>.yaml
+    <root>/courses/<course_name>/<role>/<course_id>.csv
+    <root>/users/{admin_users,allowed_users}.csv
+"""
+
+import logging
+import os
+from pathlib import Path
+from types import SimpleNamespace
+
+import yaml
+
+REPO_CONFIG = Path(__file__).resolve().parents[1] / "config" / "config.yaml"
+
+
+def make_spawner(username, course_id_slug=None):
+    """
+    Fake KubeSpawner with the attributes used by E2xHub
+    args:
+        username: name of the user
+        course_id_slug: selected course choice, Default if None
+    """
+    return SimpleNamespace(
+        user=SimpleNamespace(name=username),
+        log=logging.getLogger("bench"),
+        user_options={"course_id_slug": course_id_slug} if course_id_slug else {},
+        image="notebook:latest",
+        image_pull_policy="IfNotPresent",
+        cpu_guarantee=0.001,
+        cpu_limit=2.0,
+        mem_guarantee=1000000000,
+        mem_limit=2000000000,
+        node_affinity_required=[],
+        lifecycle_hooks={},
+        volumes=[],
+        volume_mounts=[],
+        environment={},
+    )
+
+
+def username(i):
+    return f"user{i:07d}"
+
+
+def course_name(c):
+    return f"Course{c:04d}"
+
+
+def course_id(c, s):
+    return f"{course_name(c)}-S{s}"
+
+
+def roster(c, s, n_users, n_pool):
+    """
+    Member indices of a student course id, a window into the user pool so
+    rosters of neighbouring courses overlap
+    """
+    start = (c * n_users + s * n_users // 2) % n_pool
+    return [(start + i) % n_pool for i in range(n_users)]
+
+
+def make_tree(root, n_courses, n_users, n_semesters=2, courses_per_user=4):
+    """
+    Write a synthetic course tree and return its server config
+    args:
+        root: directory to write the tree to
+        n_courses: number of courses
+        n_users: number of students per course id
+        n_semesters: number of course ids (semesters) per course and role
+        courses_per_user: average number of courses of a student
+    """
+    root = Path(root)
+    course_dir = root / "courses"
+    user_dir = root / "users"
+    n_pool = max(n_users, n_courses * n_users // courses_per_user)
+
+    os.makedirs(user_dir, exist_ok=True)
+    with open(user_dir / "admin_users.csv", "w") as f:
+        f.write("Username\nadmin0\ngrader0000\n")
+    with open(user_dir / "allowed_users.csv", "w") as f:
+        f.write("Username\n" + "\n".join(username(i) for i in range(n_pool)) + "\n")
+
+    for c in range(n_courses):
+        for role in ["grader", "student"]:
+            role_dir = course_dir / course_name(c) / role
+            os.makedirs(role_dir, exist_ok=True)
+            for s in range(n_semesters):
+                cid = course_id(c, s)
+                course_cfg = {
+                    "image": f"registry.example.org/course{c % 10}:latest",
+                    "pullPolicy": "IfNotPresent",
+                    "course_cmds": [f"echo course {cid}"],
+                    "extra_profile_description": [f"{cid} profile"],
+                }
+                if s % 2:
+                    course_cfg["course_exchange"] = {
+                        "personalized_inbound": True,
+                        "personalized_outbound": True,
+                    }
+                    course_cfg["resources"] = {
+                        "cpu_guarantee": 0.5,
+                        "cpu_limit": 3,
+                        "mem_guarantee": "1G",
+                        "mem_limit": "3G",
+                    }
+                with open(role_dir / f"{cid}.yaml", "w") as f:
+                    yaml.safe_dump(course_cfg, f)
+
+                if role == "grader":
+                    members = [f"grader{c:04d}", "grader0000"]
+                else:
+                    members = [username(i) for i in roster(c, s, n_users, n_pool)]
+                with open(role_dir / f"{cid}.csv", "w") as f:
+                    f.write("Username\n" + "\n".join(members) + "\n")
+
+    with open(REPO_CONFIG) as f:
+        server_cfg = yaml.safe_load(f)["server"]["e2x_dev"]
+    server_cfg["nbgrader"]["enabled"] = True
+    server_cfg["nbgrader"]["course_dir"] = str(course_dir)
+    # the code reads the personalized exchange flags from a mapping
+    server_cfg["nbgrader"]["default_exchange"] = {"personalized_feedback": True}
+    server_cfg["user_list_path"] = str(user_dir)
+    return server_cfg
+
+
+def sample_spawns(n_courses, n_users, n_semesters=2, courses_per_user=4, n=20):
+    """
+    (username, course_id_slug) pairs of students and graders spread over the
+    tree written by make_tree
+    """
+    n_pool = max(n_users, n_courses * n_users // courses_per_user)
+    spawns = []
+    for k in range(n):
+        c = (k * 7919) % n_courses
+        s = k % n_semesters
+        if k % 5 == 4:
+            grader = f"grader{c:04d}"
+            spawns.append((grader, f"{course_name(c)}+grader+{course_id(c, s)}"))
+        else:
+            member = roster(c, s, n_users, n_pool)[(k * 104729) % n_users]
+            spawns.append(
+                (username(member), f"{course_name(c)}+student+{course_id(c, s)}")
+            )
+    return spawns
@@ -5,4 +5,15 @@ and course management.
 """
 
 from .__version__ import __version__
-from .e2xhub import E2xHub
\ No newline at end of file
+from .e2xhub import E2xHub
+from .admission import AdmissionRejected, SpawnAdmissionController
+from .catalog import CourseCatalog
+from .config_store import ServerConfigStore
+from .course_configmap import (
+    CourseConfigPublisher,
+    InMemoryConfigMapClient,
+    KubernetesConfigMapClient,
+)
+from .filesystem import CountingFileSystem, LocalFileSystem, MemoryFileSystem
+from .image_digests import FakeRegistryClient, ImageDigestResolver, RegistryClient
+from .user_sync import AllowedUsersSync
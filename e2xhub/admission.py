@@ -0,0 +1,325 @@
+"""
+Admission control of the spawns. At an exam start all students spawn at once,
+which overloads the hub, the Kubernetes API and the NFS server. Spawns are
+admitted by token buckets, one for the whole hub and one per course id, and
+wait in a bounded queue until they get a token. Graders and admins are queued
+before the students, so they are not stuck behind an exam start.
+
+The limits are read from the server config:
+
+    admission:
+      rate: 5             # spawns per second of the hub, 0 for no limit
+      burst: 20           # spawns admitted at once after an idle period
+      course_rate: 2      # spawns per second of each course id
+      course_burst: 10
+      courses:            # limits of single course ids
+        Demo-SS21:
+          rate: 1
+          burst: 5
+      max_queue: 500      # spawns waiting at most, further students are rejected
+      max_wait: 600       # seconds a spawn waits at most
+"""
+
+import asyncio
+import itertools
+import time
+
+# queue priorities, lower is admitted first
+PRIORITY_PRIVILEGED = 0
+PRIORITY_STUDENT = 1
+
+
+class AdmissionRejected(Exception):
+    """
+    The spawn was not admitted because the queue is full or it waited too long
+    """
+
+
+class TokenBucket:
+    """
+    Token bucket refilled with rate tokens per second up to burst tokens
+    """
+
+    def __init__(self, rate, burst, clock=time.monotonic):
+        """
+        args:
+            rate: tokens per second, 0 for no limit
+            burst: maximum number of tokens
+            clock: function returning the current time in seconds
+        """
+        self.clock = clock
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.tokens = self.burst
+        self._updated = clock()
+
+    def configure(self, rate, burst):
+        """
+        Change the rate and burst, keeping the current tokens of a limited
+        bucket. A bucket that had no limit starts full.
+        args:
+            rate: tokens per second, 0 for no limit
+            burst: maximum number of tokens
+        """
+        self._refill()
+        unlimited = not self.rate
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.tokens = self.burst if unlimited else min(self.tokens, self.burst)
+
+    def _refill(self):
+        now = self.clock()
+        if self.rate:
+            refill = (now - self._updated) * self.rate
+            self.tokens = min(self.burst, self.tokens + refill)
+        self._updated = now
+
+    def available(self):
+        """
+        Check whether a token can be taken
+        """
+        if not self.rate:
+            return True
+        self._refill()
+        return self.tokens >= 1
+
+    def take(self):
+        """
+        Take a token, check with available() first
+        """
+        if self.rate:
+            self.tokens -= 1
+
+    def wait_time(self):
+        """
+        Seconds until the next token is available
+        """
+        if not self.rate:
+            return 0.0
+        self._refill()
+        return max(0.0, (1 - self.tokens) / self.rate)
+
+
+class _Waiter:
+    __slots__ = ("key", "username", "course_id", "future", "position", "report")
+
+    def __init__(self, key, username, course_id, future, report):
+        self.key = key
+        self.username = username
+        self.course_id = course_id
+        self.future = future
+        self.position = None
+        self.report = report
+
+
+class SpawnAdmissionController:
+    """
+    Admit spawns through a global and per course id token bucket. Spawns that
+    can not be admitted right away wait in a bounded priority queue, graders
+    and admins before students and first come first served within a
+    priority. A spawn whose course id has no token left does not block the
+    spawns of other course ids behind it.
+    Must be used from a single event loop, e.g. the one of the hub.
+    """
+
+    def __init__(self, clock=time.monotonic):
+        """
+        args:
+            clock: function returning the current time in seconds
+        """
+        self.clock = clock
+        self.admitted = 0
+        self.queued = 0
+        self.rejected = 0
+
+        self._limits = None
+        self._global = TokenBucket(0, 1, clock)
+        # course id -> TokenBucket
+        self._courses = {}
+        self._queue = []
+        self._counter = itertools.count()
+        self._wakeup = None
+        self._dispatcher = None
+
+    def configure(self, limits):
+        """
+        Apply the admission limits of the server config, see the module
+        docstring. The buckets keep their tokens if the limits change.
+        args:
+            limits: admission section of the server config
+        """
+        if limits == self._limits:
+            return
+        self._limits = dict(limits)
+        self._global.configure(
+            float(limits.get("rate", 0)), int(limits.get("burst", 1))
+        )
+        for course_id, bucket in self._courses.items():
+            bucket.configure(*self._course_limits(course_id))
+
+    def _course_limits(self, course_id):
+        limits = self._limits or {}
+        course_limits = limits.get("courses", {}).get(course_id, {})
+        rate = course_limits.get("rate", limits.get("course_rate", 0))
+        burst = course_limits.get("burst", limits.get("course_burst", 1))
+        return float(rate), int(burst)
+
+    def _course_bucket(self, course_id):
+        bucket = self._courses.get(course_id)
+        if bucket is None:
+            bucket = TokenBucket(*self._course_limits(course_id), clock=self.clock)
+            self._courses[course_id] = bucket
+        return bucket
+
+    @property
+    def queue_length(self):
+        return len(self._queue)
+
+    def queue_position(self, username):
+        """
+        1-based queue position of the waiting spawn of the user or None
+        args:
+            username: name of the user
+        """
+        for waiter in self._queue:
+            if waiter.username == username:
+                return waiter.position
+        return None
+
+    def metrics(self):
+        """
+        Number of admitted, queued and rejected spawns and the queue length
+        """
+        return {
+            "admitted": self.admitted,
+            "queued": self.queued,
+            "rejected": self.rejected,
+            "queue_length": len(self._queue),
+        }
+
+    async def admit(self, username, course_id=None, privileged=False, report=None):
+        """
+        Wait until the spawn is admitted and return the seconds it waited.
+        Raise AdmissionRejected if the queue is full or the spawn waited
+        longer than max_wait.
+        args:
+            username: name of the user
+            course_id: course id of the selected profile, None to only use the
+            global bucket
+            privileged: queue before the students, e.g. graders and admins
+            report: function called with the queue position when it changes
+        """
+        limits = self._limits or {}
+        if not self._queue and self._global.available():
+            course_bucket = (
+                self._course_bucket(course_id) if course_id is not None else None
+            )
+            if course_bucket is None or course_bucket.available():
+                self._global.take()
+                if course_bucket is not None:
+                    course_bucket.take()
+                self.admitted += 1
+                return 0.0
+
+        # graders and admins are few, a full queue of students never rejects them
+        max_queue = int(limits.get("max_queue", 0))
+        if max_queue and len(self._queue) >= max_queue and not privileged:
+            self.rejected += 1
+            raise AdmissionRejected(
+                f"Too many servers are starting, {len(self._queue)} are waiting. "
+                "Please try again in a few minutes."
+            )
+
+        priority = PRIORITY_PRIVILEGED if privileged else PRIORITY_STUDENT
+        future = asyncio.get_running_loop().create_future()
+        waiter = _Waiter(
+            (priority, next(self._counter)), username, course_id, future, report
+        )
+        self._queue.append(waiter)
+        self._queue.sort(key=lambda queued: queued.key)
+        self.queued += 1
+        self._wake_dispatcher()
+
+        max_wait = float(limits.get("max_wait", 0)) or None
+        started = self.clock()
+        try:
+            await asyncio.wait_for(asyncio.shield(future), max_wait)
+        except asyncio.TimeoutError:
+            if not future.done():
+                self.rejected += 1
+                raise AdmissionRejected(
+                    f"Your server could not start within {max_wait:g} seconds "
+                    "because too many servers are starting. Please try again."
+                )
+        finally:
+            if not future.done():
+                # timed out or the spawn was cancelled while waiting
+                future.cancel()
+                self._remove(waiter)
+        self.admitted += 1
+        return self.clock() - started
+
+    def _remove(self, waiter):
+        if waiter in self._queue:
+            self._queue.remove(waiter)
+            self._report_positions()
+
+    def _report_positions(self):
+        for position, waiter in enumerate(self._queue, 1):
+            if waiter.position != position:
+                waiter.position = position
+                if waiter.report is not None:
+                    try:
+                        waiter.report(position)
+                    except Exception:
+                        pass
+
+    def _wake_dispatcher(self):
+        if self._dispatcher is None or self._dispatcher.done():
+            self._wakeup = asyncio.Event()
+            self._dispatcher = asyncio.ensure_future(self._dispatch())
+        else:
+            self._wakeup.set()
+
+    async def _dispatch(self):
+        """
+        Admit the queued spawns in priority order while there are tokens and
+        sleep until the next token of a blocking bucket otherwise
+        """
+        while self._queue:
+            self._wakeup.clear()
+            global_blocked = False
+            blocked_courses = {}
+            waiting = []
+            for waiter in self._queue:
+                if waiter.future.done():
+                    continue
+                if global_blocked or waiter.course_id in blocked_courses:
+                    waiting.append(waiter)
+                    continue
+                if not self._global.available():
+                    global_blocked = True
+                    waiting.append(waiter)
+                    continue
+                if waiter.course_id is not None:
+                    course_bucket = self._course_bucket(waiter.course_id)
+                    if not course_bucket.available():
+                        blocked_courses[waiter.course_id] = course_bucket
+                        waiting.append(waiter)
+                        continue
+                    course_bucket.take()
+                self._global.take()
+                waiter.future.set_result(None)
+            self._queue = waiting
+            self._report_positions()
+            if not self._queue:
+                break
+
+            if global_blocked:
+                delay = self._global.wait_time()
+            else:
+                delay = min(bucket.wait_time() for bucket in blocked_courses.values())
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), max(delay, 0.001))
+            except asyncio.TimeoutError:
+                pass
@@ -0,0 +1,542 @@
+"""
+Capacity simulator for exam planning. The concurrent pods of the course
+choices are derived from the course catalog, with the resource guarantees and
+node affinity resolved the way the profile list renders them, and bin-packed
+onto the nodes of the given node pools. The report lists the nodes needed per
+pool, their headroom and the course choices that could not be scheduled.
+
+Node pools are described in a yaml file, pools listed first are preferred:
+
+    pools:
+      - name: c4m32
+        labels:
+          e2x.openstack.instance/flavor: c4m32
+          hub.jupyter.org/node-purpose: user
+        cpu: 4            # allocatable cpu of a node
+        memory: 30Gi      # allocatable memory of a node
+        max_pods: 110     # optional, pods per node
+        max_nodes: 20     # optional, nodes of the pool
+        reserved:         # optional, taken by daemonsets on each node
+          cpu: 200m
+          memory: 1Gi
+
+usage:
+    e2xhub-simulate-capacity --config config.yaml --server e2x_exam \\
+        --node-pools pools.yaml --course-id-slug "Demo+student+Demo-SS21"
+"""
+
+import argparse
+import json
+import math
+import re
+
+import yaml
+
+from .image_prepull import node_selector_terms, resolve_course_choices
+from .spawn_planner import PlanningSpawner, load_e2xhub
+from .utils import get_course_config_and_user, load_server_cfg
+
+QUANTITY_SUFFIXES = {
+    "Ki": 2**10,
+    "Mi": 2**20,
+    "Gi": 2**30,
+    "Ti": 2**40,
+    "Pi": 2**50,
+    "Ei": 2**60,
+    "k": 10**3,
+    "M": 10**6,
+    "G": 10**9,
+    "T": 10**12,
+    "P": 10**15,
+    "E": 10**18,
+}
+
+# memory units of the spawner resources, see jupyterhub.traitlets.ByteSpecification
+BYTE_SUFFIXES = {"K": 2**10, "M": 2**20, "G": 2**30, "T": 2**40}
+
+
+def parse_cpu(value):
+    """
+    Parse a cpu amount, e.g. 0.5, "2" or "500m", into millicores
+    args:
+        value: cpu amount
+    """
+    if value is None or value == "":
+        return 0
+    if isinstance(value, str) and value.endswith("m"):
+        return math.ceil(float(value[:-1]))
+    return math.ceil(float(value) * 1000)
+
+
+def parse_quantity(value):
+    """
+    Parse a Kubernetes memory quantity, e.g. "30Gi" or "32G", into bytes
+    args:
+        value: memory quantity
+    """
+    if value is None or value == "":
+        return 0
+    if not isinstance(value, str):
+        return int(value)
+    match = re.fullmatch(r"\s*([0-9.eE+-]+)\s*([A-Za-z]*)\s*", value)
+    if match is None or match.group(2) not in ("", *QUANTITY_SUFFIXES):
+        raise ValueError(f"Invalid quantity {value}")
+    return int(float(match.group(1)) * QUANTITY_SUFFIXES.get(match.group(2), 1))
+
+
+def parse_spawner_bytes(value):
+    """
+    Parse a memory amount of the spawner resources, e.g. "1G" or "0.15G",
+    into bytes. Like KubeSpawner the suffixes K, M, G and T are powers of 1024.
+    args:
+        value: memory amount
+    """
+    if value is None or value == "":
+        return 0
+    if not isinstance(value, str):
+        return int(value)
+    if value[-1] in BYTE_SUFFIXES:
+        return int(float(value[:-1]) * BYTE_SUFFIXES[value[-1]])
+    return int(float(value))
+
+
+def match_expression(labels, expression):
+    """
+    Check whether node labels satisfy a node selector requirement
+    args:
+        labels: dict of node labels
+        expression: dict with key, operator and values
+    """
+    key = expression["key"]
+    operator = expression["operator"]
+    values = [str(value) for value in expression.get("values") or []]
+    if operator == "In":
+        return key in labels and str(labels[key]) in values
+    if operator == "NotIn":
+        return key not in labels or str(labels[key]) not in values
+    if operator == "Exists":
+        return key in labels
+    if operator == "DoesNotExist":
+        return key not in labels
+    if operator in ("Gt", "Lt"):
+        try:
+            label, value = int(labels[key]), int(values[0])
+        except (KeyError, IndexError, ValueError):
+            return False
+        return label > value if operator == "Gt" else label < value
+    raise ValueError(f"Unknown node selector operator {operator}")
+
+
+class NodePool:
+    """
+    Identical nodes with the same labels and allocatable resources
+    """
+
+    def __init__(
+        self,
+        name,
+        labels,
+        cpu,
+        memory,
+        max_pods=110,
+        max_nodes=None,
+        reserved_cpu=0,
+        reserved_memory=0,
+    ):
+        """
+        args:
+            name: name of the pool
+            labels: dict of node labels
+            cpu: allocatable millicores of a node
+            memory: allocatable bytes of a node
+            max_pods: maximum number of pods on a node
+            max_nodes: maximum number of nodes, unlimited if None
+            reserved_cpu: millicores taken by other pods on each node
+            reserved_memory: bytes taken by other pods on each node
+        """
+        self.name = name
+        self.labels = dict(labels)
+        self.cpu = cpu - reserved_cpu
+        self.memory = memory - reserved_memory
+        self.max_pods = max_pods
+        self.max_nodes = max_nodes
+
+    @classmethod
+    def from_dict(cls, pool):
+        """
+        Create the pool from its yaml description, see the module docstring
+        args:
+            pool: dict describing the pool
+        """
+        reserved = pool.get("reserved", {})
+        return cls(
+            pool["name"],
+            pool.get("labels", {}),
+            parse_cpu(pool["cpu"]),
+            parse_quantity(pool["memory"]),
+            max_pods=int(pool.get("max_pods", 110)),
+            max_nodes=int(pool["max_nodes"]) if pool.get("max_nodes") else None,
+            reserved_cpu=parse_cpu(reserved.get("cpu")),
+            reserved_memory=parse_quantity(reserved.get("memory")),
+        )
+
+    def matches(self, terms):
+        """
+        Check whether the nodes satisfy the node selector terms. The terms are
+        ORed and their matchExpressions ANDed, no terms match every node.
+        args:
+            terms: list of node selector terms
+        """
+        if not terms:
+            return True
+        for term in terms:
+            # matchFields select single nodes by name, they can not be planned
+            if term.get("matchFields"):
+                continue
+            if all(
+                match_expression(self.labels, expression)
+                for expression in term.get("matchExpressions") or []
+            ):
+                return True
+        return False
+
+    def pods_per_node(self, cpu, memory):
+        """
+        Number of pods with the given requests fitting on an empty node
+        args:
+            cpu: requested millicores of a pod
+            memory: requested bytes of a pod
+        """
+        fits = self.max_pods
+        if cpu:
+            fits = min(fits, self.cpu // cpu)
+        if memory:
+            fits = min(fits, self.memory // memory)
+        return max(fits, 0)
+
+
+def load_node_pools(pools_file):
+    """
+    Load the node pools from a yaml file, see the module docstring
+    args:
+        pools_file: path to the yaml file
+    """
+    with open(pools_file, "r") as infile:
+        content = yaml.safe_load(infile)
+    return [NodePool.from_dict(pool) for pool in content["pools"]]
+
+
+def expected_pods(
+    e2xhub,
+    server_cfg,
+    course_cfg_list=None,
+    spawner=None,
+    course_id_slugs=None,
+    concurrency=1.0,
+):
+    """
+    Groups of identical pods expected to run at the same time, one group per
+    course choice with the cpu and memory guarantees and the node selector
+    terms of its profile and a pod for the given share of its members
+    args:
+        e2xhub: E2xHub rendering the profiles
+        server_cfg: server configuration
+        course_cfg_list: course config and user list, loaded if None
+        spawner: spawner providing the default resources and node affinity,
+        a PlanningSpawner without defaults if None
+        course_id_slugs: course choices to include, all if None
+        concurrency: share of the members running a pod at the same time
+    """
+    if course_cfg_list is None:
+        course_cfg_list = get_course_config_and_user(
+            server_cfg, catalog=e2xhub.course_catalog
+        )
+    if spawner is None:
+        spawner = PlanningSpawner("", "", log=e2xhub.log)
+    if course_id_slugs is not None:
+        course_id_slugs = set(course_id_slugs)
+
+    groups = []
+    for cname, role, cid, course_id_slug, override in resolve_course_choices(
+        e2xhub, spawner, server_cfg, course_cfg_list
+    ):
+        if course_id_slugs is not None and course_id_slug not in course_id_slugs:
+            continue
+        members = len(course_cfg_list[cname][role][cid]["course_members"])
+        count = math.ceil(members * concurrency)
+        if not count:
+            continue
+        groups.append(
+            {
+                "course_id_slug": course_id_slug,
+                "pods": count,
+                "cpu": parse_cpu(override.get("cpu_guarantee")),
+                "memory": parse_spawner_bytes(override.get("mem_guarantee")),
+                "node_selector_terms": node_selector_terms(
+                    override.get("node_affinity_required")
+                ),
+            }
+        )
+    return groups
+
+
+class _PoolNodes:
+    """
+    Free resources of the nodes opened in a pool. Nodes in the same state are
+    kept as one entry [cpu, memory, pods, count] in the order they were
+    opened, so pods are placed on many identical nodes at once.
+    """
+
+    def __init__(self, pool):
+        self.pool = pool
+        self.states = []
+
+    @property
+    def nodes(self):
+        return sum(state[3] for state in self.states)
+
+    def free(self):
+        """
+        Free millicores, bytes and pods of all nodes
+        """
+        cpu = sum(state[0] * state[3] for state in self.states)
+        memory = sum(state[1] * state[3] for state in self.states)
+        pods = sum(state[2] * state[3] for state in self.states)
+        return cpu, memory, pods
+
+    @staticmethod
+    def _fits(state, cpu, memory):
+        fits = state[2]
+        if cpu:
+            fits = min(fits, state[0] // cpu)
+        if memory:
+            fits = min(fits, state[1] // memory)
+        return max(fits, 0)
+
+    @staticmethod
+    def _fill(state, cpu, memory, pods, count):
+        """
+        States after placing up to pods pods on each of count nodes of state
+        """
+        return [state[0] - cpu * pods, state[1] - memory * pods, state[2] - pods, count]
+
+    def _split(self, state, cpu, memory, fits, remaining):
+        """
+        Place remaining pods on the nodes of state, fits per node, return the
+        states of these nodes afterwards
+        """
+        full, rest = divmod(remaining, fits)
+        states = []
+        if full:
+            states.append(self._fill(state, cpu, memory, fits, full))
+        if rest:
+            states.append(self._fill(state, cpu, memory, rest, 1))
+        if state[3] - full - (1 if rest else 0):
+            states.append(state[:3] + [state[3] - full - (1 if rest else 0)])
+        return states
+
+    def place(self, group, count):
+        """
+        Place up to count pods of the group, first on the opened nodes, then
+        on new nodes. Return the number of pods placed.
+        """
+        cpu, memory = group["cpu"], group["memory"]
+        remaining = count
+        states = []
+        for state in self.states:
+            fits = self._fits(state, cpu, memory) if remaining else 0
+            if not fits:
+                states.append(state)
+            elif remaining >= fits * state[3]:
+                states.append(self._fill(state, cpu, memory, fits, state[3]))
+                remaining -= fits * state[3]
+            else:
+                states.extend(self._split(state, cpu, memory, fits, remaining))
+                remaining = 0
+
+        per_node = self.pool.pods_per_node(cpu, memory)
+        if remaining and per_node:
+            new_nodes = -(-remaining // per_node)
+            if self.pool.max_nodes is not None:
+                new_nodes = min(new_nodes, self.pool.max_nodes - self.nodes)
+            if new_nodes > 0:
+                empty = [self.pool.cpu, self.pool.memory, self.pool.max_pods, new_nodes]
+                placed = min(remaining, new_nodes * per_node)
+                states.extend(self._split(empty, cpu, memory, per_node, placed))
+                remaining -= placed
+
+        # merge nodes that ended up in the same state
+        merged = {}
+        for state in states:
+            key = tuple(state[:3])
+            if key in merged:
+                merged[key][3] += state[3]
+            else:
+                merged[key] = list(state)
+        self.states = list(merged.values())
+        return count - remaining
+
+
+def simulate(pod_groups, node_pools):
+    """
+    Bin-pack the pod groups onto the node pools, first fit decreasing by the
+    pod requests. Pods go to the first matching pool that has room, pools at
+    max_nodes overflow to the next matching pool.
+    Return the report with the nodes, requests and headroom of each pool, the
+    pods placed per course choice and pool, and the unschedulable pods.
+    args:
+        pod_groups: groups of identical pods, see expected_pods
+        node_pools: list of NodePool, in order of preference
+    """
+    nodes = {pool.name: _PoolNodes(pool) for pool in node_pools}
+    placements = {}
+    unschedulable = []
+
+    ordered = sorted(
+        pod_groups, key=lambda group: (group["cpu"], group["memory"]), reverse=True
+    )
+    for group in ordered:
+        course_id_slug = group["course_id_slug"]
+        candidates = [
+            pool for pool in node_pools if pool.matches(group["node_selector_terms"])
+        ]
+        fitting = [
+            pool
+            for pool in candidates
+            if pool.pods_per_node(group["cpu"], group["memory"]) > 0
+        ]
+        remaining = group["pods"]
+        for pool in fitting:
+            placed = nodes[pool.name].place(group, remaining)
+            if placed:
+                pool_placements = placements.setdefault(course_id_slug, {})
+                pool_placements[pool.name] = pool_placements.get(pool.name, 0) + placed
+                remaining -= placed
+            if not remaining:
+                break
+        if remaining:
+            if not candidates:
+                reason = "no node pool matches the node affinity"
+            elif not fitting:
+                reason = "the requests exceed the allocatable resources of a node"
+            else:
+                reason = "the matching node pools are at max_nodes"
+            unschedulable.append(
+                {"course_id_slug": course_id_slug, "pods": remaining, "reason": reason}
+            )
+
+    pools = {}
+    for pool in node_pools:
+        pool_nodes = nodes[pool.name]
+        count = pool_nodes.nodes
+        cpu_total, memory_total = pool.cpu * count, pool.memory * count
+        cpu_free, memory_free, pods_free = pool_nodes.free()
+        pools[pool.name] = {
+            "nodes": count,
+            "pods": pool.max_pods * count - pods_free,
+            "cpu_requested": cpu_total - cpu_free,
+            "cpu_headroom": cpu_free,
+            "memory_requested": memory_total - memory_free,
+            "memory_headroom": memory_free,
+            "cpu_utilization": (cpu_total - cpu_free) / cpu_total if count else 0.0,
+            "memory_utilization": (
+                (memory_total - memory_free) / memory_total if count else 0.0
+            ),
+        }
+    return {
+        "pools": pools,
+        "placements": placements,
+        "unschedulable": unschedulable,
+        "pods": sum(group["pods"] for group in pod_groups),
+    }
+
+
+def format_report(report):
+    """
+    Render the simulation report as text
+    args:
+        report: report from simulate
+    """
+    lines = [f"{report['pods']} pods"]
+    for name, pool in report["pools"].items():
+        lines.append(
+            f"{name}: {pool['nodes']} nodes, {pool['pods']} pods, "
+            f"cpu {pool['cpu_requested'] / 1000:g} requested "
+            f"{pool['cpu_headroom'] / 1000:g} headroom "
+            f"({pool['cpu_utilization']:.0%} used), "
+            f"memory {pool['memory_requested'] / 2**30:.1f}Gi requested "
+            f"{pool['memory_headroom'] / 2**30:.1f}Gi headroom "
+            f"({pool['memory_utilization']:.0%} used)"
+        )
+    for entry in report["unschedulable"]:
+        lines.append(
+            f"unschedulable: {entry['course_id_slug']}, {entry['pods']} pods, "
+            f"{entry['reason']}"
+        )
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Simulate the nodes needed for the pods of the courses"
+    )
+    parser.add_argument("--config", required=True, help="server config.yaml")
+    parser.add_argument("--server", required=True, help="name of the server")
+    parser.add_argument(
+        "--node-pools", required=True, help="yaml file describing the node pools"
+    )
+    parser.add_argument(
+        "--course-id-slug",
+        action="append",
+        default=None,
+        help="simulate the members of the course choice, can be repeated, "
+        "all course choices if not given",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=float,
+        default=1.0,
+        help="share of the members running a pod at the same time",
+    )
+    parser.add_argument(
+        "--e2xhub-config",
+        help="traitlets python config file setting c.E2xHub options",
+    )
+    parser.add_argument(
+        "--default-cpu-guarantee",
+        default=None,
+        help="cpu guarantee of the spawner, used by courses not setting one",
+    )
+    parser.add_argument(
+        "--default-mem-guarantee",
+        default="0",
+        help="memory guarantee of the spawner in bytes or e.g. 1G",
+    )
+    parser.add_argument("--json", action="store_true", help="print the json report")
+    args = parser.parse_args(argv)
+
+    e2xhub = load_e2xhub(args.e2xhub_config)
+    server_cfg = load_server_cfg(args.config, args.server)
+    if server_cfg is None:
+        parser.error(f"server {args.server} not found in {args.config}")
+
+    spawner = PlanningSpawner("", "", log=e2xhub.log)
+    if args.default_cpu_guarantee is not None:
+        spawner.cpu_guarantee = float(args.default_cpu_guarantee)
+    spawner.mem_guarantee = parse_spawner_bytes(args.default_mem_guarantee)
+
+    report = e2xhub.simulate_capacity(
+        server_cfg,
+        load_node_pools(args.node_pools),
+        course_id_slugs=args.course_id_slug,
+        concurrency=args.concurrency,
+        spawner=spawner,
+    )
+    if args.json:
+        print(json.dumps(report, indent=1))
+    else:
+        print(format_report(report))
+
+
+if __name__ == "__main__":
+    main()
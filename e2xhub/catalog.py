@@ -0,0 +1,601 @@
+import asyncio
+import atexit
+import logging
+import os
+import pickle
+import threading
+from functools import partial
+from pathlib import Path
+
+from .__version__ import __version__
+from .filesystem import LOCAL_FILESYSTEM
+from .metrics import timed
+from .utils import (
+    build_member_index,
+    check_consecutive_keys,
+    course_members_by_id,
+    load_usernames,
+    load_yaml,
+    load_yaml_compiled,
+    update_member_index,
+)
+
+log = logging.getLogger(__name__)
+
+
+def file_fingerprint(path, filesystem=None):
+    """
+    Fingerprint of a file used to detect changes without reading it
+    args:
+        path: path to the file
+        filesystem: FileSystem of the file, the local file system if None
+    """
+    stat = (filesystem or LOCAL_FILESYSTEM).stat(path)
+    return (str(path), stat.st_mtime_ns, stat.st_size)
+
+
+class CourseCatalog:
+    """
+    Persistent catalog of the course configs and course members found under
+    nbgrader.course_dir. Each course/role/course_id entry is keyed on the
+    fingerprint (path, mtime, size) of its yaml and csv files, so a scan only
+    re-reads the files that changed since the previous scan and returns the
+    cached structure if nothing changed at all.
+    If compiled_cache_dir is given, course configs are loaded through the
+    compiled json cache so that a cold catalog does not have to parse the yamls.
+    If executor (a concurrent.futures executor) is given, the course directories
+    are scanned concurrently so that a cold scan takes as long as the slowest
+    course instead of the sum of all courses.
+    All file system access goes through filesystem (see e2xhub.filesystem).
+    If roster_store (a RosterStore) is given, course members are stored as
+    compact rosters instead of sets of usernames.
+    If snapshot_file is given, the catalog is restored from it on creation and
+    saved to it in the background snapshot_delay seconds after a scan changed
+    the catalog. After a restart the first scan then only has to compare the
+    fingerprints instead of reading all files.
+    """
+
+    # bumped when the layout of the snapshot changes
+    SNAPSHOT_FORMAT = 1
+
+    def __init__(
+        self,
+        compiled_cache_dir=None,
+        executor=None,
+        filesystem=None,
+        roster_store=None,
+        snapshot_file=None,
+        snapshot_delay=5.0,
+    ):
+        # number of file loads served from / missed by the cache
+        self.hits = 0
+        self.misses = 0
+        # bumped every time the returned structure changes
+        self.version = 0
+
+        self._lock = threading.RLock()
+        # path -> (fingerprint, parsed content)
+        self._files = {}
+        # paths of the files found by the last course scan
+        self._course_files = set()
+        self._course_dir = None
+        self._fingerprints = None
+        self._course_cfg_and_user = {}
+        # member index, the structure it indexes and its course_members_by_id
+        self._member_index = None
+        self._member_index_source = None
+        self._indexed_members = {}
+
+        self.executor = executor
+        self.filesystem = filesystem or LOCAL_FILESYSTEM
+        self._load_course_config = partial(load_yaml, filesystem=self.filesystem)
+        if compiled_cache_dir:
+            self._load_course_config = partial(
+                load_yaml_compiled,
+                cache_dir=compiled_cache_dir,
+                filesystem=self.filesystem,
+            )
+        self.roster_store = roster_store
+        self._load_user_list = partial(load_usernames, filesystem=self.filesystem)
+        self._load_usernames = self._load_user_list
+        if roster_store is not None:
+            self._load_usernames = partial(
+                roster_store.load_roster, filesystem=self.filesystem
+            )
+
+        self.snapshot_file = snapshot_file
+        self.snapshot_delay = snapshot_delay
+        self._snapshot_lock = threading.Lock()
+        self._snapshot_dirty = False
+        self._snapshot_timer = None
+        if snapshot_file:
+            # a pending snapshot is still written when the hub exits
+            atexit.register(self.flush_snapshot)
+            self.load_snapshot(snapshot_file)
+
+    def save_snapshot(self, snapshot_file):
+        """
+        Write the cached files, the last scan and its member index to a local
+        file. The snapshot is a pickle and must be stored where only the hub
+        can write, e.g. on the hub's own volume. The state is captured under the
+        lock, the pickling and writing happen outside of it.
+        args:
+            snapshot_file: path of the snapshot
+        """
+        with self._lock:
+            state = {
+                "format": self.SNAPSHOT_FORMAT,
+                "e2xhub_version": __version__,
+                "roster_store": self.roster_store,
+                "files": dict(self._files),
+                "course_files": set(self._course_files),
+                "course_dir": self._course_dir,
+                "fingerprints": self._fingerprints,
+                "course_cfg_and_user": self._course_cfg_and_user,
+                "member_index": None,
+            }
+        if state["course_cfg_and_user"]:
+            state["member_index"] = self.get_member_index(state["course_cfg_and_user"])
+        data = pickle.dumps(state, protocol=pickle.HIGHEST_PROTOCOL)
+        tmp_file = f"{snapshot_file}.{os.getpid()}.tmp"
+        with open(tmp_file, "wb") as outfile:
+            outfile.write(data)
+        os.replace(tmp_file, snapshot_file)
+
+    def _schedule_snapshot(self):
+        """
+        Write the snapshot snapshot_delay seconds after the first change that
+        is not saved yet, in a timer thread. Changes in between are written
+        together, so a burst of scans writes the snapshot once.
+        """
+        with self._snapshot_lock:
+            self._snapshot_dirty = True
+            if self._snapshot_timer is None:
+                self._snapshot_timer = threading.Timer(
+                    self.snapshot_delay, self.flush_snapshot
+                )
+                self._snapshot_timer.name = "e2xhub-catalog-snapshot"
+                self._snapshot_timer.daemon = True
+                self._snapshot_timer.start()
+
+    def flush_snapshot(self):
+        """
+        Write the snapshot now if the catalog changed since it was last
+        written, e.g. before the hub shuts down. Blocks on the file system.
+        """
+        with self._snapshot_lock:
+            if self._snapshot_timer is not None:
+                self._snapshot_timer.cancel()
+                self._snapshot_timer = None
+            if not self._snapshot_dirty or not self.snapshot_file:
+                return
+            self._snapshot_dirty = False
+        try:
+            self.save_snapshot(self.snapshot_file)
+        except RuntimeError:
+            # a scan changed the rosters while they were pickled, try again later
+            self._schedule_snapshot()
+        except Exception as e:
+            log.warning("Failed to save catalog snapshot %s: %s", self.snapshot_file, e)
+
+    def load_snapshot(self, snapshot_file):
+        """
+        Restore the catalog from a snapshot written by save_snapshot. Nothing
+        is re-read as long as the fingerprints of the files still match, the
+        next scan only compares them. Return True if the snapshot was used.
+        args:
+            snapshot_file: path of the snapshot
+        """
+        try:
+            with open(snapshot_file, "rb") as infile:
+                state = pickle.load(infile)
+        except FileNotFoundError:
+            return False
+        except Exception as e:
+            log.warning("Failed to load catalog snapshot %s: %s", snapshot_file, e)
+            return False
+
+        if (
+            not isinstance(state, dict)
+            or state.get("format") != self.SNAPSHOT_FORMAT
+            or state.get("e2xhub_version") != __version__
+            or (state.get("roster_store") is None) != (self.roster_store is None)
+        ):
+            log.info("Ignoring incompatible catalog snapshot %s", snapshot_file)
+            return False
+
+        with self._lock:
+            if self.roster_store is not None:
+                # the restored rosters refer to the usernames of the snapshot
+                self.roster_store = state["roster_store"]
+                self._load_usernames = partial(
+                    self.roster_store.load_roster, filesystem=self.filesystem
+                )
+            self._files = state["files"]
+            self._course_files = state["course_files"]
+            self._course_dir = state["course_dir"]
+            self._fingerprints = state["fingerprints"]
+            self._course_cfg_and_user = state["course_cfg_and_user"]
+            self._member_index = state["member_index"]
+            self._member_index_source = None
+            self._indexed_members = {}
+            if state["member_index"] is not None:
+                self._member_index_source = self._course_cfg_and_user
+                self._indexed_members = course_members_by_id(self._course_cfg_and_user)
+            self.version += 1
+        return True
+
+    def _load_file(self, path, loader, seen, entry=None):
+        """
+        Load a file through the cache, only calling loader if the file changed
+        args:
+            path: path to the file
+            loader: function parsing the file
+            seen: dict collecting the fingerprints of the current scan
+            entry: directory entry of the file, its stat is reused
+        """
+        key = str(path)
+        if entry is not None:
+            stat = entry.stat()
+            fingerprint = (key, stat.st_mtime_ns, stat.st_size)
+        else:
+            fingerprint = file_fingerprint(path, self.filesystem)
+        seen[key] = fingerprint
+
+        with self._lock:
+            cached = self._files.get(key)
+            if cached is not None and cached[0] == fingerprint:
+                self.hits += 1
+                return cached[1]
+            self.misses += 1
+
+        value = loader(path)
+        with self._lock:
+            self._files[key] = (fingerprint, value)
+        return value
+
+    def load_user_list(self, path, seen=None, entry=None):
+        """
+        Load the set of usernames of a user list csv through the file cache,
+        the same set is returned as long as the file does not change
+        args:
+            path: path to the csv file
+            seen: dict collecting the fingerprints of the loaded files
+            entry: directory entry of the file, its stat is reused
+        """
+        return self._load_file(
+            path, self._load_user_list, {} if seen is None else seen, entry
+        )
+
+    def forget_file(self, path):
+        """
+        Drop a file loaded with load_user_list from the cache
+        args:
+            path: path to the file
+        """
+        with self._lock:
+            if str(path) not in self._course_files:
+                self._files.pop(str(path), None)
+
+    def _list_course_directories(self, course_list_path):
+        """
+        List the course directories under nbgrader.course_dir
+        args:
+            course_list_path: path to nbgrader.course_dir
+        """
+        return [
+            Path(entry.path)
+            for entry in self.filesystem.scandir(course_list_path)
+            if not entry.name.startswith(".") and entry.is_dir()
+        ]
+
+    def _scan_course(self, course_path):
+        """
+        Load the course configs and members of a single course directory.
+        Return the course config (None if the course has no role directory),
+        the fingerprints of the loaded files and the layout of the course.
+        Each directory is listed once, using the file types of the directory
+        entries instead of an extra stat per entry.
+        args:
+            course_path: path to the course directory
+        """
+        seen = {}
+        layout = []
+
+        # loop through grader and student list
+        role_directories = [
+            Path(entry.path)
+            for entry in self.filesystem.scandir(course_path)
+            if not entry.name.startswith(".")
+            and ("grader" in entry.name.lower() or "student" in entry.name.lower())
+            and entry.is_dir()
+        ]
+
+        if not role_directories:
+            return None, seen, layout
+
+        course_cfg = {}
+        layout.append((course_path.name,))
+
+        for role_path in role_directories:
+            config_list_path = []
+            user_list_path = []
+            for entry in self.filesystem.scandir(role_path):
+                name = entry.name.lower()
+                if entry.name.startswith(".") or not entry.is_file():
+                    continue
+                if "yaml" in name or "yml" in name:
+                    config_list_path.append((Path(entry.path), entry))
+                if "csv" in name:
+                    user_list_path.append((Path(entry.path), entry))
+
+            if not config_list_path:
+                continue
+
+            # get users for each course from each semester, the name of user list
+            # file should represent the name of the course id for each semester
+            role_cfg = course_cfg[role_path.name] = {}
+            for cl, cl_entry in config_list_path:
+                course_config = self._load_file(
+                    cl, self._load_course_config, seen, cl_entry
+                )
+                if course_config is None:
+                    course_config = {}
+
+                user_path = [
+                    (ccpath, ccentry)
+                    for ccpath, ccentry in user_list_path
+                    if cl.stem in ccpath.stem
+                ]
+                # prefer <course_id>.csv over other csv files containing the name
+                user_path.sort(key=lambda item: item[0].stem != cl.stem)
+                user_list = set()
+                if self.roster_store is not None:
+                    user_list = self.roster_store.empty
+                if user_path:
+                    user_list = self._load_file(
+                        user_path[0][0], self._load_usernames, seen, user_path[0][1]
+                    )
+                user_path = [ccpath for ccpath, _ in user_path]
+
+                layout.append(
+                    (course_path.name, role_path.name, cl.stem, str(cl))
+                    + tuple(str(path) for path in user_path)
+                )
+                role_cfg[cl.stem] = {
+                    "course_config_path": cl,
+                    "course_config": course_config,
+                    "course_members": user_list,
+                    "course_members_path": user_path,
+                }
+
+        return course_cfg, seen, layout
+
+    def _commit(self, course_list_path, course_directories, results):
+        """
+        Assemble the scanned courses and replace the cached structure if
+        anything changed since the previous scan
+        args:
+            course_list_path: path to nbgrader.course_dir
+            course_directories: scanned course directories
+            results: results of _scan_course for each course directory
+        """
+        seen = {}
+        layout = []
+        course_cfg_and_user = {}
+        for course_path, (course_cfg, course_seen, course_layout) in zip(
+            course_directories, results
+        ):
+            seen.update(course_seen)
+            layout.extend(course_layout)
+            if course_cfg is not None:
+                course_cfg_and_user[course_path.name] = course_cfg
+
+        with self._lock:
+            # forget files that disappeared from the course directory
+            for key in self._course_files - set(seen):
+                self._files.pop(key, None)
+            self._course_files = set(seen)
+
+            fingerprints = (tuple(layout), frozenset(seen.values()))
+            if (
+                self._course_dir == course_list_path
+                and self._fingerprints == fingerprints
+            ):
+                return self._course_cfg_and_user
+
+            self._course_dir = course_list_path
+            self._fingerprints = fingerprints
+            self._course_cfg_and_user = course_cfg_and_user
+            self.version += 1
+
+        if self.snapshot_file:
+            self._schedule_snapshot()
+        return course_cfg_and_user
+
+    def get_course_config_and_user(self, server_cfg):
+        """
+        Get course config and user list, re-reading only the changed files.
+        The returned structure is shared between callers and must not be modified.
+        args:
+            server_cfg: server config dict
+        """
+        if not check_consecutive_keys(server_cfg, "nbgrader", "course_dir"):
+            return {}
+        course_list_path = Path(server_cfg["nbgrader"]["course_dir"])
+
+        course_directories = self._list_course_directories(course_list_path)
+        if self.executor is not None:
+            results = list(self.executor.map(self._scan_course, course_directories))
+        else:
+            results = [self._scan_course(path) for path in course_directories]
+        return self._commit(course_list_path, course_directories, results)
+
+    @timed("async_get_course_config_and_user")
+    async def async_get_course_config_and_user(self, server_cfg, executor=None):
+        """
+        Same as get_course_config_and_user, but the directory listing and
+        each course directory are scanned concurrently in the executor so that
+        the event loop is never blocked by the file system.
+        args:
+            server_cfg: server config dict
+            executor: concurrent.futures executor, the catalog executor or the
+            loop default if None
+        """
+        executor = executor or self.executor
+        if not check_consecutive_keys(server_cfg, "nbgrader", "course_dir"):
+            return {}
+        course_list_path = Path(server_cfg["nbgrader"]["course_dir"])
+
+        loop = asyncio.get_running_loop()
+        course_directories = await loop.run_in_executor(
+            executor, self._list_course_directories, course_list_path
+        )
+        results = await asyncio.gather(
+            *[
+                loop.run_in_executor(executor, self._scan_course, path)
+                for path in course_directories
+            ]
+        )
+        course_cfg_and_user = self._commit(
+            course_list_path, course_directories, results
+        )
+        if self._member_index_source is not course_cfg_and_user:
+            # index a new version here, not in the first profile list rendered
+            # on the event loop
+            await loop.run_in_executor(
+                executor, self.get_member_index, course_cfg_and_user
+            )
+        return course_cfg_and_user
+
+    def get_course(self, server_cfg, course_name, role, course_id):
+        """
+        Load a single course id without scanning nbgrader.course_dir: only
+        <course_name>/<role>/<course_id>.yaml and its csv member list are
+        checked, through the same file cache as the full scan. Return a course
+        config and user list with only this course id, i.e. the structure of
+        get_course_config_and_user, or an empty dict if it does not exist.
+        args:
+            server_cfg: server config dict
+            course_name: name of the course
+            role: role directory, e.g. grader or student
+            course_id: course id, e.g. the semester of the course
+        """
+        if not check_consecutive_keys(server_cfg, "nbgrader", "course_dir"):
+            return {}
+        # the names come from the user options, never leave nbgrader.course_dir
+        for name in (course_name, role, course_id):
+            if not name or name.startswith(".") or "/" in name or "\\" in name:
+                return {}
+        if "grader" not in role.lower() and "student" not in role.lower():
+            return {}
+        role_path = Path(server_cfg["nbgrader"]["course_dir"]) / course_name / role
+
+        seen = {}
+        course_config_path = None
+        for suffix in (".yaml", ".yml"):
+            path = role_path / f"{course_id}{suffix}"
+            try:
+                course_config = self._load_file(path, self._load_course_config, seen)
+            except OSError:
+                self.forget_file(path)
+                continue
+            course_config_path = path
+            break
+        if course_config_path is None:
+            return {}
+
+        user_path = []
+        try:
+            path = role_path / f"{course_id}.csv"
+            course_members = self._load_file(path, self._load_usernames, seen)
+            user_path.append(path)
+        except OSError:
+            self.forget_file(path)
+            # same rule as the full scan: any csv whose name contains the course id
+            entries = self.filesystem.scandir(role_path)
+            for entry in entries:
+                if (
+                    not entry.name.startswith(".")
+                    and "csv" in entry.name.lower()
+                    and course_id in Path(entry.name).stem
+                    and entry.is_file()
+                ):
+                    path = Path(entry.path)
+                    course_members = self._load_file(
+                        path, self._load_usernames, seen, entry
+                    )
+                    user_path.append(path)
+                    break
+            else:
+                course_members = set()
+                if self.roster_store is not None:
+                    course_members = self.roster_store.empty
+
+        return {
+            course_name: {
+                role: {
+                    course_id: {
+                        "course_config_path": course_config_path,
+                        "course_config": course_config or {},
+                        "course_members": course_members,
+                        "course_members_path": user_path,
+                    }
+                }
+            }
+        }
+
+    def get_member_index(self, course_cfg_list):
+        """
+        Get the username -> {(course_name, role, course_id)} index of a structure
+        returned by get_course_config_and_user. The index is shared between
+        callers and built once per catalog version, from the index of the
+        previous version so that only the changed member lists are diffed.
+        args:
+            course_cfg_list: course config and user list
+        """
+        with self._lock:
+            if course_cfg_list is not self._course_cfg_and_user:
+                return build_member_index(course_cfg_list)
+            if self._member_index_source is course_cfg_list:
+                return self._member_index
+            member_index = self._member_index
+            indexed_members = self._indexed_members
+
+        # built outside of the lock, the scans are not blocked meanwhile
+        if member_index is None:
+            member_index = build_member_index(course_cfg_list)
+            indexed_members = course_members_by_id(course_cfg_list)
+        else:
+            member_index, indexed_members = update_member_index(
+                member_index, indexed_members, course_cfg_list
+            )
+        with self._lock:
+            if self._course_cfg_and_user is course_cfg_list:
+                self._member_index = member_index
+                self._member_index_source = course_cfg_list
+                self._indexed_members = indexed_members
+        return member_index
+
+    def get_user_token(self, username, course_cfg_list, member_index):
+        """
+        Token of the courses of a user: the course memberships together with the
+        fingerprints of those course configs. It only changes if the user joins
+        or leaves a course, or the config of one of the user's courses changes.
+        args:
+            username: name of the user
+            course_cfg_list: course config and user list
+            member_index: member index of course_cfg_list
+        """
+        memberships = sorted(member_index.get(username, ()))
+        token = []
+        with self._lock:
+            for cname, role, cid in memberships:
+                course_config_path = course_cfg_list[cname][role][cid][
+                    "course_config_path"
+                ]
+                cached = self._files.get(str(course_config_path))
+                token.append(
+                    ((cname, role, cid), cached[0] if cached is not None else None)
+                )
+        return tuple(token)
@@ -0,0 +1,129 @@
+import logging
+import os
+import threading
+
+from .utils import check_consecutive_keys, load_yaml
+
+log = logging.getLogger(__name__)
+
+
+class ServerConfigStore:
+    """
+    Keep the parsed server config.yaml in memory and only re-parse it when the
+    file changes (inode, mtime or size). If the file is being written or
+    contains invalid yaml, the last good parse keeps being served.
+    Optionally a background thread polls the file so that get() never
+    touches the file system.
+    """
+
+    def __init__(self, config_file):
+        self.config_file = config_file
+        # bumped every time a new config is parsed successfully
+        self.version = 0
+        self.reloads = 0
+        self.errors = 0
+
+        self._lock = threading.Lock()
+        self._configs = None
+        self._fingerprint = None
+        self._watcher = None
+        self._stop_watcher = threading.Event()
+
+    def _file_fingerprint(self):
+        stat = os.stat(self.config_file)
+        return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+    def refresh(self):
+        """
+        Re-parse the config file if it changed since the last parse.
+        Return True if a new config has been loaded.
+        """
+        try:
+            fingerprint = self._file_fingerprint()
+        except OSError:
+            # keep serving the last config if the file is (temporarily) missing
+            return False
+        if fingerprint == self._fingerprint:
+            return False
+
+        with self._lock:
+            if fingerprint == self._fingerprint:
+                return False
+            try:
+                configs = load_yaml(self.config_file)
+                # the file changed while it was parsed, e.g. it is being written
+                if self._file_fingerprint() != fingerprint:
+                    return False
+            except Exception as e:
+                log.warning(
+                    "Failed to load %s, keeping last config: %s", self.config_file, e
+                )
+                self.errors += 1
+                # do not parse the same broken file again
+                self._fingerprint = fingerprint
+                return False
+
+            self._fingerprint = fingerprint
+            if not configs:
+                log.warning("%s is empty, keeping last config", self.config_file)
+                self.errors += 1
+                return False
+
+            self._configs = configs
+            self.reloads += 1
+            self.version += 1
+            return True
+
+    def get(self, server_name):
+        """
+        Get the server config given server_name, same as utils.load_server_cfg
+        args:
+            server_name: name of the server
+        """
+        if not self.watching:
+            self.refresh()
+        configs = self._configs
+        if configs and check_consecutive_keys(configs, "server", server_name):
+            return configs["server"][server_name]
+        return None
+
+    @property
+    def watching(self):
+        return self._watcher is not None and self._watcher.is_alive()
+
+    def _watch(self, interval):
+        while not self._stop_watcher.is_set():
+            try:
+                self.refresh()
+            except Exception as e:
+                log.warning("Failed to refresh %s: %s", self.config_file, e)
+            self._stop_watcher.wait(interval)
+
+    def start_watcher(self, interval=5.0):
+        """
+        Start a daemon thread polling the config file for changes. While it runs,
+        get() only returns the config parsed by the watcher.
+        args:
+            interval: polling interval in seconds
+        """
+        if self.watching:
+            return
+        # parse once before returning so that the first get() has a config
+        self.refresh()
+        self._stop_watcher.clear()
+        self._watcher = threading.Thread(
+            target=self._watch,
+            args=(interval,),
+            name="e2xhub-config-watcher",
+            daemon=True,
+        )
+        self._watcher.start()
+
+    def stop_watcher(self):
+        """
+        Stop the polling thread if it is running
+        """
+        self._stop_watcher.set()
+        if self._watcher is not None:
+            self._watcher.join()
+            self._watcher = None
@@ -0,0 +1,374 @@
+"""
+Deliver the generated per-course post start script through a ConfigMap.
+The script of each course id is rendered once on the hub and stored in a
+content-addressed ConfigMap, which is mounted into the pods so their
+postStart hook only has to run the mounted file.
+"""
+
+import hashlib
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# labels of the ConfigMaps published by the hub, used to find them again
+CONFIG_MAP_LABELS = {
+    "app.kubernetes.io/managed-by": "e2xhub",
+    "app.kubernetes.io/component": "course-config",
+}
+
+
+class InMemoryConfigMapClient:
+    """
+    In-memory stand-in for the Kubernetes ConfigMap API, e.g. for tests
+    """
+
+    def __init__(self, clock=time.time):
+        """
+        args:
+            clock: function returning the creation time of the ConfigMaps
+        """
+        self.clock = clock
+        self.config_maps = {}
+        self.reads = 0
+        self.creates = 0
+        self.lists = 0
+        self.deletes = 0
+
+    def read_config_map(self, name):
+        """
+        Return the data of the ConfigMap or None if it does not exist
+        args:
+            name: name of the ConfigMap
+        """
+        self.reads += 1
+        config_map = self.config_maps.get(name)
+        return dict(config_map["data"]) if config_map is not None else None
+
+    def create_config_map(self, name, data, labels=None):
+        """
+        Create a ConfigMap
+        args:
+            name: name of the ConfigMap
+            data: dict of file name to content
+            labels: labels of the ConfigMap
+        """
+        self.creates += 1
+        self.config_maps[name] = {
+            "data": dict(data),
+            "labels": dict(labels or {}),
+            "created": self.clock(),
+        }
+
+    def list_config_maps(self, labels):
+        """
+        Return (name, creation time) of the ConfigMaps having all labels
+        args:
+            labels: dict of label to value
+        """
+        self.lists += 1
+        return [
+            (name, config_map["created"])
+            for name, config_map in self.config_maps.items()
+            if labels.items() <= config_map["labels"].items()
+        ]
+
+    def delete_config_map(self, name):
+        """
+        Delete the ConfigMap if it exists
+        args:
+            name: name of the ConfigMap
+        """
+        self.deletes += 1
+        self.config_maps.pop(name, None)
+
+
+class KubernetesConfigMapClient:
+    """
+    ConfigMap API of the cluster using the kubernetes python client
+    """
+
+    def __init__(self, namespace, api=None):
+        """
+        args:
+            namespace: namespace of the hub and the user pods
+            api: kubernetes.client.CoreV1Api, created from the in-cluster
+            config if None
+        """
+        self.namespace = namespace
+        if api is None:
+            from kubernetes import client, config
+
+            config.load_incluster_config()
+            api = client.CoreV1Api()
+        self.api = api
+
+    def read_config_map(self, name):
+        from kubernetes.client.rest import ApiException
+
+        try:
+            return self.api.read_namespaced_config_map(name, self.namespace).data
+        except ApiException as e:
+            if e.status == 404:
+                return None
+            raise
+
+    def create_config_map(self, name, data, labels=None):
+        from kubernetes.client import V1ConfigMap, V1ObjectMeta
+        from kubernetes.client.rest import ApiException
+
+        body = V1ConfigMap(
+            metadata=V1ObjectMeta(name=name, labels=labels or {}), data=data
+        )
+        try:
+            self.api.create_namespaced_config_map(self.namespace, body)
+        except ApiException as e:
+            # created concurrently, the content is the same by construction
+            if e.status != 409:
+                raise
+
+    def list_config_maps(self, labels):
+        label_selector = ",".join(f"{key}={value}" for key, value in labels.items())
+        config_maps = self.api.list_namespaced_config_map(
+            self.namespace, label_selector=label_selector
+        )
+        return [
+            (item.metadata.name, item.metadata.creation_timestamp.timestamp())
+            for item in config_maps.items
+        ]
+
+    def delete_config_map(self, name):
+        from kubernetes.client.rest import ApiException
+
+        try:
+            self.api.delete_namespaced_config_map(name, self.namespace)
+        except ApiException as e:
+            if e.status != 404:
+                raise
+
+
+class CourseConfigPublisher:
+    """
+    Publish rendered course config files as content-addressed ConfigMaps.
+    The same content is only published once and shared by all pods using it.
+    The names are computed on the caller, the ConfigMaps are created in the
+    background and wait() blocks until a ConfigMap exists, e.g. in the
+    pre-spawn hook. The published ConfigMaps are labelled, so after a restart
+    they are listed once instead of published again, and the ones no course
+    choice used for max_age seconds are deleted every prune_interval seconds.
+    """
+
+    def __init__(
+        self,
+        client,
+        name_prefix="e2xhub-course-config",
+        executor=None,
+        max_age=86400.0,
+        prune_interval=3600.0,
+        log=None,
+        clock=time.time,
+    ):
+        """
+        args:
+            client: ConfigMap client, e.g. KubernetesConfigMapClient
+            name_prefix: prefix of the ConfigMap names
+            executor: executor calling the client, a single thread of its own
+            if None
+            max_age: seconds after which a ConfigMap no course choice uses is
+            deleted, never if 0
+            prune_interval: seconds between checks for unused ConfigMaps
+            log: logger for errors of the client, the module logger if None
+            clock: function returning the current time in seconds
+        """
+        self.client = client
+        self.name_prefix = name_prefix
+        self.executor = executor
+        self.max_age = max_age
+        self.prune_interval = prune_interval
+        self.log = log or logging.getLogger(__name__)
+        self.clock = clock
+        self.labels = {**CONFIG_MAP_LABELS, "e2xhub/name-prefix": name_prefix}
+
+        self._lock = threading.Lock()
+        self._recovered = False
+        self._published = set()
+        # ConfigMap name -> future of its creation
+        self._pending = {}
+        # ConfigMap name -> data, until the ConfigMap was created
+        self._unpublished = {}
+        # course_id_slug (and username for graders) -> ConfigMap name
+        self._assigned = {}
+        # ConfigMap name -> last time it was assigned
+        self._used = {}
+        self._started = clock()
+        self._last_prune = self._started
+
+    def config_map_name(self, data):
+        """
+        Content-addressed name of the ConfigMap holding data
+        args:
+            data: dict of file name to content
+        """
+        digest = hashlib.sha256()
+        for key in sorted(data):
+            digest.update(key.encode() + b"\0" + data[key].encode() + b"\0")
+        return f"{self.name_prefix}-{digest.hexdigest()[:20]}"
+
+    def _submit(self, function, *args):
+        with self._lock:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(
+                    max_workers=1, thread_name_prefix="e2xhub-course-config"
+                )
+        return self.executor.submit(function, *args)
+
+    def _recover(self):
+        """
+        Mark the ConfigMaps published before a restart of the hub as published
+        """
+        with self._lock:
+            if self._recovered:
+                return
+        names = [name for name, _ in self.client.list_config_maps(self.labels)]
+        with self._lock:
+            self._published.update(names)
+            self._recovered = True
+
+    def _create(self, name, data):
+        try:
+            self._recover()
+            with self._lock:
+                published = name in self._published
+            if not published:
+                self.client.create_config_map(name, data, labels=self.labels)
+            with self._lock:
+                self._published.add(name)
+                self._unpublished.pop(name, None)
+        finally:
+            with self._lock:
+                self._pending.pop(name, None)
+
+    def publish(self, data):
+        """
+        Return the name of the ConfigMap holding data and create it in the
+        background unless it exists
+        args:
+            data: dict of file name to content
+        """
+        name = self.config_map_name(data)
+        with self._lock:
+            if name in self._published or name in self._pending:
+                return name
+            # the future is stored before the task can finish and pop it
+            self._pending[name] = None
+            self._unpublished[name] = data
+        future = self._submit(self._create, name, data)
+        with self._lock:
+            if name in self._pending:
+                self._pending[name] = future
+        self.prune_due()
+        return name
+
+    def pending(self, name):
+        """
+        Future of the creation of the ConfigMap or None if it is not pending
+        args:
+            name: name of the ConfigMap
+        """
+        with self._lock:
+            return self._pending.get(name)
+
+    def wait(self, name, timeout=30.0):
+        """
+        Block until the ConfigMap was created, return whether it exists. If
+        its creation in the background failed, it is created again here.
+        args:
+            name: name of the ConfigMap
+            timeout: seconds to wait at most for the background creation
+        """
+        try:
+            future = self.pending(name)
+            if future is not None:
+                future.result(timeout)
+            with self._lock:
+                data = self._unpublished.get(name)
+            if data is not None:
+                self._create(name, data)
+        except Exception as e:
+            self.log.warning("Failed to publish ConfigMap %s: %s", name, e)
+            return False
+        with self._lock:
+            return name in self._published
+
+    def assign(self, key, name):
+        """
+        Remember the ConfigMap of a course choice
+        args:
+            key: hashable key of the course choice
+            name: name of the ConfigMap
+        """
+        with self._lock:
+            self._assigned[key] = name
+            self._used[name] = self.clock()
+
+    def lookup(self, key):
+        """
+        Get the ConfigMap of a course choice or None
+        args:
+            key: hashable key of the course choice
+        """
+        with self._lock:
+            return self._assigned.get(key)
+
+    def prune(self, max_age=None):
+        """
+        Delete the published ConfigMaps that no course choice used for max_age
+        seconds and return their names. ConfigMaps published before a restart
+        count as used at the restart. Blocks on the client.
+        args:
+            max_age: seconds a ConfigMap is kept unused, the max_age of the
+            publisher if None
+        """
+        max_age = self.max_age if max_age is None else max_age
+        self._recover()
+        now = self.clock()
+        with self._lock:
+            in_use = set(self._assigned.values()) | set(self._pending)
+        deleted = []
+        for name, created in self.client.list_config_maps(self.labels):
+            if name in in_use:
+                continue
+            with self._lock:
+                used = max(self._used.get(name, 0), created, self._started)
+            if now - used < max_age:
+                continue
+            self.client.delete_config_map(name)
+            deleted.append(name)
+        with self._lock:
+            self._published.difference_update(deleted)
+            for name in deleted:
+                self._used.pop(name, None)
+        return deleted
+
+    def _prune(self):
+        try:
+            deleted = self.prune()
+        except Exception as e:
+            self.log.warning("Failed to prune course config ConfigMaps: %s", e)
+            return
+        if deleted:
+            self.log.info("Deleted %s unused course config ConfigMaps", len(deleted))
+
+    def prune_due(self):
+        """
+        Prune the unused ConfigMaps in the background if the last prune was
+        more than prune_interval seconds ago. Return the future or None.
+        """
+        if not self.max_age or not self.prune_interval:
+            return None
+        with self._lock:
+            now = self.clock()
+            if now - self._last_prune < self.prune_interval:
+                return None
+            self._last_prune = now
+        return self._submit(self._prune)
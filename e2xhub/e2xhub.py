@@ -1,9 +1,22 @@
+import asyncio
+import copy
 import os
-from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 
 from .utils import *
-import pandas as pd
-from traitlets import Unicode, List
+from .admission import SpawnAdmissionController
+from .catalog import CourseCatalog
+from .course_configmap import CourseConfigPublisher
+from .filesystem import FileSystem, LOCAL_FILESYSTEM
+from .image_digests import ImageDigestResolver
+from .metrics import disable_timing, enable_timing, timed
+from .profile_cache import ProfileFragmentCache, ProfileListCache
+from .roster import RosterStore
+from .user_directory import UserDirectory
+from .volume_mounts import plan_volume_mounts
+from . import capacity, image_prepull, spawn_planner
+from traitlets import Bool, Float, Instance, Integer, Unicode, List, default, observe
 from traitlets.config import LoggingConfigurable
 
 
@@ -196,100 +209,459 @@ class E2xHub(LoggingConfigurable):
         """,
     ).tag(config=True)
 
+    compiled_config_cache_dir = Unicode(
+        "",
+        help="""
+        Directory on the hub to store the compiled (json) course configs, so the
+        course yamls are only parsed again when their content changes.
+        Disabled if empty
+        """,
+    ).tag(config=True)
+
+    filesystem = Instance(
+        FileSystem,
+        help="""
+        File system backend of the course catalog and the user lists, e.g. a
+        CountingFileSystem to measure the file system calls of each spawn
+        """,
+    )
+
+    @default("filesystem")
+    def _default_filesystem(self):
+        return LOCAL_FILESYSTEM
+
+    course_catalog = Instance(
+        CourseCatalog,
+        help="""
+        Persistent course catalog, course configs and member lists are only
+        re-read from nbgrader.course_dir when they change
+        """,
+    )
+
+    @default("course_catalog")
+    def _default_course_catalog(self):
+        executor = None
+        if self.parallel_scan:
+            # a pool of its own, the catalog is also loaded from the tasks of
+            # the scan executor and must never wait for its own workers
+            executor = ThreadPoolExecutor(
+                max_workers=self.scan_workers, thread_name_prefix="e2xhub-catalog"
+            )
+        return CourseCatalog(
+            compiled_cache_dir=self.compiled_config_cache_dir,
+            executor=executor,
+            filesystem=self.filesystem,
+            roster_store=RosterStore() if self.compact_rosters else None,
+            snapshot_file=self.catalog_snapshot_file or None,
+            snapshot_delay=self.catalog_snapshot_delay,
+        )
+
+    catalog_snapshot_file = Unicode(
+        "",
+        help="""
+        Local file on the hub to persist the course catalog to, so that after a
+        restart the course configs and members are only re-read if they changed.
+        Must not be writable by users. Disabled if empty
+        """,
+    ).tag(config=True)
+
+    catalog_snapshot_delay = Float(
+        5.0,
+        help="""
+        Seconds after a change of the course catalog until the snapshot is
+        written in the background, changes in between are written together
+        """,
+    ).tag(config=True)
+
+    user_list_refresh_interval = Float(
+        0,
+        help="""
+        Seconds between checks of user_list_path for changed user lists,
+        0 to check on every spawn. Unchanged user lists are never re-read
+        """,
+    ).tag(config=True)
+
+    user_directory = Instance(
+        UserDirectory,
+        help="""
+        Cached admin, allowed and blocked users sharing the file cache of the
+        course catalog
+        """,
+    )
+
+    @default("user_directory")
+    def _default_user_directory(self):
+        return UserDirectory(
+            self.course_catalog, refresh_interval=self.user_list_refresh_interval
+        )
+
+    compact_rosters = Bool(
+        False,
+        help="""
+        Store the course members as sorted arrays of interned username ids
+        instead of sets of strings, which saves memory if many students are
+        enrolled in several course ids
+        """,
+    ).tag(config=True)
+
+    scan_workers = Integer(
+        8,
+        help="""
+        Maximum number of threads scanning the course directories and loading
+        the user lists
+        """,
+    ).tag(config=True)
+
+    parallel_scan = Bool(
+        True,
+        help="""
+        Scan the course directories concurrently in a thread pool of the course
+        catalog with scan_workers threads when the catalog is loaded from the
+        sync methods. The async methods scan in the scan executor
+        """,
+    ).tag(config=True)
+
+    scan_executor = Instance(
+        ThreadPoolExecutor,
+        help="""
+        Bounded thread pool used for file system access by the async methods
+        """,
+    )
+
+    @default("scan_executor")
+    def _default_scan_executor(self):
+        return ThreadPoolExecutor(
+            max_workers=self.scan_workers, thread_name_prefix="e2xhub-scan"
+        )
+
+    profile_cache_size = Integer(
+        1024,
+        help="""
+        Maximum number of users whose rendered profile list is cached,
+        0 disables the cache
+        """,
+    ).tag(config=True)
+
+    profile_cache_ttl = Float(
+        300,
+        help="""
+        Seconds after which a cached profile list is rebuilt even if nothing
+        changed, 0 for no limit
+        """,
+    ).tag(config=True)
+
+    profile_cache = Instance(
+        ProfileListCache,
+        help="""
+        Cache of the rendered profile list of each user, see profile_cache.metrics()
+        for the hit rate and memory use
+        """,
+    )
+
+    @default("profile_cache")
+    def _default_profile_cache(self):
+        return ProfileListCache(
+            maxsize=self.profile_cache_size, ttl=self.profile_cache_ttl
+        )
+
+    profile_fragments = Instance(
+        ProfileFragmentCache,
+        args=(),
+        help="""
+        Course and semester profile fragments shared between the users
+        """,
+    )
+
+    timing_enabled = Bool(
+        False,
+        help="""
+        Export the duration of the profile list and spawn operations as the
+        e2xhub_operation_duration_seconds histogram on the hub /metrics endpoint.
+        Requires prometheus_client, use e2xhub.metrics.enable_timing(sink) for
+        other sinks
+        """,
+    ).tag(config=True)
+
+    @observe("timing_enabled")
+    def _timing_enabled_changed(self, change):
+        if change["new"]:
+            enable_timing()
+        else:
+            disable_timing()
+
+    course_config_publisher = Instance(
+        CourseConfigPublisher,
+        allow_none=True,
+        help="""
+        If set, the post start script of each course id is rendered once into a
+        content-addressed ConfigMap mounted into the pods, and the postStart hook
+        only runs the mounted script
+        """,
+    )
+
+    course_config_map_volume_name = Unicode(
+        "e2xhub-course-config",
+        help="""
+        Name of the pod volume holding the course config ConfigMap
+        """,
+    ).tag(config=True)
+
+    course_config_map_mountpath = Unicode(
+        "/etc/e2xhub/course",
+        help="""
+        Mount path of the course config ConfigMap in the user container
+        """,
+    ).tag(config=True)
+
+    admission_controller = Instance(
+        SpawnAdmissionController,
+        args=(),
+        help="""
+        Token bucket admission of the spawns of the async pre-spawn hook, enabled
+        by the admission section of the server config
+        """,
+    )
+
+    image_digest_resolver = Instance(
+        ImageDigestResolver,
+        allow_none=True,
+        help="""
+        If set, the images of the course profiles are pinned to their digests
+        with pullPolicy IfNotPresent, so spawns do not ask the registry for the
+        image tag. The digests are resolved again after the refresh interval
+        of the resolver
+        """,
+    )
+
+    optimize_volume_mounts = Bool(
+        False,
+        help="""
+        Remove duplicate volume mounts and mounts already exposed by a parent
+        mount of the same volume and permission before the pod is created.
+        The generated course mounts have no such mounts, enable it if extra
+        volume mounts of the server config repeat them
+        """,
+    ).tag(config=True)
+
+    spawn_plan_file = Unicode(
+        "",
+        help="""
+        Spawn plans written by e2xhub-plan-spawns, e.g. before an exam starts.
+        The pre-spawn hook applies the plan of the user and selected profile
+        instead of loading the user lists and course catalog. The file is
+        reloaded when it changes. Plans computed with another server config,
+        admin status or course files are ignored. Disabled if empty
+        """,
+    ).tag(config=True)
+
     def __init__(self, **kwargs):
         super(E2xHub, self).__init__(**kwargs)
+        # (username, course_id_slug) -> plan, see spawn_planner
+        self._spawn_plans = {}
+        # (fingerprint of spawn_plan_file, its plans)
+        self._spawn_plan_file_plans = (None, {})
+        # (server config, its fingerprint)
+        self._server_fingerprint = (None, None)
+        self._image_digest_version = None
+
+    def plan_pre_spawn(self, server_cfg, requests, ttl=spawn_planner.DEFAULT_TTL):
+        """
+        Pre-compute the pre-spawn hook of many spawns in one pass, e.g. before
+        an exam starts. The plans are used by configure_pre_spawn_hook.
+        args:
+            server_cfg: server configuration
+            requests: iterable of (username, course_id_slug)
+            ttl: seconds the plans are valid
+        """
+        plans = spawn_planner.plan_pre_spawn(self, server_cfg, requests, ttl=ttl)
+        self._spawn_plans.update(plans)
+        return plans
 
-    def _get_jupyterhub_users(self, server_cfg):
+    def clear_spawn_plans(self):
+        """
+        Drop the plans computed by plan_pre_spawn
+        """
+        self._spawn_plans = {}
+
+    def _load_spawn_plan_file(self):
         """
-        Get JupyterHub users (allowed_users, blocked_users, and admin_users).
-        ToDo: this is a workaround function as it does not work when imported from utils
+        Plans of spawn_plan_file, only re-read when the file changes
+        """
+        fingerprint, plans = self._spawn_plan_file_plans
+        try:
+            stat = os.stat(self.spawn_plan_file)
+            if (stat.st_ino, stat.st_mtime_ns, stat.st_size) != fingerprint:
+                fingerprint = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+                plans = spawn_planner.load_spawn_plans(self.spawn_plan_file)
+                self._spawn_plan_file_plans = (fingerprint, plans)
+        except (OSError, ValueError, KeyError) as e:
+            self.log.warning(
+                "Failed to load spawn plans %s: %s", self.spawn_plan_file, e
+            )
+            self._spawn_plan_file_plans = (None, {})
+            return {}
+        return plans
+
+    def server_fingerprint(self, server_cfg):
+        """
+        Fingerprint of the server config the spawn plans are checked against,
+        only computed once per server config object. ServerConfigStore and
+        utils.load_server_cfg return a new object when config.yaml changes,
+        server configs must not be modified in place.
         args:
             server_cfg: server configuration
         """
-        jupyterhub_users = {"allowed_users": [], "blocked_users": [], "admin_users": []}
-
-        if "user_list_path" not in server_cfg:
-            return jupyterhub_users
-
-        user_list_path = Path(server_cfg["user_list_path"])
-        user_list_file_path = [
-            item
-            for item in user_list_path.iterdir()
-            if item.is_file()
-            and not item.name.startswith(".")
-            and ".csv" in item.name.lower()
-        ]
+        cached_cfg, fingerprint = self._server_fingerprint
+        if cached_cfg is not server_cfg:
+            fingerprint = spawn_planner.server_fingerprint(server_cfg)
+            self._server_fingerprint = (server_cfg, fingerprint)
+        return fingerprint
 
-        for user_file_path in user_list_file_path:
-            df = load_df(user_file_path)
-            if "Username" in df.columns:
-                user_list = list(df.Username.str.strip())
-                if "admin_users" in user_file_path.name.lower():
-                    jupyterhub_users["admin_users"].extend(user_list)
-                elif "allowed_users" in user_file_path.name.lower():
-                    jupyterhub_users["allowed_users"].extend(user_list)
-                elif "blocked_users" in user_file_path.name.lower():
-                    jupyterhub_users["blocked_users"].extend(user_list)
+    def lookup_spawn_plan(self, username, course_id_slug, server_cfg):
+        """
+        Get the valid spawn plan of the user and course choice or None. A plan
+        is only valid if it did not expire and was computed with the current
+        server config, admin status and course files. Stats the plan file and
+        the course files, call it in an executor from the event loop.
+        args:
+            username: name of the user
+            course_id_slug: selected course choice
+            server_cfg: server configuration
+        """
+        key = (username, course_id_slug)
+        plan = self._spawn_plans.get(key)
+        if plan is None and self.spawn_plan_file:
+            plan = self._load_spawn_plan_file().get(key)
+        if plan is None or spawn_planner.is_expired(plan):
+            return None
+        admin_user = self.user_directory.is_admin(server_cfg, username)
+        if not spawn_planner.plan_matches(
+            plan,
+            server_cfg,
+            admin_user,
+            self.filesystem,
+            server_hash=self.server_fingerprint(server_cfg),
+        ):
+            self.log.info("Spawn plan of %s for %s is outdated", username, key[1])
+            return None
+        return plan
+
+    def plan_image_prepull(self, server_cfg, spawner=None, **manifest_options):
+        """
+        Collect the (image, node affinity) pairs of the course choices with
+        their number of users and create DaemonSets pre-pulling the images on
+        the matching nodes. Return (images, manifests), see image_prepull.
+        args:
+            server_cfg: server configuration
+            spawner: spawner providing the default image, resources and node
+            affinity of the profiles
+            manifest_options: options of image_prepull.prepull_manifests,
+            e.g. namespace
+        """
+        return image_prepull.plan_image_prepull(
+            self, server_cfg, spawner=spawner, **manifest_options
+        )
 
-        return jupyterhub_users
+    def simulate_capacity(
+        self,
+        server_cfg,
+        node_pools,
+        course_id_slugs=None,
+        concurrency=1.0,
+        spawner=None,
+    ):
+        """
+        Bin-pack the pods of the course members onto the node pools and report
+        the nodes needed per pool, their headroom and the unschedulable pods,
+        see capacity.simulate
+        args:
+            server_cfg: server configuration
+            node_pools: list of capacity.NodePool, in order of preference
+            course_id_slugs: course choices to include, all if None
+            concurrency: share of the members running a pod at the same time
+            spawner: spawner providing the default resources and node
+            affinity of the profiles
+        """
+        pod_groups = capacity.expected_pods(
+            self,
+            server_cfg,
+            spawner=spawner,
+            course_id_slugs=course_id_slugs,
+            concurrency=concurrency,
+        )
+        return capacity.simulate(pod_groups, node_pools)
+
+    def pin_image(self, image, image_pull_policy):
+        """
+        Pin the image to its digest with the image digest resolver, return
+        the image and pull policy unchanged if there is no resolver
+        args:
+            image: image reference
+            image_pull_policy: pull policy of the image
+        """
+        if self.image_digest_resolver is None:
+            return image, image_pull_policy
+        return self.image_digest_resolver.pin(image, image_pull_policy)
+
+    def refresh_image_digests(self):
+        """
+        Refresh the outdated image digests in the background and drop the
+        cached profiles if a digest changed since they were rendered
+        """
+        resolver = self.image_digest_resolver
+        if resolver is None:
+            return
+        resolver.refresh_due()
+        if resolver.version != self._image_digest_version:
+            self._image_digest_version = resolver.version
+            self.profile_cache.invalidate()
+            self.profile_fragments.invalidate()
+
+    @timed("get_jupyterhub_users")
+    def _get_jupyterhub_users(self, server_cfg):
+        """
+        Get JupyterHub users (allowed_users, blocked_users, and admin_users)
+        as frozensets from the user directory
+        args:
+            server_cfg: server configuration
+        """
+        return self.user_directory.get_users(server_cfg)
 
     def parse_exam_kernel_cfg(self, spawner, exam_kernel_cfg):
         """
-        Parse exam kernel config
+        Parse exam kernel config into a single write to the ipython config
         args:
             spawner: kubespawner object
             exam_kernel_cfg: exam kernel configuration to parse
         """
-        parsed_cfgs = []
         spawner.log.debug("Configuring exam kernel")
-        parsed_cfgs.append(
-            f"echo from textwrap import dedent >> {self.ipython_config_path}"
-        )
-        parsed_cfgs.append(f"echo c = get_config\(\) >> {self.ipython_config_path}")
+        config_lines = ["from textwrap import dedent", "c = get_config()"]
         if "allowed_imports" in exam_kernel_cfg:
             spawner.log.debug("[exam_kernel] adding allowed imports")
-            allowed_imports = exam_kernel_cfg["allowed_imports"]
-            joint_ai = "\["
-            for allowed_import in allowed_imports:
-                joint_ai = joint_ai + "\\'{}\\',".format(allowed_import)
-            joint_ai = (
-                "echo c.ExamKernel.allowed_imports = "
-                + joint_ai
-                + "\]"
-                + f" >> {self.ipython_config_path}"
-            )
-            parsed_cfgs.append(joint_ai)
+            allowed_imports = [str(ai) for ai in exam_kernel_cfg["allowed_imports"]]
+            config_lines.append(f"c.ExamKernel.allowed_imports = {allowed_imports!r}")
 
         if "init_code" in exam_kernel_cfg:
             spawner.log.debug("[exam_kernel] adding init_code")
-            init_code = exam_kernel_cfg["init_code"]
-            joint_ic = "\\'\\'\\'\\\\n"
-            for ic in init_code:
-                joint_ic = joint_ic + "{} \\\\n".format(ic)
-
-            joint_ic = joint_ic + "\\'\\'\\'"
-            joint_ic = (
-                "echo c.ExamKernel.init_code = "
-                + joint_ic
-                + f" >> {self.ipython_config_path}"
-            )
-            parsed_cfgs.append(joint_ic)
+            init_code = "\n"
+            for ic in exam_kernel_cfg["init_code"]:
+                unescaped = strip_legacy_escapes(str(ic))
+                if unescaped != ic:
+                    spawner.log.warning(
+                        "[exam_kernel] init_code %r uses the shell escaping of older "
+                        "versions, use %r instead",
+                        ic,
+                        unescaped,
+                    )
+                init_code += f"{unescaped} \n"
+            config_lines.append(f"c.ExamKernel.init_code = {init_code!r}")
 
         if "allowed_magics" in exam_kernel_cfg:
             spawner.log.debug("[exam_kernel] adding allowed_magics")
-            allowed_magics = exam_kernel_cfg["allowed_magics"]
-            joint_am = "\["
-            for allowed_magic in allowed_magics:
-                joint_am = joint_am + "\\'{}\\',".format(allowed_magic)
-            joint_am = (
-                "echo c.ExamKernel.allowed_magics = "
-                + joint_am
-                + "\]"
-                + f" >> {self.ipython_config_path}"
-            )
-            parsed_cfgs.append(joint_am)
+            allowed_magics = [str(am) for am in exam_kernel_cfg["allowed_magics"]]
+            config_lines.append(f"c.ExamKernel.allowed_magics = {allowed_magics!r}")
 
-        return parsed_cfgs
+        return [ConfigWrite(self.ipython_config_path, config_lines)]
 
     def create_course_profile(self, spawner, server_cfg, course_name, role="student"):
         """
@@ -298,11 +670,13 @@ class E2xHub(LoggingConfigurable):
         args:
             spawner: spawner
             course_name: name of the course
-            role: role of the user e.g. student, grader. This will reflect the course slug
+            role: role of the user e.g. student, grader. This will reflect the
+            course slug
         """
 
         image = server_cfg.get("image", spawner.image)
         image_pull_policy = server_cfg.get("pullPolicy", spawner.image_pull_policy)
+        image, image_pull_policy = self.pin_image(image, image_pull_policy)
 
         if role == "grader":
             user_resources = server_cfg.get("grader_resources", {})
@@ -385,7 +759,8 @@ class E2xHub(LoggingConfigurable):
             course_id: course_id where the config is applied to
             post_start_cmds: spawner post start commands
             cmds: spawner pre stop commands
-            role: role of the user e.g. student, grader. This will reflect the course slug
+            role: role of the user e.g. student, grader. This will reflect the
+            course slug
         """
         verbose_profile_list = course_cfg.get("verbose_profile_list", False)
 
@@ -446,6 +821,9 @@ class E2xHub(LoggingConfigurable):
         if verbose_profile_list:
             course_profile["description"] = course_description
 
+        # the description shows the tag, the override uses the digest
+        image, image_pull_policy = self.pin_image(image, image_pull_policy)
+
         # course slug  must be unique for different role
         # here we use {course_name}+{role}+{course_id} as slug
         # which also correspods to the key in the course config
@@ -473,7 +851,7 @@ class E2xHub(LoggingConfigurable):
                     "image_pull_policy": image_pull_policy,
                     "lifecycle_hooks": {
                         "postStart": {
-                            "exec": {"command": ["/bin/sh", "-c", " && ".join(cmds)]}
+                            "exec": {"command": ["/bin/sh", "-c", join_commands(cmds)]}
                         },
                         # todo: is this needed?
                         "preStop": {
@@ -527,14 +905,14 @@ class E2xHub(LoggingConfigurable):
             extra_commands = server_cfg["commands"]
             for extra_cmd in extra_commands:
                 spawner.log.debug("[Commands] Executing: %s", extra_cmd)
-                cmds.append("{}".format(extra_cmd))
+                cmds.append(parse_echo_command("{}".format(extra_cmd)))
 
         # Configure exam_kernel if config is given
         if check_consecutive_keys(server_cfg, "exam_kernel"):
             cmds.extend(self.parse_exam_kernel_cfg(spawner, server_cfg["exam_kernel"]))
 
         spawner.lifecycle_hooks = {
-            "postStart": {"exec": {"command": ["/bin/sh", "-c", " && ".join(cmds)]}},
+            "postStart": {"exec": {"command": ["/bin/sh", "-c", join_commands(cmds)]}},
             "preStop": {"exec": {"command": ["/bin/sh", "-c", "rm -rf /tmp/*"]}},
         }
 
@@ -544,7 +922,9 @@ class E2xHub(LoggingConfigurable):
                 {
                     "display_name": "Default",
                     "slug": "Default",
-                    "description": "Default notebook server (home directory is not persistent)",
+                    "description": (
+                        "Default notebook server (home directory is not persistent)"
+                    ),
                     "default": True,
                     "kubespawner_override": {
                         "cpu_limit": 2.0,
@@ -575,25 +955,22 @@ class E2xHub(LoggingConfigurable):
         Initialize nbgrader config
         args:
             spawner: kubespawner object
-            nbgrader_cfg: global and default nbgrader config, this is overriden by the course-specific
-            nbgrader config
+            nbgrader_cfg: global and default nbgrader config, this is overriden by the
+            course-specific nbgrader config
             course_cfg: course configuration containing course list with its configs
             course_id: course id e.g. MRC-Teaching-SS23
-            course_id_path: path to the course id root e.g. $HOME/courses/MRC-Teaching/MRC-Teaching-SS23
+            course_id_path: path to the course id root e.g.
+            $HOME/courses/MRC-Teaching/MRC-Teaching-SS23
             cmds: commands executed when the server starts spawning
             sum_cmds: number of commands before nbgrader related commands added
             student: whether the server is configured for students
         """
         # Set course id and course root
-        cmds.append(
-            f"echo 'c.CourseDirectory.course_id = \"{course_id}\"'  >> {self.nbgrader_config_path}"
-        )
-        sum_cmds += 1
+        course_lines = [f"c.CourseDirectory.course_id = {str(course_id)!r}"]
         if not student:
-            cmds.append(
-                f"echo 'c.CourseDirectory.root = \"{course_id_path}\"'  >> {self.nbgrader_config_path}"
-            )
-            sum_cmds += 1
+            course_lines.append(f"c.CourseDirectory.root = {course_id_path!r}")
+        cmds.append(ConfigWrite(self.nbgrader_config_path, course_lines))
+        sum_cmds += 1
 
         # Additional nbgrader commands
         spawner.log.debug("[nbgrader_cmds] looking into default exchange cmds")
@@ -601,7 +978,7 @@ class E2xHub(LoggingConfigurable):
             nbgrader_commands = nbgrader_cfg["nbgrader_cmds"]
             for nbg_cmd in nbgrader_commands:
                 spawner.log.debug("[nbgrader_cmds] executing: %s", nbg_cmd)
-                cmds.append("{}".format(nbg_cmd))
+                cmds.append(parse_echo_command("{}".format(nbg_cmd)))
                 sum_cmds += 1
 
         # Configure exchange if given in nbgrader_cfg
@@ -634,15 +1011,14 @@ class E2xHub(LoggingConfigurable):
         # Add nbgrader exchange config
         if exchange_configured:
             cmds.append(
-                f"echo 'c.Exchange.personalized_outbound = {personalized_outbound}' >> {self.nbgrader_config_path}"
-            )
-            sum_cmds += 1
-            cmds.append(
-                f"echo 'c.Exchange.personalized_inbound = {personalized_inbound}' >> {self.nbgrader_config_path}"
-            )
-            sum_cmds += 1
-            cmds.append(
-                f"echo 'c.Exchange.personalized_feedback = {personalized_feedback}' >> {self.nbgrader_config_path}"
+                ConfigWrite(
+                    self.nbgrader_config_path,
+                    [
+                        f"c.Exchange.personalized_outbound = {personalized_outbound}",
+                        f"c.Exchange.personalized_inbound = {personalized_inbound}",
+                        f"c.Exchange.personalized_feedback = {personalized_feedback}",
+                    ],
+                )
             )
             sum_cmds += 1
 
@@ -666,117 +1042,338 @@ class E2xHub(LoggingConfigurable):
                 len_extra_cmds = len(extra_commands)
                 for extra_cmd in extra_commands:
                     spawner.log.info("[grader cmds] executing: %s", extra_cmd)
-                    cmds.append("{}".format(extra_cmd))
+                    cmds.append(parse_echo_command("{}".format(extra_cmd)))
                     sum_cmds += 1
 
         return cmds, sum_cmds
 
+    def create_semester_fragment(
+        self,
+        spawner,
+        nbgrader_cfg,
+        cmds,
+        course_profile,
+        course_cfg,
+        course_name,
+        course_id,
+        role="student",
+    ):
+        """
+        Create the profile fragment of a course id that is shared by all its
+        members: the semester choice including its post start commands, and the
+        description and display name it sets on the course profile
+        args:
+            spawner: kubespawner object
+            nbgrader_cfg: global and default nbgrader config
+            cmds: commands executed when the server starts spawning
+            course_profile: course profile fragment from create_course_profile
+            course_cfg: configuration of the given course id
+            course_name: name of the course
+            course_id: course id e.g. MRC-Teaching-SS23
+            role: role of the user e.g. student, grader
+        """
+        course_id_path = f"/home/{spawner.user.name}/courses/{course_name}/{course_id}"
+
+        # Add configuration for each course
+        sum_cmds = 0
+        cmds, sum_cmds = self.configure_nbgrader(
+            spawner,
+            nbgrader_cfg,
+            course_cfg,
+            course_id,
+            course_id_path,
+            cmds,
+            sum_cmds,
+            student=False if role == "grader" else True,
+        )
+
+        # course specific commands e.g. enable exam mode for specific course
+        if "course_cmds" in course_cfg:
+            spawner.log.info("[course cmds] looking into course commands")
+            course_commands = course_cfg["course_cmds"]
+            for course_cmd in course_commands:
+                spawner.log.info("[course cmds] executing: %s", course_cmd)
+                cmds.append(parse_echo_command("{}".format(course_cmd)))
+                sum_cmds += 1
+
+        # render the semester into an empty course profile
+        scratch_profile = {
+            "display_name": course_profile["display_name"],
+            "kubespawner_override": course_profile["kubespawner_override"],
+            "profile_options": {"course_id_slug": {"choices": {}}},
+        }
+        self.create_semester_profile(
+            spawner,
+            scratch_profile,
+            course_cfg,
+            course_name,
+            course_id,
+            cmds,
+            role=role,
+        )
+
+        # Clear commands for the current course
+        del cmds[-sum_cmds:]
+
+        semester_fragment = {
+            "choices": scratch_profile["profile_options"]["course_id_slug"]["choices"]
+        }
+        if self.course_config_publisher is not None:
+            self.publish_course_config(spawner, semester_fragment["choices"], role)
+        if "description" in scratch_profile:
+            semester_fragment["description"] = scratch_profile["description"]
+        if "course_display_name" in course_cfg:
+            semester_fragment["display_name"] = scratch_profile["display_name"]
+        return semester_fragment
+
+    def publish_course_config(self, spawner, semester_choices, role="student"):
+        """
+        Move the post start script of the semester choices into a ConfigMap
+        and replace the postStart hook by running the mounted script. The
+        ConfigMap is created in the background, the pre-spawn hook waits for it
+        args:
+            spawner: kubespawner object
+            semester_choices: choices created by create_semester_profile
+            role: role of the user e.g. student, grader
+        """
+        for course_id_slug, choice in semester_choices.items():
+            lifecycle_hooks = choice["kubespawner_override"]["lifecycle_hooks"]
+            post_start_script = lifecycle_hooks["postStart"]["exec"]["command"][-1]
+            config_map_name = self.course_config_publisher.publish(
+                {"post_start.sh": post_start_script}
+            )
+            self.course_config_publisher.assign(
+                (course_id_slug, spawner.user.name if role == "grader" else None),
+                config_map_name,
+            )
+            spawner.log.debug(
+                "[course config] %s uses ConfigMap %s", course_id_slug, config_map_name
+            )
+
+            choice["kubespawner_override"] = {
+                **choice["kubespawner_override"],
+                "lifecycle_hooks": {
+                    **lifecycle_hooks,
+                    "postStart": {
+                        "exec": {
+                            "command": [
+                                "/bin/sh",
+                                f"{self.course_config_map_mountpath}/post_start.sh",
+                            ]
+                        }
+                    },
+                },
+            }
+
+    def course_config_key(self, spawner, selected_profile):
+        """
+        Key the course config ConfigMap of the selected profile is assigned to,
+        grader profiles depend on the username
+        args:
+            spawner: kubespawner object
+            selected_profile: selected course_id_slug
+        """
+        is_grader = "grader" in selected_profile
+        return (selected_profile, spawner.user.name if is_grader else None)
+
+    def prepare_course_config(
+        self, spawner, server_cfg, selected_profile, wait=True, render=True
+    ):
+        """
+        Get the course config ConfigMap of the selected profile and wait until
+        it exists. If the profiles of the user were not rendered since the hub
+        started, they are rendered to publish it. Return the name of the
+        ConfigMap or None. Blocks, call it in an executor from the event loop.
+        args:
+            spawner: kubespawner object
+            server_cfg: server configuration
+            selected_profile: selected course_id_slug
+            wait: wait until the ConfigMap exists
+            render: render the profiles if the ConfigMap was not published,
+            must be False in the scan executor, whose workers may all be
+            waiting for the scans of the course catalog then
+        """
+        key = self.course_config_key(spawner, selected_profile)
+        config_map_name = self.course_config_publisher.lookup(key)
+        if config_map_name is None and render:
+            self.configure_profile_list(spawner, server_cfg)
+            config_map_name = self.course_config_publisher.lookup(key)
+        if config_map_name is None:
+            spawner.log.warning(
+                "[course config] No ConfigMap published for %s", selected_profile
+            )
+            return None
+        if wait and not self.course_config_publisher.wait(config_map_name):
+            # the kubelet retries mounting it until it exists
+            spawner.log.warning(
+                "[course config] ConfigMap %s is not published yet", config_map_name
+            )
+        return config_map_name
+
+    def configure_course_config_volume(
+        self, spawner, server_cfg, selected_profile, wait=True
+    ):
+        """
+        Mount the course config ConfigMap of the selected profile
+        args:
+            spawner: kubespawner object
+            server_cfg: server configuration
+            selected_profile: selected course_id_slug
+            wait: wait until the ConfigMap exists and render the profiles if it
+            was not published, see prepare_course_config. False if the
+            ConfigMap was prepared already, e.g. by the async pre-spawn hook
+        """
+        config_map_name = self.prepare_course_config(
+            spawner, server_cfg, selected_profile, wait=wait, render=wait
+        )
+        if config_map_name is None:
+            return
+
+        # spawner objects are persistent, replace the volume of a previous spawn
+        spawner.volumes = [
+            volume
+            for volume in spawner.volumes
+            if volume.get("name") != self.course_config_map_volume_name
+        ] + [
+            {
+                "name": self.course_config_map_volume_name,
+                "configMap": {"name": config_map_name},
+            }
+        ]
+        spawner.volume_mounts.append(
+            {
+                "name": self.course_config_map_volume_name,
+                "mountPath": self.course_config_map_mountpath,
+                "readOnly": True,
+            }
+        )
+
+    @timed("generate_course_profile")
     def generate_course_profile(
-        self, spawner, server_cfg, nbgrader_cfg, cmds, course_cfg_list, role="student"
+        self,
+        spawner,
+        server_cfg,
+        nbgrader_cfg,
+        cmds,
+        course_cfg_list,
+        role="student",
+        member_index=None,
     ):
         """
         Generate course profile from the given course list and config
         args:
             spawner: kubespawner object
-            nbgrader_cfg: global and default nbgrader config, this is overriden by the course-specific
-            nbgrader config
-            course_cfg_list: course configuration containing course list with its configs
+            nbgrader_cfg: global and default nbgrader config, this is overriden by the
+            course-specific nbgrader config
+            course_cfg_list: course configuration containing course list with its
+            configs
             cmds: commands executed when the server starts spawning
             role: role of the current user e.g. student or grader
+            member_index: username to (course_name, role, course_id) index of
+            course_cfg_list, if given only the courses of the user are visited
         """
-        # keep track of commands for each course
-        sum_cmds = 0
         profile_list = []
         # if no course config, return empty profile
         if not course_cfg_list:
             spawner.log.warning(f"Course config is empty, returning empty profile")
             return profile_list
 
-        for course_name in course_cfg_list.keys():
-            if role not in course_cfg_list[course_name]:
-                spawner.log.warning(
-                    f"Course {course_name} does not have config for role {role}"
-                )
-                continue
-
-            course_profile = self.create_course_profile(
-                spawner, server_cfg, course_name, role
-            )
-
-            is_user_course_member = False
-            for course_id in course_cfg_list[course_name][role].keys():
-                course_members = course_cfg_list[course_name][role][course_id][
-                    "course_members"
+        # shared fragments are rebuilt when the server config or catalog change
+        self.profile_fragments.prepare(server_cfg, course_cfg_list)
+
+        # collect the course ids the user is registered in for the given role
+        user_course_ids = {}
+        if member_index is not None:
+            user_courses = member_index.get(spawner.user.name, ())
+            for course_name in sorted(
+                {cname for cname, crole, _ in user_courses if crole == role}
+            ):
+                # keep the catalog order of the course ids
+                user_course_ids[course_name] = [
+                    course_id
+                    for course_id in course_cfg_list[course_name][role].keys()
+                    if (course_name, role, course_id) in user_courses
                 ]
-                if spawner.user.name in course_members:
-                    course_id_path = (
-                        f"/home/{spawner.user.name}/courses/{course_name}/{course_id}"
+        else:
+            for course_name in course_cfg_list.keys():
+                if role not in course_cfg_list[course_name]:
+                    spawner.log.warning(
+                        f"Course {course_name} does not have config for role {role}"
                     )
-
-                    # Add configuration for each course
-                    curr_course_cfg = course_cfg_list[course_name][role][course_id][
-                        "course_config"
+                    continue
+                for course_id in course_cfg_list[course_name][role].keys():
+                    course_members = course_cfg_list[course_name][role][course_id][
+                        "course_members"
                     ]
-                    cmds, sum_cmds = self.configure_nbgrader(
+                    if spawner.user.name in course_members:
+                        user_course_ids.setdefault(course_name, []).append(course_id)
+
+        # only show profile to members registered in the courses
+        # at least the user exist in one of the choices
+        for course_name, course_ids in user_course_ids.items():
+            # the course profile and the semester choices are shared fragments,
+            # they are deep copied as kubespawner modifies the selected profile
+            # and its kubespawner_override
+            course_fragment = self.profile_fragments.get(
+                (course_name, role),
+                lambda: self.create_course_profile(
+                    spawner, server_cfg, course_name, role
+                ),
+            )
+            course_profile = copy.deepcopy(course_fragment)
+            course_profile["profile_options"] = {
+                "course_id_slug": {"display_name": "Semester", "choices": {}}
+            }
+            semester_choices = course_profile["profile_options"]["course_id_slug"][
+                "choices"
+            ]
+
+            for course_id in course_ids:
+                # the nbgrader course root of graders depends on the username
+                fragment_key = (
+                    course_name,
+                    role,
+                    course_id,
+                    spawner.user.name if role == "grader" else None,
+                )
+                semester_fragment = self.profile_fragments.get(
+                    fragment_key,
+                    lambda: self.create_semester_fragment(
                         spawner,
                         nbgrader_cfg,
-                        curr_course_cfg,
-                        course_id,
-                        course_id_path,
                         cmds,
-                        sum_cmds,
-                        student=False if role == "grader" else True,
-                    )
-
-                    # course specific commands e.g. enable exam mode for specific course
-                    if "course_cmds" in curr_course_cfg:
-                        spawner.log.info("[course cmds] looking into course commands")
-                        course_commands = curr_course_cfg["course_cmds"]
-                        for course_cmd in course_commands:
-                            spawner.log.info("[course cmds] executing: %s", course_cmd)
-                            cmds.append("{}".format(course_cmd))
-                            sum_cmds += 1
-
-                    # update post start commands
-                    post_start_cmds = ["/bin/sh", "-c", " && ".join(cmds)]
-
-                    self.create_semester_profile(
-                        spawner,
-                        course_profile,
-                        curr_course_cfg,
+                        course_fragment,
+                        course_cfg_list[course_name][role][course_id]["course_config"],
                         course_name,
                         course_id,
-                        cmds,
                         role=role,
-                    )
-
-                    # Clear commands for the current course
-                    del cmds[-sum_cmds:]
-                    sum_cmds = 0
-                    is_user_course_member = True
-
-            # only show profile to members registered in the courses
-            # at least the user exist in one of the choices
-            if is_user_course_member:
-                # sort semester choices based on semester
-                semester_choices = course_profile["profile_options"]["course_id_slug"][
-                    "choices"
-                ]
-                sorted_semester_choices = sorted(
-                    semester_choices.items(), key=lambda x: x[1]["display_name"]
-                )
-                course_profile["profile_options"]["course_id_slug"]["choices"] = dict(
-                    sorted_semester_choices
+                    ),
                 )
-                profile_list.append(course_profile)
+
+                for slug, choice in semester_fragment["choices"].items():
+                    semester_choices[slug] = copy.deepcopy(choice)
+                if "description" in semester_fragment:
+                    course_profile["description"] = semester_fragment["description"]
+                if "display_name" in semester_fragment:
+                    course_profile["display_name"] = semester_fragment["display_name"]
+
+            # sort semester choices based on semester
+            sorted_semester_choices = sorted(
+                semester_choices.items(), key=lambda x: x[1]["display_name"]
+            )
+            course_profile["profile_options"]["course_id_slug"]["choices"] = dict(
+                sorted_semester_choices
+            )
+            profile_list.append(course_profile)
 
         # sort profile alphabetically
         profile_list = sorted(profile_list, key=lambda x: x["display_name"])
 
         return profile_list
 
+    @timed("configure_grader_volumes")
     def configure_grader_volumes(
-        self, spawner, server_cfg, course_cfg_list, admin_user=False
+        self, spawner, server_cfg, course_cfg_list, admin_user=False, member_index=None
     ):
         """
         Configure grader volumes
@@ -785,6 +1382,7 @@ class E2xHub(LoggingConfigurable):
           server_cfg: server configuration
           course_cfg_list: course config
           admin_user: whether current user is admin or not
+          member_index: optional username to course index of course_cfg_list
         """
         # check server mode (exam|teaching) otherwise set to teaching
         server_mode = server_cfg.get("mode", "teaching")
@@ -794,10 +1392,11 @@ class E2xHub(LoggingConfigurable):
         username = spawner.user.name
 
         course_cfg = course_cfg_list[course_name]["grader"][course_id]
-        course_members = course_cfg["course_members"]
 
         # mount home dir and the selected course dir if the user is grader
-        if username in course_members:
+        if is_course_member(
+            username, course_cfg_list, course_name, "grader", course_id, member_index
+        ):
             # Load grader course config if given
             grader_course_cfg = course_cfg["course_config"]
 
@@ -868,7 +1467,8 @@ class E2xHub(LoggingConfigurable):
                     "[grader_exchange] Default exchange is not configured"
                 )
 
-            # mount server config to admin users and if it's enabled in the server config
+            # mount server config to admin users and if it's enabled in the server
+            # config
             # this will allow admins to modify config in their notebooks server
             # mount_server_config = server_cfg.get("mount_server_config", False)
             mount_server_config = False
@@ -920,12 +1520,14 @@ class E2xHub(LoggingConfigurable):
             }
 
     # set students volume mount
+    @timed("configure_student_volumes")
     def configure_student_volumes(
         self,
         spawner,
         nbgrader_cfg,
         course_cfg_list,
         server_mode="teaching",
+        member_index=None,
     ):
         """
         Configure volume mounts for the student
@@ -936,15 +1538,17 @@ class E2xHub(LoggingConfigurable):
           server_mode: whether teaching or exam mode, used to differentiate
           home directory location on the nfs server. It's useful when the exam and
           teaching servers are deployed on the same hub.
+          member_index: optional username to course index of course_cfg_list
         """
         selected_profile = spawner.user_options["course_id_slug"]
         course_name, role, course_id = selected_profile.split("+")
         username = spawner.user.name
 
         course_cfg = course_cfg_list[course_name]["student"][course_id]
-        course_members = course_cfg["course_members"]
 
-        if username in course_members:
+        if is_course_member(
+            username, course_cfg_list, course_name, "student", course_id, member_index
+        ):
             # Load grader course config if given
             student_course_cfg = course_cfg["course_config"]
 
@@ -1111,7 +1715,8 @@ class E2xHub(LoggingConfigurable):
             else:
                 spawner.log.warning(
                     "[student][exchange] Default exchange is not configured. "
-                    + "Please configure it either using web-based or file-based exchange"
+                    + "Please configure it either using web-based or "
+                    + "file-based exchange"
                 )
 
             spawner.log.debug(
@@ -1123,6 +1728,7 @@ class E2xHub(LoggingConfigurable):
                 "NB_GID": f"{self.student_gid}",
             }
 
+    @timed("configure_extra_course_volumes")
     def configure_extra_course_volumes(self, spawner, read_only=True):
         """
         Add extra volume mounts for a particular course (selected profile).
@@ -1172,6 +1778,7 @@ class E2xHub(LoggingConfigurable):
                 "consult k8s admin to provide the volume for exchange",
             )
 
+    @timed("set_extra_volume_mounts")
     def set_extra_volume_mounts(self, spawner, vol_mounts, read_only=True):
         """
         Add extra volume mounts
@@ -1194,15 +1801,38 @@ class E2xHub(LoggingConfigurable):
             )
             spawner.volume_mounts.append(extra_vmount)
 
-    def configure_profile_list(self, spawner, server_cfg):
+    @timed("configure_profile_list")
+    def configure_profile_list(self, spawner, server_cfg, course_cfg_list=None):
         """
         Configure profile list given server configuration
         args:
             spawner: kubespawner object
             server_cfg: server configuration
+            course_cfg_list: course config and its members, loaded from the
+            course catalog if not given
         """
         # get course config and its members
-        course_cfg_list = get_course_config_and_user(server_cfg)
+        if course_cfg_list is None:
+            course_cfg_list = get_course_config_and_user(
+                server_cfg, catalog=self.course_catalog
+            )
+
+        member_index = self.course_catalog.get_member_index(course_cfg_list)
+        self.refresh_image_digests()
+
+        # return the cached profile list if neither the server config nor the
+        # courses of the user changed since it was built
+        username = spawner.user.name
+        user_token = self.course_catalog.get_user_token(
+            username, course_cfg_list, member_index
+        )
+        # the cached profiles are deep copied as kubespawner modifies the
+        # selected profile and its kubespawner_override
+        cached = self.profile_cache.get(username, server_cfg, user_token)
+        if cached is not None:
+            profile_list, lifecycle_hooks = cached
+            spawner.lifecycle_hooks = copy.deepcopy(lifecycle_hooks)
+            return copy.deepcopy(profile_list)
 
         nbgrader_cfg = get_nbgrader_cfg(server_cfg)
 
@@ -1211,18 +1841,45 @@ class E2xHub(LoggingConfigurable):
 
         if len(course_cfg_list.keys()) > 0:
             grader_profile_list = self.generate_course_profile(
-                spawner, server_cfg, nbgrader_cfg, cmds, course_cfg_list, role="grader"
+                spawner,
+                server_cfg,
+                nbgrader_cfg,
+                cmds,
+                course_cfg_list,
+                role="grader",
+                member_index=member_index,
             )
             profile_list.extend(grader_profile_list)
 
             student_profile_list = self.generate_course_profile(
-                spawner, server_cfg, nbgrader_cfg, cmds, course_cfg_list, role="student"
+                spawner,
+                server_cfg,
+                nbgrader_cfg,
+                cmds,
+                course_cfg_list,
+                role="student",
+                member_index=member_index,
             )
             profile_list.extend(student_profile_list)
 
-        return profile_list
+        self.profile_cache.put(
+            username,
+            server_cfg,
+            user_token,
+            (profile_list, copy.deepcopy(spawner.lifecycle_hooks)),
+        )
+        return copy.deepcopy(profile_list)
 
-    def configure_pre_spawn_hook(self, spawner, server_cfg):
+    @timed("configure_pre_spawn_hook")
+    def configure_pre_spawn_hook(
+        self,
+        spawner,
+        server_cfg,
+        jupyterhub_users=None,
+        course_cfg_list=None,
+        use_spawn_plan=True,
+        wait_for_course_config=True,
+    ):
         """
         Configure pre spawner hook, and update the spawner.
         Home directories for exam users will be separated by semster_id, and course_id
@@ -1230,20 +1887,47 @@ class E2xHub(LoggingConfigurable):
         args:
             spawner: kubespawner object
             server_cfg: server configuration
+            jupyterhub_users: admin, allowed and blocked users, loaded from
+            user_list_path if not given
+            course_cfg_list: course config and its members, loaded from the
+            course catalog if not given
+            use_spawn_plan: apply the pre-computed plan of the spawn if there is one
+            wait_for_course_config: wait until the course config ConfigMap exists,
+            False if the caller already waited for it
         """
-        # Load JupyterHub users (not necessarily have access to coursess)
-        # any user file name containing "admin" will be grouped as admin_users
-        # allowed_users grouped to allowed_users, as well as blocked_users
-        jupyterhub_users = {"allowed_users": [], "blocked_users": [], "admin_users": []}
-        jupyterhub_users = self._get_jupyterhub_users(server_cfg)
-
-        # get course config and its members
-        course_cfg_list = get_course_config_and_user(server_cfg)
-
         username = str(spawner.user.name)
         selected_profile = spawner.user_options.get("course_id_slug", "Default")
         spawner.log.info("Selected profile %s", selected_profile)
 
+        # use the pre-computed plan of the spawn if there is one
+        plan = None
+        if use_spawn_plan:
+            plan = self.lookup_spawn_plan(username, selected_profile, server_cfg)
+        if plan is not None:
+            spawner.log.info("Using spawn plan of %s", selected_profile)
+            spawn_planner.apply_spawn_plan(spawner, plan)
+            return
+
+        # Check admin status from the JupyterHub users (not necessarily have access
+        # to coursess), any user file name containing "admin" will be grouped as
+        # admin_users, the user lists are only re-read when they change
+        if jupyterhub_users is None:
+            admin_user = self.user_directory.is_admin(server_cfg, username)
+        else:
+            admin_user = username in jupyterhub_users["admin_users"]
+
+        # get course config and members of the selected course only, the other
+        # courses on the hub are not needed to configure the spawn
+        member_index = None
+        if course_cfg_list is None:
+            course_cfg_list = {}
+            if selected_profile.count("+") == 2:
+                course_cfg_list = self.course_catalog.get_course(
+                    server_cfg, *selected_profile.split("+")
+                )
+        else:
+            member_index = self.course_catalog.get_member_index(course_cfg_list)
+
         # clear spawner attributes as Python spawner objects are peristent
         # if not cleared, they may be persistent across restarts, and
         # result in duplicate mounts resulting in failed startup
@@ -1253,8 +1937,6 @@ class E2xHub(LoggingConfigurable):
         server_mode = server_cfg.get("mode", "teaching")
         spawner.log.debug("Server mode: %s", server_mode)
 
-        admin_user = True if username in jupyterhub_users["admin_users"] else False
-
         is_grader = True if "grader" in selected_profile else False
         spawner.log.debug("Grader status for user %s is %s", username, is_grader)
 
@@ -1267,16 +1949,27 @@ class E2xHub(LoggingConfigurable):
                     server_cfg=server_cfg,
                     course_cfg_list=course_cfg_list,
                     admin_user=admin_user,
+                    member_index=member_index,
                 )
 
         # set student volume mounts
         if not is_grader and selected_profile != "Default":
             self.configure_student_volumes(
-                spawner, nbgrader_cfg, course_cfg_list, server_mode=server_mode
+                spawner,
+                nbgrader_cfg,
+                course_cfg_list,
+                server_mode=server_mode,
+                member_index=member_index,
             )
 
         # set additional course and extra volume mounts
         if selected_profile != "Default":
+            # mount the post start script of the course
+            if self.course_config_publisher is not None:
+                self.configure_course_config_volume(
+                    spawner, server_cfg, selected_profile, wait=wait_for_course_config
+                )
+
             # set extra course volume mounts
             read_only = False if is_grader else True
             self.configure_extra_course_volumes(spawner, read_only=read_only)
@@ -1285,4 +1978,146 @@ class E2xHub(LoggingConfigurable):
             if check_consecutive_keys(server_cfg, "extra_mounts", "enabled"):
                 if server_cfg["extra_mounts"]["enabled"]:
                     vol_mounts = server_cfg["extra_mounts"]
-                    self.configure_extra_volumes(spawner, vol_mounts, read_only)
+                    self.set_extra_volume_mounts(spawner, vol_mounts, read_only)
+
+        # drop duplicate and redundant mounts, each one is a bind mount at pod start
+        removed = []
+        if self.optimize_volume_mounts:
+            spawner.volume_mounts, removed = plan_volume_mounts(spawner.volume_mounts)
+        spawner.log.info(
+            "%s volume mounts for %s (%s redundant removed)",
+            len(spawner.volume_mounts),
+            username,
+            len(removed),
+        )
+
+    @timed("async_configure_profile_list")
+    async def async_configure_profile_list(self, spawner, server_cfg):
+        """
+        Async variant of configure_profile_list, the course directories are
+        scanned concurrently in the scan executor instead of on the event loop
+        args:
+            spawner: kubespawner object
+            server_cfg: server configuration
+        """
+        course_cfg_list = await self.course_catalog.async_get_course_config_and_user(
+            server_cfg, executor=self.scan_executor
+        )
+        return self.configure_profile_list(
+            spawner, server_cfg, course_cfg_list=course_cfg_list
+        )
+
+    async def admit_spawn(self, spawner, server_cfg):
+        """
+        Wait until the spawn is admitted by the admission controller if the
+        server config has admission limits. Grader profiles and admins are
+        queued before the students, admins as listed when the user lists were
+        last loaded, so admission does not touch the file system. Raises
+        admission.AdmissionRejected if the queue is full or the spawn waited
+        too long.
+        args:
+            spawner: kubespawner object
+            server_cfg: server configuration
+        """
+        limits = server_cfg.get("admission")
+        if not limits:
+            return
+        self.admission_controller.configure(limits)
+
+        username = str(spawner.user.name)
+        selected_profile = spawner.user_options.get("course_id_slug", "Default")
+        course_id = None
+        privileged = False
+        if selected_profile.count("+") == 2:
+            _, role, course_id = selected_profile.split("+")
+            privileged = role == "grader"
+        if not privileged:
+            # no file access before the spawn is admitted, the admin lists
+            # loaded by previous spawns are good enough to pick the queue
+            admin_users = self.user_directory.cached_users()["admin_users"]
+            privileged = username in admin_users
+
+        def report(position):
+            spawner.log.info(
+                "Spawn of %s (%s) is waiting at queue position %d",
+                username,
+                selected_profile,
+                position,
+            )
+
+        waited = await self.admission_controller.admit(
+            username, course_id=course_id, privileged=privileged, report=report
+        )
+        if waited:
+            spawner.log.info("Spawn of %s admitted after %.1fs", username, waited)
+
+    @timed("async_configure_pre_spawn_hook")
+    async def async_configure_pre_spawn_hook(self, spawner, server_cfg):
+        """
+        Async variant of configure_pre_spawn_hook, the user lists and the
+        selected course are loaded concurrently in the scan executor
+        instead of on the event loop, after the spawn is admitted by
+        admit_spawn
+        args:
+            spawner: kubespawner object
+            server_cfg: server configuration
+        """
+        await self.admit_spawn(spawner, server_cfg)
+
+        username = str(spawner.user.name)
+        selected_profile = spawner.user_options.get("course_id_slug", "Default")
+        loop = asyncio.get_running_loop()
+        if self.spawn_plan_file or self._spawn_plans:
+            plan = await loop.run_in_executor(
+                self.scan_executor,
+                self.lookup_spawn_plan,
+                username,
+                selected_profile,
+                server_cfg,
+            )
+            if plan is not None:
+                # nothing to load, the plan is applied right away
+                spawner.log.info("Using spawn plan of %s", selected_profile)
+                spawn_planner.apply_spawn_plan(spawner, plan)
+                return
+
+        if selected_profile.count("+") == 2:
+            course = loop.run_in_executor(
+                self.scan_executor,
+                self.course_catalog.get_course,
+                server_cfg,
+                *selected_profile.split("+"),
+            )
+        else:
+            course = asyncio.sleep(0, result={})
+        jupyterhub_users, course_cfg_list = await asyncio.gather(
+            loop.run_in_executor(
+                self.scan_executor, self._get_jupyterhub_users, server_cfg
+            ),
+            course,
+        )
+        if self.course_config_publisher is not None and selected_profile != "Default":
+            key = self.course_config_key(spawner, selected_profile)
+            if self.course_config_publisher.lookup(key) is None:
+                # the profiles are rendered here and not in the scan executor,
+                # which the scans of the course catalog run in
+                await self.async_configure_profile_list(spawner, server_cfg)
+            # the ConfigMap is published in the background, wait for it here
+            await loop.run_in_executor(
+                self.scan_executor,
+                partial(
+                    self.prepare_course_config,
+                    spawner,
+                    server_cfg,
+                    selected_profile,
+                    render=False,
+                ),
+            )
+        self.configure_pre_spawn_hook(
+            spawner,
+            server_cfg,
+            jupyterhub_users=jupyterhub_users,
+            course_cfg_list=course_cfg_list,
+            use_spawn_plan=False,
+            wait_for_course_config=False,
+        )
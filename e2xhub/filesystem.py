@@ -0,0 +1,318 @@
+"""
+File system access of the course catalog and the user list loaders.
+Course directories usually live on NFS where every metadata operation is a
+round trip, so all of it goes through one of these backends:
+
+    LocalFileSystem     the real file system
+    MemoryFileSystem    files kept in memory, e.g. for tests
+    CountingFileSystem  wraps another backend, counts the stat, scandir and
+                        open calls and optionally adds a latency to each
+"""
+
+import abc
+import io
+import os
+import posixpath
+import stat as stat_module
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+
+class FileSystem(abc.ABC):
+    """
+    Interface of the file system backends
+    """
+
+    @abc.abstractmethod
+    def scandir(self, path):
+        """
+        List the entries of a directory. The entries have name and path
+        attributes and is_dir(), is_file() and stat() methods like os.DirEntry
+        args:
+            path: path to the directory
+        """
+
+    @abc.abstractmethod
+    def stat(self, path):
+        """
+        Get the stat result (st_ino, st_mode, st_mtime_ns, st_size) of a file
+        args:
+            path: path to the file
+        """
+
+    @abc.abstractmethod
+    def open(self, path, mode="r", encoding=None, newline=None):
+        """
+        Open a file for reading
+        args:
+            path: path to the file
+            mode: "r" or "rb"
+            encoding: text encoding
+            newline: newline mode of text files
+        """
+
+
+class LocalFileSystem(FileSystem):
+    """
+    The real file system
+    """
+
+    def scandir(self, path):
+        with os.scandir(path) as entries:
+            return list(entries)
+
+    def stat(self, path):
+        return os.stat(path)
+
+    def open(self, path, mode="r", encoding=None, newline=None):
+        return open(path, mode, encoding=encoding, newline=newline)
+
+
+LOCAL_FILESYSTEM = LocalFileSystem()
+
+
+class MemoryStat:
+    def __init__(self, st_mode, st_ino, st_size, st_mtime_ns):
+        self.st_mode = st_mode
+        self.st_ino = st_ino
+        self.st_size = st_size
+        self.st_mtime_ns = st_mtime_ns
+        self.st_mtime = st_mtime_ns / 1e9
+
+
+class MemoryDirEntry:
+    def __init__(self, filesystem, path):
+        self._filesystem = filesystem
+        self.path = path
+        self.name = posixpath.basename(path)
+
+    def is_dir(self):
+        return self.path in self._filesystem.directories
+
+    def is_file(self):
+        return self.path in self._filesystem.files
+
+    def stat(self):
+        return self._filesystem.stat(self.path)
+
+    def __fspath__(self):
+        return self.path
+
+
+class MemoryFileSystem(FileSystem):
+    """
+    File system kept in memory. Files are created with write_file, their
+    parent directories are created implicitly. Every write gets a new mtime.
+    """
+
+    def __init__(self, files=None):
+        """
+        args:
+            files: dict of path to str or bytes content
+        """
+        self._lock = threading.Lock()
+        self._clock = 0
+        self._inodes = 0
+        # path -> (content, mtime_ns, inode)
+        self.files = {}
+        self.directories = {"/"}
+        for path, content in (files or {}).items():
+            self.write_file(path, content)
+
+    @staticmethod
+    def _normalize(path):
+        return posixpath.normpath(posixpath.join("/", os.fspath(path)))
+
+    def makedirs(self, path):
+        """
+        Create a directory and its parents
+        args:
+            path: path to the directory
+        """
+        path = self._normalize(path)
+        with self._lock:
+            while path not in self.directories:
+                self.directories.add(path)
+                path = posixpath.dirname(path)
+
+    def write_file(self, path, content):
+        """
+        Create or replace a file
+        args:
+            path: path to the file
+            content: str or bytes content
+        """
+        path = self._normalize(path)
+        if isinstance(content, str):
+            content = content.encode()
+        self.makedirs(posixpath.dirname(path))
+        with self._lock:
+            self._clock += 1
+            inode = self.files[path][2] if path in self.files else None
+            if inode is None:
+                self._inodes += 1
+                inode = self._inodes
+            self.files[path] = (content, self._clock, inode)
+
+    def remove(self, path):
+        """
+        Remove a file or a directory tree
+        args:
+            path: path to the file or directory
+        """
+        path = self._normalize(path)
+        prefix = path.rstrip("/") + "/"
+        with self._lock:
+            self.files.pop(path, None)
+            self.directories.discard(path)
+            for name in [name for name in self.files if name.startswith(prefix)]:
+                del self.files[name]
+            self.directories = {
+                name for name in self.directories if not name.startswith(prefix)
+            }
+
+    def scandir(self, path):
+        path = self._normalize(path)
+        with self._lock:
+            if path not in self.directories:
+                if path in self.files:
+                    raise NotADirectoryError(path)
+                raise FileNotFoundError(path)
+            children = {
+                name
+                for name in list(self.files) + list(self.directories)
+                if name != "/" and posixpath.dirname(name) == path
+            }
+        return [MemoryDirEntry(self, name) for name in sorted(children)]
+
+    def stat(self, path):
+        path = self._normalize(path)
+        with self._lock:
+            if path in self.files:
+                content, mtime_ns, inode = self.files[path]
+                return MemoryStat(
+                    stat_module.S_IFREG | 0o644, inode, len(content), mtime_ns
+                )
+            if path in self.directories:
+                return MemoryStat(stat_module.S_IFDIR | 0o755, 0, 0, 0)
+        raise FileNotFoundError(path)
+
+    def open(self, path, mode="r", encoding=None, newline=None):
+        if mode not in ("r", "rb"):
+            raise ValueError(f"MemoryFileSystem files are read-only, mode {mode}")
+        path = self._normalize(path)
+        with self._lock:
+            if path not in self.files:
+                if path in self.directories:
+                    raise IsADirectoryError(path)
+                raise FileNotFoundError(path)
+            content = self.files[path][0]
+        if mode == "rb":
+            return io.BytesIO(content)
+        return io.TextIOWrapper(
+            io.BytesIO(content), encoding=encoding or "utf-8", newline=newline
+        )
+
+
+class CountingDirEntry:
+    def __init__(self, filesystem, entry):
+        self._filesystem = filesystem
+        self._entry = entry
+        self.name = entry.name
+        self.path = entry.path
+
+    def is_dir(self):
+        return self._entry.is_dir()
+
+    def is_file(self):
+        return self._entry.is_file()
+
+    def stat(self):
+        self._filesystem._count("stat")
+        return self._entry.stat()
+
+    def __fspath__(self):
+        return self.path
+
+
+class CountingFileSystem(FileSystem):
+    """
+    Count the stat, scandir and open calls made through another backend, and
+    optionally simulate a slow (e.g. NFS) file system by sleeping on each call.
+    The is_dir() and is_file() checks of directory entries are not counted, they
+    are answered from the directory listing.
+    """
+
+    OPERATIONS = ("stat", "scandir", "open")
+
+    def __init__(self, filesystem=None, latency=0.0):
+        """
+        args:
+            filesystem: backend to wrap, the local file system if None
+            latency: seconds added to each counted call
+        """
+        self.filesystem = filesystem or LOCAL_FILESYSTEM
+        self.latency = latency
+        self._lock = threading.Lock()
+        self.counts = Counter({operation: 0 for operation in self.OPERATIONS})
+        # label -> Counter of the calls made while measuring the label
+        self.operations = {}
+
+    def _count(self, operation):
+        with self._lock:
+            self.counts[operation] += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def snapshot(self):
+        """
+        Copy of the current call counts
+        """
+        with self._lock:
+            return Counter(self.counts)
+
+    def reset(self):
+        """
+        Reset all call counts
+        """
+        with self._lock:
+            self.counts = Counter({operation: 0 for operation in self.OPERATIONS})
+            self.operations = {}
+
+    @contextmanager
+    def measure(self, label):
+        """
+        Count the calls made within the block under label, e.g.
+
+            with filesystem.measure("pre_spawn") as calls:
+                e2xhub.configure_pre_spawn_hook(spawner, server_cfg)
+            assert calls["stat"] <= 2
+
+        Calls of other threads during the block are counted as well.
+        args:
+            label: name of the measured operation
+        """
+        calls = Counter({operation: 0 for operation in self.OPERATIONS})
+        before = self.snapshot()
+        try:
+            yield calls
+        finally:
+            calls.update(self.snapshot())
+            calls.subtract(before)
+            with self._lock:
+                self.operations.setdefault(label, Counter()).update(calls)
+
+    def scandir(self, path):
+        self._count("scandir")
+        entries = self.filesystem.scandir(path)
+        return [CountingDirEntry(self, entry) for entry in entries]
+
+    def stat(self, path):
+        self._count("stat")
+        return self.filesystem.stat(path)
+
+    def open(self, path, mode="r", encoding=None, newline=None):
+        self._count("open")
+        return self.filesystem.open(path, mode, encoding=encoding, newline=newline)
@@ -0,0 +1,373 @@
+"""
+Pin the images of the generated profiles to their digests. Each image tag is
+resolved to a digest once and re-resolved on a schedule, and the profiles use
+image@sha256:... with pullPolicy IfNotPresent. A new image pushed to a tag is
+still picked up after at most one refresh interval, but the nodes no longer
+ask the registry for the tag on every spawn.
+"""
+
+import base64
+import hashlib
+import json
+import logging
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+DOCKER_HUB_REGISTRY = "registry-1.docker.io"
+
+MANIFEST_MEDIA_TYPES = (
+    "application/vnd.oci.image.index.v1+json",
+    "application/vnd.docker.distribution.manifest.list.v2+json",
+    "application/vnd.oci.image.manifest.v1+json",
+    "application/vnd.docker.distribution.manifest.v2+json",
+)
+
+
+def parse_image(image):
+    """
+    Split an image reference into (registry, repository, tag, digest).
+    Docker Hub images get their registry and library/ prefix, the tag
+    defaults to latest if there is no digest.
+    args:
+        image: image reference e.g. ghcr.io/digiklausur/notebook:latest
+    """
+    name, _, digest = image.partition("@")
+    tag = None
+    last_part = name.rsplit("/", 1)[-1]
+    if ":" in last_part:
+        name, tag = name.rsplit(":", 1)
+    first_part, _, rest = name.partition("/")
+    if rest and ("." in first_part or ":" in first_part or first_part == "localhost"):
+        registry, repository = first_part, rest
+    else:
+        registry, repository = DOCKER_HUB_REGISTRY, name
+        if "/" not in repository:
+            repository = f"library/{repository}"
+    if tag is None and not digest:
+        tag = "latest"
+    return registry, repository, tag, digest or None
+
+
+def pinned_image(image, digest):
+    """
+    Image reference of the digest, without the tag
+    args:
+        image: image reference the digest was resolved for
+        digest: digest e.g. sha256:...
+    """
+    name = image.partition("@")[0]
+    if ":" in name.rsplit("/", 1)[-1]:
+        name = name.rsplit(":", 1)[0]
+    return f"{name}@{digest}"
+
+
+class FakeRegistryClient:
+    """
+    In-memory registry for tests, images are pushed with push()
+    """
+
+    def __init__(self, digests=None):
+        """
+        args:
+            digests: dict of image reference to digest
+        """
+        self.digests = dict(digests or {})
+        self.resolves = 0
+
+    def push(self, image, content=None):
+        """
+        Push new content to the image tag and return its digest
+        args:
+            image: image reference
+            content: content of the image, a new one if None
+        """
+        if content is None:
+            content = f"{image} {len(self.digests)} {time.time()}"
+        digest = "sha256:" + hashlib.sha256(content.encode()).hexdigest()
+        self.digests[image] = digest
+        return digest
+
+    def resolve(self, image):
+        """
+        Return the digest of the image or raise LookupError
+        args:
+            image: image reference
+        """
+        self.resolves += 1
+        try:
+            return self.digests[image]
+        except KeyError:
+            raise LookupError(f"Image {image} not found")
+
+
+class RegistryClient:
+    """
+    Resolve digests with the manifest HEAD request of the registry API (v2).
+    Anonymous bearer tokens are requested if the registry asks for them, or
+    with the given credentials.
+    """
+
+    def __init__(self, credentials=None, timeout=10.0):
+        """
+        args:
+            credentials: dict of registry host to (username, password)
+            timeout: seconds to wait for the registry
+        """
+        self.credentials = credentials or {}
+        self.timeout = timeout
+
+    def _request(self, url, method="GET", headers=None, auth=None):
+        headers = dict(headers or {})
+        if auth is not None:
+            headers["Authorization"] = auth
+        request = urllib.request.Request(url, method=method, headers=headers)
+        return urllib.request.urlopen(request, timeout=self.timeout)
+
+    def _token(self, challenge, registry):
+        scheme, _, params = challenge.partition(" ")
+        if scheme.lower() != "bearer":
+            raise LookupError(f"Unsupported authentication {scheme} of {registry}")
+        fields = {}
+        for param in params.split(","):
+            key, _, value = param.strip().partition("=")
+            fields[key] = value.strip('"')
+        query = {key: fields[key] for key in ("service", "scope") if key in fields}
+        url = f"{fields['realm']}?{urllib.parse.urlencode(query)}"
+
+        auth = None
+        if registry in self.credentials:
+            username, password = self.credentials[registry]
+            basic = base64.b64encode(f"{username}:{password}".encode()).decode()
+            auth = f"Basic {basic}"
+        with self._request(url, auth=auth) as response:
+            content = json.load(response)
+        return content.get("token") or content["access_token"]
+
+    def resolve(self, image):
+        """
+        Return the digest of the image or raise LookupError
+        args:
+            image: image reference
+        """
+        registry, repository, tag, digest = parse_image(image)
+        if digest is not None:
+            return digest
+        url = f"https://{registry}/v2/{repository}/manifests/{tag}"
+        headers = {"Accept": ", ".join(MANIFEST_MEDIA_TYPES)}
+        auth = None
+        for _ in range(2):
+            try:
+                with self._request(url, "HEAD", headers, auth) as response:
+                    digest = response.headers.get("Docker-Content-Digest")
+                    if not digest:
+                        raise LookupError(f"No digest for {image} from {registry}")
+                    return digest
+            except urllib.error.HTTPError as e:
+                challenge = e.headers.get("WWW-Authenticate")
+                if e.code != 401 or auth is not None or not challenge:
+                    raise LookupError(f"Failed to resolve {image}: {e}")
+                auth = f"Bearer {self._token(challenge, registry)}"
+            except urllib.error.URLError as e:
+                raise LookupError(f"Failed to resolve {image}: {e}")
+
+
+class ImageDigestResolver:
+    """
+    Cache of the digests of the image tags. Registry requests never run in the
+    caller: unknown images are resolved in the background on their first use
+    and rendered unpinned until then, known images are re-resolved once they
+    are older than refresh_interval, either by a refresher thread started with
+    start_refresher or in the background when refresh_due is called, e.g. once
+    per profile list. If an image can not be resolved its last digest is kept,
+    or the image stays unpinned if it was never resolved. The version is
+    bumped whenever a digest changes.
+    """
+
+    def __init__(self, client, refresh_interval=300.0, log=None, executor=None):
+        """
+        args:
+            client: registry client, e.g. RegistryClient or FakeRegistryClient
+            refresh_interval: seconds after which a digest is resolved again
+            log: logger for resolution errors, the logger of this module if None
+            executor: executor resolving the digests in the background, a
+            single thread of its own if None
+        """
+        self.client = client
+        self.refresh_interval = refresh_interval
+        self.log = log or logging.getLogger(__name__)
+        self.executor = executor
+        # bumped every time a digest changes
+        self.version = 0
+        self.resolves = 0
+        self.failures = 0
+
+        self._lock = threading.Lock()
+        # image -> (digest, time of the last resolution attempt)
+        self._digests = {}
+        self._pinned = set()
+        # images submitted to the executor and not resolved yet
+        self._pending = set()
+        self._refresher = None
+        self._stop_refresher = threading.Event()
+
+    def _resolve(self, image):
+        """
+        Resolve the image and store its digest, return whether it changed
+        args:
+            image: image reference
+        """
+        old_digest = self._digests.get(image, (None, None))[0]
+        try:
+            self.resolves += 1
+            digest = self.client.resolve(image)
+        except Exception as e:
+            self.failures += 1
+            self.log.warning("Failed to resolve the digest of %s: %s", image, e)
+            digest = old_digest
+        with self._lock:
+            self._digests[image] = (digest, time.monotonic())
+            if digest is not None:
+                self._pinned.add(pinned_image(image, digest))
+            if digest != old_digest:
+                self.version += 1
+                return True
+        return False
+
+    def _resolve_pending(self, images):
+        try:
+            for image in images:
+                self._resolve(image)
+        finally:
+            with self._lock:
+                self._pending.difference_update(images)
+
+    def _submit(self, images):
+        """
+        Resolve the images in the executor unless they are already pending.
+        Return the future or None if there was nothing to resolve.
+        args:
+            images: image references
+        """
+        with self._lock:
+            images = [image for image in images if image not in self._pending]
+            if not images:
+                return None
+            self._pending.update(images)
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(
+                    max_workers=1, thread_name_prefix="e2xhub-image-digests"
+                )
+        return self.executor.submit(self._resolve_pending, images)
+
+    def resolve(self, images):
+        """
+        Resolve the images right away, e.g. before the hub serves spawns.
+        Return whether any digest changed.
+        args:
+            images: image references
+        """
+        changed = False
+        for image in images:
+            changed |= self._resolve(image)
+        return changed
+
+    def digest(self, image):
+        """
+        Cached digest of the image, None if it was not resolved (yet)
+        args:
+            image: image reference
+        """
+        return self._digests.get(image, (None, None))[0]
+
+    def pin(self, image, image_pull_policy):
+        """
+        Return the image pinned to its digest with IfNotPresent, or the image
+        and pull policy unchanged if the image is no tag reference (e.g. a
+        dict) or is not resolved yet. Unknown images are resolved in the
+        background.
+        args:
+            image: image reference
+            image_pull_policy: pull policy of the image
+        """
+        if not image or not isinstance(image, str):
+            return image, image_pull_policy
+        if image in self._pinned:
+            return image, "IfNotPresent"
+        if "@" in image:
+            return image, image_pull_policy
+        if image not in self._digests:
+            self._submit([image])
+            return image, image_pull_policy
+        digest = self.digest(image)
+        if digest is None:
+            return image, image_pull_policy
+        return pinned_image(image, digest), "IfNotPresent"
+
+    def _stale_images(self, force=False):
+        now = time.monotonic()
+        with self._lock:
+            return [
+                image
+                for image, (_, resolved) in self._digests.items()
+                if force or now - resolved >= self.refresh_interval
+            ]
+
+    def refresh(self, force=False):
+        """
+        Resolve the images whose digest is older than refresh_interval again,
+        in the caller. Return whether any digest changed.
+        args:
+            force: resolve all images
+        """
+        return self.resolve(self._stale_images(force))
+
+    def refresh_due(self):
+        """
+        Refresh the outdated digests in the background unless the refresher
+        thread does it. Return the future of the refresh or None.
+        """
+        if self.refreshing:
+            return None
+        images = self._stale_images()
+        return self._submit(images) if images else None
+
+    @property
+    def refreshing(self):
+        return self._refresher is not None and self._refresher.is_alive()
+
+    def _refresh_loop(self, interval):
+        while not self._stop_refresher.wait(interval):
+            try:
+                self.refresh()
+            except Exception as e:
+                self.log.warning("Failed to refresh image digests: %s", e)
+
+    def start_refresher(self, interval=None):
+        """
+        Start a daemon thread refreshing the digests periodically
+        args:
+            interval: seconds between refreshes, refresh_interval if None
+        """
+        if self.refreshing:
+            return
+        self._stop_refresher.clear()
+        self._refresher = threading.Thread(
+            target=self._refresh_loop,
+            args=(interval or self.refresh_interval,),
+            name="e2xhub-image-digests",
+            daemon=True,
+        )
+        self._refresher.start()
+
+    def stop_refresher(self):
+        """
+        Stop the refresher thread if it is running
+        """
+        self._stop_refresher.set()
+        if self._refresher is not None:
+            self._refresher.join()
+            self._refresher = None
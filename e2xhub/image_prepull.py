@@ -0,0 +1,359 @@
+"""
+Image pre-pull planner. The images of all course choices are resolved the way
+the profile list renders them, grouped by the node affinity their pods are
+scheduled with, and turned into continuous-image-puller style DaemonSets, so
+every node an exam pod may land on already has its image before the exam.
+
+usage:
+    e2xhub-plan-image-prepull --config config.yaml --server e2x_exam \\
+        --namespace jhub --output prepull.yaml
+"""
+
+import argparse
+import hashlib
+import json
+import sys
+
+import yaml
+
+from .roster import union_members
+from .spawn_planner import PlanningSpawner, load_e2xhub
+from .utils import get_course_config_and_user, load_server_cfg
+
+PAUSE_IMAGE = "registry.k8s.io/pause:3.9"
+
+# tolerations of the user pods of zero-to-jupyterhub
+DEFAULT_TOLERATIONS = [
+    {
+        "key": "hub.jupyter.org/dedicated",
+        "operator": "Equal",
+        "value": "user",
+        "effect": "NoSchedule",
+    },
+    {
+        "key": "hub.jupyter.org_dedicated",
+        "operator": "Equal",
+        "value": "user",
+        "effect": "NoSchedule",
+    },
+]
+
+
+def node_selector_terms(node_affinity_required):
+    """
+    Non-empty node selector terms of a node_affinity_required override. The
+    profiles may nest the terms in a list, e.g. [[]] if no affinity is set.
+    args:
+        node_affinity_required: list of node selector terms
+    """
+    terms = []
+    for term in node_affinity_required or []:
+        if isinstance(term, list):
+            terms.extend(node_selector_terms(term))
+        elif term:
+            terms.append(term)
+    return terms
+
+
+def image_reference(image):
+    """
+    Image reference of an image override. An image given as a dict of name and
+    tag, the format of the image of the server config, is joined to name:tag.
+    Return None if there is no image name.
+    args:
+        image: image reference or dict with name, tag and pullPolicy
+    """
+    if isinstance(image, dict):
+        name, tag = image.get("name"), image.get("tag")
+        if not name:
+            return None
+        return f"{name}:{tag}" if tag else name
+    return image or None
+
+
+def resolve_course_choices(e2xhub, spawner, server_cfg, course_cfg_list):
+    """
+    Yield the effective kubespawner override of every course choice, i.e. the
+    course profile override updated with the semester choice override, as
+    (course_name, role, course_id, course_id_slug, override)
+    args:
+        e2xhub: E2xHub rendering the profiles
+        spawner: spawner providing the defaults, e.g. image and resources
+        server_cfg: server configuration
+        course_cfg_list: course config and user list
+    """
+    for course_name in course_cfg_list.keys():
+        for role in course_cfg_list[course_name].keys():
+            course_profile = e2xhub.create_course_profile(
+                spawner, server_cfg, course_name, role
+            )
+            for course_id, course_cfg in course_cfg_list[course_name][role].items():
+                scratch_profile = {
+                    "display_name": course_profile["display_name"],
+                    "kubespawner_override": course_profile["kubespawner_override"],
+                    "profile_options": {"course_id_slug": {"choices": {}}},
+                }
+                e2xhub.create_semester_profile(
+                    spawner,
+                    scratch_profile,
+                    course_cfg["course_config"],
+                    course_name,
+                    course_id,
+                    [],
+                    role=role,
+                )
+                choices = scratch_profile["profile_options"]["course_id_slug"]
+                for course_id_slug, choice in choices["choices"].items():
+                    override = dict(course_profile["kubespawner_override"])
+                    override.update(choice["kubespawner_override"])
+                    yield course_name, role, course_id, course_id_slug, override
+
+
+def collect_course_images(e2xhub, server_cfg, course_cfg_list=None, spawner=None):
+    """
+    Collect the (image, node affinity) pairs used by the course choices with
+    their members. Return a list of dicts with the image, the pull policies,
+    the node selector terms, the course choices and their roster sizes, and
+    the number of distinct users, sorted by the number of users.
+    args:
+        e2xhub: E2xHub rendering the profiles
+        server_cfg: server configuration
+        course_cfg_list: course config and user list, loaded if None
+        spawner: spawner providing the default image, resources and node
+        affinity, a PlanningSpawner without defaults if None
+    """
+    if course_cfg_list is None:
+        course_cfg_list = get_course_config_and_user(
+            server_cfg, catalog=e2xhub.course_catalog
+        )
+    if spawner is None:
+        spawner = PlanningSpawner("", "", log=e2xhub.log)
+
+    pairs = {}
+    for cname, role, cid, course_id_slug, override in resolve_course_choices(
+        e2xhub, spawner, server_cfg, course_cfg_list
+    ):
+        image = image_reference(override.get("image"))
+        if image is None:
+            e2xhub.log.warning("No image set for %s, skipping it", course_id_slug)
+            continue
+        image_pull_policy = override.get("image_pull_policy")
+        if isinstance(override["image"], dict):
+            image_pull_policy = override["image"].get("pullPolicy", image_pull_policy)
+        terms = node_selector_terms(override.get("node_affinity_required"))
+        key = (image, json.dumps(terms, sort_keys=True))
+        pair = pairs.setdefault(
+            key,
+            {
+                "image": image,
+                "image_pull_policies": set(),
+                "node_selector_terms": terms,
+                "courses": {},
+                "members": [],
+            },
+        )
+        members = course_cfg_list[cname][role][cid]["course_members"]
+        pair["image_pull_policies"].add(image_pull_policy)
+        pair["courses"][course_id_slug] = len(members)
+        pair["members"].append(members)
+
+    images = []
+    for pair in pairs.values():
+        members = pair.pop("members")
+        pair["users"] = len(union_members(members))
+        pair["image_pull_policies"] = sorted(
+            policy for policy in pair["image_pull_policies"] if policy
+        )
+        images.append(pair)
+    return sorted(images, key=lambda pair: (-pair["users"], pair["image"]))
+
+
+def prepull_manifests(
+    images,
+    namespace=None,
+    name_prefix="e2xhub-prepull",
+    pause_image=PAUSE_IMAGE,
+    tolerations=None,
+):
+    """
+    Create one DaemonSet per node affinity pulling all images scheduled with
+    it in init containers, images with the most users first. The pods are
+    placed on the nodes matching the affinity and then idle in a pause
+    container. Images of courses with pullPolicy Always are pulled with
+    Always, so the nodes get the current image of the tag.
+    args:
+        images: image pairs from collect_course_images
+        namespace: namespace of the DaemonSets, omitted if None
+        name_prefix: prefix of the DaemonSet names
+        pause_image: image of the idle container
+        tolerations: tolerations of the pods, the ones of the user pods of
+        zero-to-jupyterhub if None
+    """
+    if tolerations is None:
+        tolerations = DEFAULT_TOLERATIONS
+
+    groups = {}
+    for pair in images:
+        affinity_key = json.dumps(pair["node_selector_terms"], sort_keys=True)
+        group = groups.setdefault(
+            affinity_key,
+            {"node_selector_terms": pair["node_selector_terms"], "images": {}},
+        )
+        entry = group["images"].setdefault(
+            pair["image"], {"users": 0, "always": False, "courses": {}}
+        )
+        entry["users"] += pair["users"]
+        entry["always"] |= "Always" in pair["image_pull_policies"]
+        entry["courses"].update(pair["courses"])
+
+    manifests = []
+    for affinity_key, group in groups.items():
+        group_id = hashlib.sha1(affinity_key.encode()).hexdigest()[:10]
+        name = f"{name_prefix}-{group_id}"
+        labels = {
+            "app": "e2xhub",
+            "component": "image-prepuller",
+            "e2xhub/prepull-group": group_id,
+        }
+        group_images = sorted(
+            group["images"].items(), key=lambda item: (-item[1]["users"], item[0])
+        )
+        init_containers = [
+            {
+                "name": f"image-pull-{index}",
+                "image": image,
+                "imagePullPolicy": "Always" if entry["always"] else "IfNotPresent",
+                "command": ["/bin/sh", "-c", "echo Pulling complete"],
+                "resources": {"requests": {"cpu": "0", "memory": "0"}},
+            }
+            for index, (image, entry) in enumerate(group_images)
+        ]
+        pod_spec = {
+            "tolerations": tolerations,
+            "terminationGracePeriodSeconds": 0,
+            "automountServiceAccountToken": False,
+            "initContainers": init_containers,
+            "containers": [
+                {
+                    "name": "pause",
+                    "image": pause_image,
+                    "resources": {"requests": {"cpu": "0", "memory": "0"}},
+                }
+            ],
+        }
+        if group["node_selector_terms"]:
+            pod_spec["affinity"] = {
+                "nodeAffinity": {
+                    "requiredDuringSchedulingIgnoredDuringExecution": {
+                        "nodeSelectorTerms": group["node_selector_terms"]
+                    }
+                }
+            }
+        metadata = {
+            "name": name,
+            "labels": dict(labels),
+            "annotations": {
+                "e2xhub/images": json.dumps(
+                    {
+                        image: {"users": entry["users"], "courses": entry["courses"]}
+                        for image, entry in group_images
+                    },
+                    sort_keys=True,
+                ),
+            },
+        }
+        if namespace:
+            metadata["namespace"] = namespace
+        manifests.append(
+            {
+                "apiVersion": "apps/v1",
+                "kind": "DaemonSet",
+                "metadata": metadata,
+                "spec": {
+                    "selector": {"matchLabels": dict(labels)},
+                    "updateStrategy": {
+                        "type": "RollingUpdate",
+                        "rollingUpdate": {"maxUnavailable": "100%"},
+                    },
+                    "template": {"metadata": {"labels": labels}, "spec": pod_spec},
+                },
+            }
+        )
+    return manifests
+
+
+def plan_image_prepull(
+    e2xhub, server_cfg, course_cfg_list=None, spawner=None, **manifest_options
+):
+    """
+    Collect the course images and create their pre-pull DaemonSets.
+    Return (images, manifests).
+    args:
+        e2xhub: E2xHub rendering the profiles
+        server_cfg: server configuration
+        course_cfg_list: course config and user list, loaded if None
+        spawner: spawner providing the defaults, see collect_course_images
+        manifest_options: options of prepull_manifests
+    """
+    images = collect_course_images(
+        e2xhub, server_cfg, course_cfg_list=course_cfg_list, spawner=spawner
+    )
+    return images, prepull_manifests(images, **manifest_options)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Create DaemonSets pre-pulling the images of the courses"
+    )
+    parser.add_argument("--config", required=True, help="server config.yaml")
+    parser.add_argument("--server", required=True, help="name of the server")
+    parser.add_argument(
+        "--e2xhub-config",
+        help="traitlets python config file setting c.E2xHub options",
+    )
+    parser.add_argument(
+        "--default-image",
+        default="",
+        help="image of the spawner, used by courses not setting an image",
+    )
+    parser.add_argument("--namespace", help="namespace of the DaemonSets")
+    parser.add_argument("--name-prefix", default="e2xhub-prepull")
+    parser.add_argument("--pause-image", default=PAUSE_IMAGE)
+    parser.add_argument("--output", help="yaml file to write, stdout if not given")
+    args = parser.parse_args(argv)
+
+    e2xhub = load_e2xhub(args.e2xhub_config)
+    server_cfg = load_server_cfg(args.config, args.server)
+    if server_cfg is None:
+        parser.error(f"server {args.server} not found in {args.config}")
+
+    spawner = PlanningSpawner("", "", log=e2xhub.log)
+    spawner.image = args.default_image
+    images, manifests = plan_image_prepull(
+        e2xhub,
+        server_cfg,
+        spawner=spawner,
+        namespace=args.namespace,
+        name_prefix=args.name_prefix,
+        pause_image=args.pause_image,
+    )
+
+    content = yaml.safe_dump_all(manifests, sort_keys=False)
+    if args.output:
+        with open(args.output, "w") as outfile:
+            outfile.write(content)
+    else:
+        print(content, end="")
+
+    # the summary goes to stderr so the manifests can be piped to kubectl
+    for pair in images:
+        terms = pair["node_selector_terms"]
+        terms = json.dumps(terms) if terms else "any node"
+        print(
+            f"{pair['users']:6d} users  {pair['image']}  nodes: {terms}",
+            file=sys.stderr,
+        )
+
+
+if __name__ == "__main__":
+    main()
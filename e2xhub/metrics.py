@@ -0,0 +1,142 @@
+"""
+Timing of the spawn hot path. Functions decorated with timed() report their
+duration to the enabled sink, by default a Prometheus histogram registered in
+the default prometheus_client registry which JupyterHub exposes under
+/hub/metrics. Outside of the hub any callable(operation, seconds) can be used
+as sink. While disabled, timed functions only pay for one extra call.
+"""
+
+import functools
+import inspect
+import threading
+import time
+
+# sink receiving (operation, seconds), None if timing is disabled
+_sink = None
+
+
+class PrometheusSink:
+    """
+    Export the durations as the e2xhub_operation_duration_seconds histogram
+    """
+
+    # a histogram can only be registered once per registry
+    _histograms = {}
+    _lock = threading.Lock()
+
+    def __init__(self, registry=None):
+        """
+        args:
+            registry: prometheus_client registry, the default one if None
+        """
+        from prometheus_client import REGISTRY, Histogram
+
+        registry = registry or REGISTRY
+        with self._lock:
+            if id(registry) not in self._histograms:
+                self._histograms[id(registry)] = Histogram(
+                    "e2xhub_operation_duration_seconds",
+                    "Duration of the e2xhub profile and spawn operations",
+                    ["operation"],
+                    registry=registry,
+                )
+            self.histogram = self._histograms[id(registry)]
+
+    def __call__(self, operation, seconds):
+        self.histogram.labels(operation=operation).observe(seconds)
+
+
+class RecordingSink:
+    """
+    Keep the durations in memory, e.g. for benchmarks and tests
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.durations = {}
+
+    def __call__(self, operation, seconds):
+        with self._lock:
+            self.durations.setdefault(operation, []).append(seconds)
+
+    def summary(self):
+        """
+        Count, total and max duration of each operation
+        """
+        with self._lock:
+            return {
+                operation: {
+                    "count": len(durations),
+                    "total": sum(durations),
+                    "max": max(durations),
+                }
+                for operation, durations in self.durations.items()
+            }
+
+
+def enable_timing(sink=None):
+    """
+    Enable timing of the decorated functions
+    args:
+        sink: callable(operation, seconds), a PrometheusSink if None
+    """
+    global _sink
+    _sink = sink if sink is not None else PrometheusSink()
+    return _sink
+
+
+def disable_timing():
+    """
+    Disable timing of the decorated functions
+    """
+    global _sink
+    _sink = None
+
+
+def observe(operation, seconds):
+    """
+    Report a duration to the sink if timing is enabled
+    args:
+        operation: name of the operation
+        seconds: duration in seconds
+    """
+    sink = _sink
+    if sink is not None:
+        sink(operation, seconds)
+
+
+def timed(operation):
+    """
+    Decorator reporting the duration of a function or coroutine function
+    args:
+        operation: name of the operation
+    """
+
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                if _sink is None:
+                    return await func(*args, **kwargs)
+                start = time.perf_counter()
+                try:
+                    return await func(*args, **kwargs)
+                finally:
+                    observe(operation, time.perf_counter() - start)
+
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _sink is None:
+                return func(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                observe(operation, time.perf_counter() - start)
+
+        return wrapper
+
+    return decorator
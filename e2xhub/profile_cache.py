@@ -0,0 +1,184 @@
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+
+def approximate_size(obj, seen=None):
+    """
+    Approximate the memory used by a nested structure of dicts, lists, tuples
+    and sets. Objects shared within the structure are only counted once.
+    args:
+        obj: object to measure
+        seen: ids of the objects already counted
+    """
+    if seen is None:
+        seen = set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        for key, value in obj.items():
+            size += approximate_size(key, seen) + approximate_size(value, seen)
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        for item in obj:
+            size += approximate_size(item, seen)
+    return size
+
+
+class ProfileListCache:
+    """
+    LRU cache with a time to live of the rendered profile list of each user.
+    An entry is only served if the server config is still the same and the
+    token of the user, i.e. the user's course memberships and the versions of
+    those course configs, did not change.
+    """
+
+    def __init__(self, maxsize=1024, ttl=300):
+        """
+        args:
+            maxsize: maximum number of cached users
+            ttl: seconds after which an entry is rebuilt anyway, 0 for no limit
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._lock = threading.Lock()
+        # username -> (server_cfg, token, expiry, value)
+        self._entries = OrderedDict()
+
+    def get(self, username, server_cfg, token):
+        """
+        Get the cached value of the user or None if it is missing or stale
+        args:
+            username: name of the user
+            server_cfg: server configuration the value was built from
+            token: hashable token of the user's courses
+        """
+        with self._lock:
+            entry = self._entries.get(username)
+            if entry is not None:
+                cached_cfg, cached_token, expiry, value = entry
+                if (
+                    (expiry is None or time.monotonic() < expiry)
+                    and cached_token == token
+                    and (cached_cfg is server_cfg or cached_cfg == server_cfg)
+                ):
+                    self._entries.move_to_end(username)
+                    self.hits += 1
+                    return value
+                del self._entries[username]
+            self.misses += 1
+            return None
+
+    def put(self, username, server_cfg, token, value):
+        """
+        Cache the value built for the user
+        args:
+            username: name of the user
+            server_cfg: server configuration the value was built from
+            token: hashable token of the user's courses
+            value: value to cache
+        """
+        if self.maxsize <= 0:
+            return
+        expiry = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            self._entries[username] = (server_cfg, token, expiry, value)
+            self._entries.move_to_end(username)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, username=None):
+        """
+        Drop the entry of the given user, or all entries if username is None
+        args:
+            username: name of the user
+        """
+        with self._lock:
+            if username is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(username, None)
+
+    def metrics(self):
+        """
+        Hit rate and approximate memory use of the cache
+        """
+        with self._lock:
+            values = [entry[3] for entry in self._entries.values()]
+            requests = self.hits + self.misses
+            return {
+                "entries": len(values),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / requests if requests else 0.0,
+                "memory_bytes": approximate_size(values),
+            }
+
+
+class ProfileFragmentCache:
+    """
+    Course and semester profile fragments shared by all users. The fragments
+    are built once for a server config and course catalog version and must
+    not be modified, per-user profiles only select and combine them.
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._server_cfg = None
+        self._course_cfg_list = None
+        self._fragments = {}
+
+    def prepare(self, server_cfg, course_cfg_list):
+        """
+        Drop all fragments if the server config or the course catalog changed
+        args:
+            server_cfg: server configuration
+            course_cfg_list: course config and user list
+        """
+        with self._lock:
+            if self._course_cfg_list is course_cfg_list and (
+                self._server_cfg is server_cfg or self._server_cfg == server_cfg
+            ):
+                return
+            self._server_cfg = server_cfg
+            self._course_cfg_list = course_cfg_list
+            self._fragments = {}
+
+    def invalidate(self):
+        """
+        Drop all fragments
+        """
+        with self._lock:
+            self._fragments = {}
+
+    def get(self, key, build):
+        """
+        Get the fragment stored under key, build and store it if missing
+        args:
+            key: hashable key of the fragment
+            build: function returning the fragment
+        """
+        with self._lock:
+            fragment = self._fragments.get(key)
+            if fragment is not None:
+                self.hits += 1
+                return fragment
+            self.misses += 1
+            fragments = self._fragments
+
+        fragment = build()
+        with self._lock:
+            fragments[key] = fragment
+        return fragment
@@ -0,0 +1,194 @@
+"""
+Compact storage of the course members. Every username is interned once into
+a shared UsernameTable and each course id keeps its members as a sorted array
+of 32-bit ids instead of a set of strings, so users enrolled in many course ids
+are only stored once.
+"""
+
+import logging
+import threading
+from array import array
+from bisect import bisect_left
+
+from .utils import iter_csv_column
+
+log = logging.getLogger(__name__)
+
+
+class UsernameTable:
+    """
+    Interned usernames, each username gets a stable integer id
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._ids = {}
+        self.names = []
+
+    def __len__(self):
+        return len(self.names)
+
+    def __getstate__(self):
+        return {"names": self.names}
+
+    def __setstate__(self, state):
+        self._lock = threading.Lock()
+        self.names = state["names"]
+        self._ids = {username: uid for uid, username in enumerate(self.names)}
+
+    def intern(self, username):
+        """
+        Get the id of the username, adding it to the table if it is new
+        args:
+            username: name of the user
+        """
+        uid = self._ids.get(username)
+        if uid is not None:
+            return uid
+        with self._lock:
+            uid = self._ids.get(username)
+            if uid is None:
+                uid = len(self.names)
+                self.names.append(username)
+                self._ids[username] = uid
+            return uid
+
+    def lookup(self, username):
+        """
+        Get the id of the username or None if it was never interned
+        args:
+            username: name of the user
+        """
+        return self._ids.get(username)
+
+
+class Roster:
+    """
+    Immutable set of usernames stored as a sorted array of ids into a
+    UsernameTable. Supports membership tests, iteration over the usernames,
+    union and intersection with rosters of the same table.
+    """
+
+    __slots__ = ("table", "ids")
+
+    def __init__(self, table, ids):
+        """
+        args:
+            table: UsernameTable the ids refer to
+            ids: sorted array("I") of unique ids
+        """
+        self.table = table
+        self.ids = ids
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __iter__(self):
+        names = self.table.names
+        for uid in self.ids:
+            yield names[uid]
+
+    def __contains__(self, username):
+        uid = self.table.lookup(username)
+        if uid is None:
+            return False
+        ids = self.ids
+        i = bisect_left(ids, uid)
+        return i < len(ids) and ids[i] == uid
+
+    def __eq__(self, other):
+        if isinstance(other, Roster) and other.table is self.table:
+            return self.ids == other.ids
+        if isinstance(other, (Roster, set, frozenset)):
+            return set(self) == set(other)
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f"Roster({sorted(self)!r})"
+
+    def _check_table(self, others):
+        for other in others:
+            if other.table is not self.table:
+                raise ValueError("Rosters of different username tables")
+
+    def union(self, *others):
+        """
+        Roster of the users in any of the rosters
+        args:
+            others: rosters of the same UsernameTable
+        """
+        self._check_table(others)
+        ids = set(self.ids)
+        for other in others:
+            ids.update(other.ids)
+        return Roster(self.table, array("I", sorted(ids)))
+
+    def intersection(self, *others):
+        """
+        Roster of the users in all of the rosters
+        args:
+            others: rosters of the same UsernameTable
+        """
+        self._check_table(others)
+        ids = set(self.ids)
+        for other in sorted(others, key=len):
+            ids.intersection_update(other.ids)
+        return Roster(self.table, array("I", sorted(ids)))
+
+    __or__ = union
+    __and__ = intersection
+
+
+class RosterStore:
+    """
+    Create rosters sharing one UsernameTable
+    """
+
+    def __init__(self):
+        self.table = UsernameTable()
+        self.empty = Roster(self.table, array("I"))
+
+    def roster(self, usernames):
+        """
+        Create a roster from an iterable of usernames
+        args:
+            usernames: iterable of usernames
+        """
+        intern = self.table.intern
+        ids = array("I", sorted({intern(username) for username in usernames}))
+        return Roster(self.table, ids) if ids else self.empty
+
+    def load_roster(self, csv_path, filesystem=None):
+        """
+        Load the roster from the Username column of a csv file
+        and return an empty roster if there is an error
+        args:
+            csv_path: path to the csv file
+            filesystem: FileSystem to read from, the local file system if None
+        """
+        try:
+            return self.roster(iter_csv_column(csv_path, "Username", filesystem))
+        except Exception as e:
+            log.warning("Failed to load the roster of %s: %s", csv_path, e)
+            return self.empty
+
+
+def union_members(members_list):
+    """
+    Usernames in any of the member collections. Rosters of the same table are
+    merged on their ids, other collections (e.g. sets) are added as they are.
+    args:
+        members_list: iterable of rosters or sets of usernames
+    """
+    rosters = {}
+    usernames = set()
+    for members in members_list:
+        if isinstance(members, Roster):
+            rosters.setdefault(id(members.table), []).append(members)
+        else:
+            usernames.update(members)
+    for table_rosters in rosters.values():
+        usernames.update(table_rosters[0].union(*table_rosters[1:]))
+    return usernames
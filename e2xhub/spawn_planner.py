@@ -0,0 +1,366 @@
+"""
+Bulk pre-spawn planner for exam start storms. The volume mounts, environment
+and lifecycle hooks of many (username, course_id_slug) spawns are computed in
+one pass over the user lists and the course catalog, so that the pre-spawn
+hook of each spawn only has to look up the precomputed plan.
+
+usage:
+    e2xhub-plan-spawns --config config.yaml --server e2x_dev \\
+        --course-id-slug "Demo+student+Demo-SS21" --output plan.json
+"""
+
+import argparse
+import copy
+import hashlib
+import json
+import logging
+import os
+import time
+from types import SimpleNamespace
+
+from .catalog import file_fingerprint
+from .profile_cache import ProfileFragmentCache, ProfileListCache
+from .utils import get_course_config_and_user, load_server_cfg
+
+# seconds the plans are valid unless another ttl is given
+DEFAULT_TTL = 6 * 3600
+
+
+class PlanningSpawner:
+    """
+    Minimal stand-in for a KubeSpawner that records what the pre-spawn hook
+    configures for a single spawn
+    """
+
+    def __init__(self, username, course_id_slug, log=None):
+        self.user = SimpleNamespace(name=username)
+        self.user_options = {"course_id_slug": course_id_slug}
+        self.log = log or logging.getLogger("e2xhub.spawn_planner")
+        self.volumes = []
+        self.volume_mounts = []
+        self.environment = {}
+        self.lifecycle_hooks = {}
+        # fallbacks used when rendering profiles, they do not affect the plan
+        self.image = ""
+        self.image_pull_policy = "IfNotPresent"
+        self.cpu_guarantee = None
+        self.cpu_limit = None
+        self.mem_guarantee = 0
+        self.mem_limit = 0
+        self.node_affinity_required = []
+
+
+def course_members_requests(course_cfg_list, course_id_slug):
+    """
+    Spawn requests of all members of the course choice
+    args:
+        course_cfg_list: course config and user list
+        course_id_slug: course choice e.g. Demo+student+Demo-SS21
+    """
+    course_name, role, course_id = course_id_slug.split("+")
+    course_cfg = course_cfg_list.get(course_name, {}).get(role, {}).get(course_id)
+    if course_cfg is None:
+        return []
+    return [
+        (username, course_id_slug) for username in sorted(course_cfg["course_members"])
+    ]
+
+
+def server_fingerprint(server_cfg):
+    """
+    Hash of the server config a plan was computed with
+    args:
+        server_cfg: server configuration
+    """
+    content = json.dumps(server_cfg, sort_keys=True, default=str)
+    return hashlib.sha256(content.encode()).hexdigest()
+
+
+def course_file_fingerprints(course_cfg_list, course_id_slug, filesystem=None):
+    """
+    Fingerprints of the course config and member lists of the course choice,
+    empty if it is no course choice
+    args:
+        course_cfg_list: course config and user list
+        course_id_slug: course choice e.g. Demo+student+Demo-SS21
+        filesystem: FileSystem of the course files, the local file system if None
+    """
+    if course_id_slug.count("+") != 2:
+        return []
+    course_name, role, course_id = course_id_slug.split("+")
+    course_cfg = course_cfg_list.get(course_name, {}).get(role, {}).get(course_id)
+    if course_cfg is None:
+        return []
+    paths = [course_cfg["course_config_path"], *course_cfg["course_members_path"]]
+    return [list(file_fingerprint(path, filesystem)) for path in paths]
+
+
+def planning_copy(e2xhub):
+    """
+    Copy of the E2xHub sharing its course catalog and ConfigMap publisher, but
+    with its own profile caches so profiles rendered for the planning spawners
+    are never served to real spawns
+    args:
+        e2xhub: E2xHub to copy
+    """
+    traits = {
+        name: getattr(e2xhub, name)
+        for name in e2xhub.trait_names(config=True)
+        if name not in ("timing_enabled", "spawn_plan_file")
+    }
+    return e2xhub.__class__(
+        parent=e2xhub.parent,
+        log=e2xhub.log,
+        course_catalog=e2xhub.course_catalog,
+        scan_executor=e2xhub.scan_executor,
+        course_config_publisher=e2xhub.course_config_publisher,
+        profile_cache=ProfileListCache(maxsize=0),
+        profile_fragments=ProfileFragmentCache(),
+        **traits,
+    )
+
+
+def plan_pre_spawn(e2xhub, server_cfg, requests, ttl=DEFAULT_TTL):
+    """
+    Compute the pre-spawn result of many spawns in one pass over shared state.
+    Each plan records what it was computed from: the server config, the admin
+    status of the user and the fingerprints of the files of the course choice,
+    see plan_matches.
+    args:
+        e2xhub: E2xHub whose volume configuration is used
+        server_cfg: server configuration
+        requests: iterable of (username, course_id_slug)
+        ttl: seconds the plans are valid
+    """
+    if not ttl or ttl <= 0:
+        raise ValueError(f"The ttl of spawn plans must be positive, not {ttl}")
+    planner = planning_copy(e2xhub)
+    expires = time.time() + ttl
+    server_hash = e2xhub.server_fingerprint(server_cfg)
+
+    # user lists and course catalog are loaded once for all spawns
+    jupyterhub_users = planner._get_jupyterhub_users(server_cfg)
+    course_cfg_list = get_course_config_and_user(
+        server_cfg, catalog=planner.course_catalog
+    )
+
+    plans = {}
+    for username, course_id_slug in requests:
+        spawner = PlanningSpawner(username, course_id_slug, log=planner.log)
+        try:
+            profile_list = planner.configure_profile_list(
+                spawner, server_cfg, course_cfg_list=course_cfg_list
+            )
+            planner.configure_pre_spawn_hook(
+                spawner,
+                server_cfg,
+                jupyterhub_users=jupyterhub_users,
+                course_cfg_list=course_cfg_list,
+            )
+        except Exception as e:
+            # the spawn is planned again by its own pre-spawn hook
+            planner.log.warning(
+                "Failed to plan %s for %s: %s", course_id_slug, username, e
+            )
+            continue
+
+        # lifecycle hooks of the selected choice as rendered in the profile list
+        lifecycle_hooks = {}
+        if course_id_slug == "Default":
+            lifecycle_hooks = spawner.lifecycle_hooks
+        for profile in profile_list:
+            choices = (
+                profile.get("profile_options", {})
+                .get("course_id_slug", {})
+                .get("choices", {})
+            )
+            if course_id_slug in choices:
+                override = choices[course_id_slug]["kubespawner_override"]
+                lifecycle_hooks = override.get("lifecycle_hooks", {})
+
+        try:
+            course_files = course_file_fingerprints(
+                course_cfg_list, course_id_slug, planner.filesystem
+            )
+        except OSError as e:
+            planner.log.warning("Failed to plan %s: %s", course_id_slug, e)
+            continue
+
+        plans[(username, course_id_slug)] = {
+            "username": username,
+            "course_id_slug": course_id_slug,
+            "expires": expires,
+            "server_cfg": server_hash,
+            "admin_user": username in jupyterhub_users["admin_users"],
+            "course_files": course_files,
+            "volumes": spawner.volumes,
+            "volume_mounts": spawner.volume_mounts,
+            "environment": spawner.environment,
+            "lifecycle_hooks": lifecycle_hooks,
+        }
+
+    return plans
+
+
+def is_expired(plan, now=None):
+    """
+    Check if the plan is no longer valid, plans without expiry are never valid
+    args:
+        plan: plan of a spawn
+        now: current time.time()
+    """
+    expires = plan.get("expires")
+    return expires is None or expires < (time.time() if now is None else now)
+
+
+def plan_matches(plan, server_cfg, admin_user, filesystem=None, server_hash=None):
+    """
+    Check if the plan was computed from the current server config, admin
+    status and course files. The course files are checked with a stat each.
+    args:
+        plan: plan of a spawn
+        server_cfg: current server configuration
+        admin_user: whether the user is an admin now
+        filesystem: FileSystem of the course files, the local file system if None
+        server_hash: server_fingerprint of server_cfg if already known
+    """
+    if server_hash is None:
+        server_hash = server_fingerprint(server_cfg)
+    if plan.get("server_cfg") != server_hash:
+        return False
+    if plan.get("admin_user") != admin_user:
+        return False
+    try:
+        for fingerprint in plan.get("course_files", []):
+            if list(file_fingerprint(fingerprint[0], filesystem)) != fingerprint:
+                return False
+    except OSError:
+        return False
+    return True
+
+
+def save_spawn_plans(plans, output_file):
+    """
+    Write spawn plans to a json file
+    args:
+        plans: plans from plan_pre_spawn
+        output_file: path of the json file
+    """
+    tmp_file = f"{output_file}.tmp"
+    with open(tmp_file, "w") as outfile:
+        json.dump({"plans": list(plans.values())}, outfile, indent=1)
+    os.replace(tmp_file, output_file)
+
+
+def load_spawn_plans(plan_file):
+    """
+    Load the spawn plans which did not expire from a json file
+    args:
+        plan_file: path of the json file
+    """
+    with open(plan_file, "r") as infile:
+        content = json.load(infile)
+    now = time.time()
+    return {
+        (plan["username"], plan["course_id_slug"]): plan
+        for plan in content["plans"]
+        if not is_expired(plan, now)
+    }
+
+
+def apply_spawn_plan(spawner, plan):
+    """
+    Apply a spawn plan to the spawner, as the pre-spawn hook would
+    args:
+        spawner: kubespawner object
+        plan: plan of the spawn
+    """
+    plan = copy.deepcopy(plan)
+    spawner.volume_mounts = plan["volume_mounts"]
+    if plan["volumes"]:
+        # spawner objects are persistent, replace the volumes of a previous spawn
+        names = {volume.get("name") for volume in plan["volumes"]}
+        spawner.volumes = [
+            volume for volume in spawner.volumes if volume.get("name") not in names
+        ] + plan["volumes"]
+    if plan["environment"]:
+        spawner.environment = plan["environment"]
+    if plan["lifecycle_hooks"]:
+        spawner.lifecycle_hooks = plan["lifecycle_hooks"]
+
+
+def load_e2xhub(e2xhub_config=None):
+    """
+    Create an E2xHub for the command line tools
+    args:
+        e2xhub_config: traitlets python config file setting c.E2xHub options
+    """
+    from traitlets.config.loader import PyFileConfigLoader
+
+    from .e2xhub import E2xHub
+
+    if not e2xhub_config:
+        return E2xHub()
+    loader = PyFileConfigLoader(
+        os.path.basename(e2xhub_config),
+        path=os.path.dirname(os.path.abspath(e2xhub_config)),
+    )
+    return E2xHub(config=loader.load_config())
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Pre-compute the pre-spawn plans of an exam start"
+    )
+    parser.add_argument("--config", required=True, help="server config.yaml")
+    parser.add_argument("--server", required=True, help="name of the server")
+    parser.add_argument(
+        "--course-id-slug",
+        action="append",
+        default=[],
+        help="plan the spawns of all members of the course choice, can be repeated",
+    )
+    parser.add_argument(
+        "--requests",
+        help="csv file with Username and course_id_slug columns of single spawns",
+    )
+    parser.add_argument(
+        "--e2xhub-config",
+        help="traitlets python config file setting c.E2xHub options",
+    )
+    parser.add_argument(
+        "--ttl",
+        type=float,
+        default=DEFAULT_TTL,
+        help="seconds the plans stay valid, six hours by default",
+    )
+    parser.add_argument("--output", required=True, help="json file to write")
+    args = parser.parse_args(argv)
+
+    e2xhub = load_e2xhub(args.e2xhub_config)
+    server_cfg = load_server_cfg(args.config, args.server)
+    if server_cfg is None:
+        parser.error(f"server {args.server} not found in {args.config}")
+
+    course_cfg_list = get_course_config_and_user(
+        server_cfg, catalog=e2xhub.course_catalog
+    )
+    requests = []
+    for course_id_slug in args.course_id_slug:
+        requests.extend(course_members_requests(course_cfg_list, course_id_slug))
+    if args.requests:
+        import csv
+
+        with open(args.requests, "r", newline="", encoding="utf-8-sig") as infile:
+            for row in csv.DictReader(infile):
+                requests.append(
+                    (row["Username"].strip(), row["course_id_slug"].strip())
+                )
+
+    plans = plan_pre_spawn(e2xhub, server_cfg, requests, ttl=args.ttl)
+    save_spawn_plans(plans, args.output)
+    print(f"Planned {len(plans)} spawns into {args.output}")
+
+
+if __name__ == "__main__":
+    main()
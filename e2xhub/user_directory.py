@@ -0,0 +1,124 @@
+import threading
+import time
+from pathlib import Path
+
+from .utils import check_consecutive_keys
+
+# user list categories and the file name part selecting them, in order
+USER_LIST_CATEGORIES = (
+    ("admin_users", "admin"),
+    ("allowed_users", "allowed_users"),
+    ("blocked_users", "blocked_users"),
+)
+
+
+def user_list_category(file_name):
+    """
+    Category of a user list csv given its file name, None if it is no user list.
+    Any file name containing "admin" is an admin list.
+    args:
+        file_name: name of the csv file
+    """
+    name = file_name.lower()
+    if file_name.startswith(".") or ".csv" not in name:
+        return None
+    for category, part in USER_LIST_CATEGORIES:
+        if part in name:
+            return category
+    return None
+
+
+class UserDirectory:
+    """
+    Admin, allowed and blocked users of the hub from the csv files under
+    user_list_path. The csv files are loaded through the file cache of the
+    course catalog, so they are only read again when they change, and the sets
+    of each category are only rebuilt when one of the files changed.
+    With a refresh_interval, user_list_path is checked for changes at most once
+    per interval and lookups in between do not touch the file system at all.
+    """
+
+    def __init__(self, catalog, refresh_interval=0):
+        """
+        args:
+            catalog: CourseCatalog whose file system and file cache are used
+            refresh_interval: seconds between checks for changes, 0 to check
+            on every call
+        """
+        self.catalog = catalog
+        self.refresh_interval = refresh_interval
+        # bumped every time the user sets change
+        self.version = 0
+
+        self._lock = threading.Lock()
+        self._checked = None
+        self._key = None
+        self._paths = set()
+        self._users = self._empty()
+
+    @staticmethod
+    def _empty():
+        return {category: frozenset() for category, _ in USER_LIST_CATEGORIES}
+
+    def get_users(self, server_cfg):
+        """
+        Get JupyterHub users as {"admin_users", "allowed_users", "blocked_users"}
+        frozensets. The sets are shared between callers.
+        args:
+            server_cfg: server configuration
+        """
+        if not check_consecutive_keys(server_cfg, "user_list_path"):
+            return self._empty()
+        user_list_path = server_cfg["user_list_path"]
+        if (
+            self.refresh_interval
+            and self._key is not None
+            and self._key[0] == str(user_list_path)
+            and time.monotonic() - self._checked < self.refresh_interval
+        ):
+            return self._users
+
+        seen = {}
+        user_lists = []
+        for entry in self.catalog.filesystem.scandir(user_list_path):
+            category = user_list_category(entry.name)
+            if category is None or not entry.is_file():
+                continue
+            usernames = self.catalog.load_user_list(Path(entry.path), seen, entry)
+            user_lists.append((category, usernames))
+
+        key = (str(user_list_path), frozenset(seen.values()))
+        with self._lock:
+            self._checked = time.monotonic()
+            if key == self._key:
+                return self._users
+
+            users = {category: set() for category, _ in USER_LIST_CATEGORIES}
+            for category, usernames in user_lists:
+                users[category].update(usernames)
+            for path in self._paths - set(seen):
+                self.catalog.forget_file(path)
+
+            self._key = key
+            self._paths = set(seen)
+            self._users = {
+                category: frozenset(usernames) for category, usernames in users.items()
+            }
+            self.version += 1
+            return self._users
+
+    def cached_users(self):
+        """
+        The user sets of the last get_users call, without checking the files
+        for changes. Empty sets if the user lists were never loaded.
+        """
+        return self._users
+
+    def is_admin(self, server_cfg, username):
+        """
+        Check whether the user is listed in an admin csv file
+        args:
+            server_cfg: server configuration
+            username: name of the user
+        """
+        return username in self.get_users(server_cfg)["admin_users"]
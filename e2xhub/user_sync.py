@@ -0,0 +1,290 @@
+"""
+Keep the allowed (and optionally admin and blocked) users of the authenticator
+in sync with the user lists and course rosters while the hub is running.
+
+Every user list and course roster is a source of users. The course catalog
+returns the same member collection for files that did not change, so only the
+sources that changed are diffed and each user is reference counted over its
+sources: a user is added when the first source lists it and removed when the
+last one drops it. The cost of a sync scales with the changed files, not with
+the total number of users.
+"""
+
+import asyncio
+import logging
+import threading
+from collections import Counter
+
+from .user_directory import user_list_category
+from .utils import get_nbgrader_cfg
+
+CATEGORIES = ("allowed_users", "admin_users", "blocked_users")
+
+
+log = logging.getLogger(__name__)
+
+
+class AllowedUsersSync:
+    """
+    Apply the changes of the user lists and course rosters to the allowed_users,
+    admin_users and blocked_users sets of the authenticator. The users follow
+    the rules of utils.add_allowed_users; users listed in admin or blocked csv
+    files are only synced to admin_users and blocked_users if enabled.
+    Users that were already in a set of the authenticator are never removed.
+    """
+
+    def __init__(
+        self, catalog, target=None, sync_admin_users=False, sync_blocked_users=False
+    ):
+        """
+        args:
+            catalog: CourseCatalog, e.g. E2xHub.course_catalog
+            target: authenticator, or a function returning it (None while it
+            is not available yet, e.g. lambda: JupyterHub.instance().authenticator)
+            sync_admin_users: sync admin csv files to target.admin_users
+            sync_blocked_users: sync blocked csv files to target.blocked_users
+        """
+        self.catalog = catalog
+        self.target = target
+        self.sync_admin_users = sync_admin_users
+        self.sync_blocked_users = sync_blocked_users
+        self.syncs = 0
+
+        self._lock = threading.Lock()
+        # source key -> (category, members)
+        self._sources = {}
+        # category -> Counter of username -> number of sources listing it
+        self._counts = {category: Counter() for category in CATEGORIES}
+        # category -> users found in the target set before the sync added them
+        self._external = {category: set() for category in CATEGORIES}
+        # paths of the user list files loaded by the last sync
+        self._user_files = set()
+        self._applied_target = None
+        self._watcher = None
+        self._stop_watcher = threading.Event()
+
+    def _current_sources(self, server_cfg):
+        """
+        Map of the source key to (category, members) of all current sources
+        args:
+            server_cfg: server configuration
+        """
+        sources = {}
+
+        if "user_list_path" in server_cfg:
+            auto_add_hub_users = server_cfg.get("auto_add_hub_users", False)
+            seen = {}
+            entries = self.catalog.filesystem.scandir(server_cfg["user_list_path"])
+            for entry in entries:
+                category = user_list_category(entry.name)
+                if category is None or not entry.is_file():
+                    continue
+                synced = (category == "admin_users" and self.sync_admin_users) or (
+                    category == "blocked_users" and self.sync_blocked_users
+                )
+                if not (auto_add_hub_users or synced):
+                    continue
+
+                path = entry.path
+                usernames = self.catalog.load_user_list(path, seen, entry)
+                if auto_add_hub_users:
+                    sources[("allowed_users", path)] = ("allowed_users", usernames)
+                if synced:
+                    sources[(category, path)] = (category, usernames)
+            for path in self._user_files - set(seen):
+                self.catalog.forget_file(path)
+            self._user_files = set(seen)
+
+        course_cfg_list = self.catalog.get_course_config_and_user(server_cfg)
+        nbgrader_cfg = get_nbgrader_cfg(server_cfg)
+        auto_add_graders = nbgrader_cfg.get("auto_add_graders", False)
+        auto_add_students = nbgrader_cfg.get("auto_add_students", False)
+        for cname in course_cfg_list.keys():
+            for role in course_cfg_list[cname].keys():
+                if (role == "student" and auto_add_students) or (
+                    role == "grader" and auto_add_graders
+                ):
+                    for cid, course_cfg in course_cfg_list[cname][role].items():
+                        sources[("course", cname, role, cid)] = (
+                            "allowed_users",
+                            course_cfg["course_members"],
+                        )
+        return sources
+
+    def _resolve_target(self):
+        target = self.target
+        if callable(target):
+            try:
+                target = target()
+            except Exception:
+                target = None
+        return target
+
+    def _apply(self, target, category, added, removed):
+        users = getattr(target, category)
+        for username in added:
+            if username in users:
+                self._external[category].add(username)
+            else:
+                users.add(username)
+        for username in removed:
+            if username in self._external[category]:
+                self._external[category].discard(username)
+            else:
+                users.discard(username)
+
+    def _diff(self, server_cfg):
+        """
+        Pick up the changed user lists and rosters and update the reference
+        counts. Return the changes as {category: {"added": set, "removed": set}}
+        and, if the target was not synced yet, the users of all categories.
+        Does not touch the target.
+        args:
+            server_cfg: server configuration
+        """
+        with self._lock:
+            sources = self._current_sources(server_cfg)
+            counts = self._counts
+            increments = {category: [] for category in CATEGORIES}
+            decrements = {category: [] for category in CATEGORIES}
+            for key in set(self._sources) | set(sources):
+                old = self._sources.get(key)
+                new = sources.get(key)
+                if old is not None and new is not None and old[1] is new[1]:
+                    continue
+                old_members = set(old[1]) if old is not None else set()
+                new_members = set(new[1]) if new is not None else set()
+                if old is not None:
+                    decrements[old[0]].extend(old_members - new_members)
+                if new is not None:
+                    increments[new[0]].extend(new_members - old_members)
+            self._sources = sources
+
+            # count up before counting down, so users moving between sources
+            # are never removed in between
+            delta = {}
+            for category in CATEGORIES:
+                added, removed = set(), set()
+                for username in increments[category]:
+                    counts[category][username] += 1
+                    if counts[category][username] == 1:
+                        added.add(username)
+                for username in decrements[category]:
+                    counts[category][username] -= 1
+                    if counts[category][username] == 0:
+                        del counts[category][username]
+                        removed.add(username)
+                delta[category] = {
+                    "added": added - removed,
+                    "removed": removed - added,
+                }
+
+            all_users = None
+            if self._resolve_target() is not self._applied_target:
+                all_users = {category: set(counts[category]) for category in CATEGORIES}
+            self.syncs += 1
+            return delta, all_users
+
+    def _apply_changes(self, delta, all_users=None):
+        """
+        Apply the changes of a sync to the target. A target that was not synced
+        yet gets all users instead. Must run where the target is used, e.g. on
+        the event loop of the hub.
+        args:
+            delta: changes returned by _diff
+            all_users: users of all categories at the time of the diff
+        """
+        target = self._resolve_target()
+        if target is None:
+            return
+        if target is not self._applied_target:
+            # first sync with this target, apply all users
+            if all_users is None:
+                all_users = {category: self.users(category) for category in CATEGORIES}
+            for category in CATEGORIES:
+                self._external[category] = set()
+                self._apply(target, category, all_users[category], set())
+            self._applied_target = target
+        else:
+            for category in CATEGORIES:
+                self._apply(
+                    target,
+                    category,
+                    delta[category]["added"],
+                    delta[category]["removed"],
+                )
+
+    def sync(self, server_cfg):
+        """
+        Pick up the changed user lists and rosters and apply the added and
+        removed users to the target in the caller. Return the applied changes
+        as {category: {"added": set, "removed": set}}
+        args:
+            server_cfg: server configuration
+        """
+        delta, all_users = self._diff(server_cfg)
+        self._apply_changes(delta, all_users)
+        return delta
+
+    def users(self, category="allowed_users"):
+        """
+        Users currently listed by the sources of the category
+        args:
+            category: allowed_users, admin_users or blocked_users
+        """
+        with self._lock:
+            return set(self._counts[category])
+
+    @property
+    def watching(self):
+        return self._watcher is not None and self._watcher.is_alive()
+
+    def _watch(self, get_server_cfg, interval, loop):
+        while not self._stop_watcher.is_set():
+            try:
+                server_cfg = get_server_cfg()
+                if server_cfg is not None:
+                    delta, all_users = self._diff(server_cfg)
+                    loop.call_soon_threadsafe(self._apply_changes, delta, all_users)
+            except Exception as e:
+                log.warning("Failed to sync allowed users: %s", e)
+            self._stop_watcher.wait(interval)
+
+    def start_watcher(self, get_server_cfg, interval=60.0, loop=None):
+        """
+        Start a daemon thread syncing the users periodically. The files are
+        scanned in the thread, the changes are applied to the target on the
+        event loop, so the sets of the authenticator are only changed there.
+        args:
+            get_server_cfg: function returning the current server config,
+            e.g. lambda: config_store.get(server_name)
+            interval: polling interval in seconds
+            loop: event loop of the hub, the running loop if None
+        """
+        if self.watching:
+            return
+        if loop is None:
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                raise RuntimeError(
+                    "start_watcher needs the event loop of the hub, call it "
+                    "from the loop or pass loop"
+                )
+        self._stop_watcher.clear()
+        self._watcher = threading.Thread(
+            target=self._watch,
+            args=(get_server_cfg, interval, loop),
+            name="e2xhub-user-sync",
+            daemon=True,
+        )
+        self._watcher.start()
+
+    def stop_watcher(self):
+        """
+        Stop the syncing thread if it is running
+        """
+        self._stop_watcher.set()
+        if self._watcher is not None:
+            self._watcher.join()
+            self._watcher = None
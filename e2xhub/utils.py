@@ -1,51 +1,217 @@
+import csv
+import hashlib
+import json
+import logging
 import os
+import re
+import shlex
+import stat
 import yaml
-from pathlib import Path
-import pandas as pd
 
+from .filesystem import LOCAL_FILESYSTEM
+from .metrics import timed
 
-def load_yaml(yaml_file):
+# use the libyaml based loader if pyyaml is built with it
+YamlLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+
+log = logging.getLogger(__name__)
+
+
+def load_yaml(yaml_file, filesystem=None):
     """
     Load yaml file
     args:
         yaml_file: yaml file to load
+        filesystem: FileSystem to read from, the local file system if None
     """
+    filesystem = filesystem or LOCAL_FILESYSTEM
     configs = {}
-    with open(yaml_file, "r") as infile:
-        configs = yaml.safe_load(infile)
+    with filesystem.open(yaml_file, "r") as infile:
+        configs = yaml.load(infile, Loader=YamlLoader)
     return configs
 
 
-def load_df(df_path):
+def load_yaml_compiled(yaml_file, cache_dir, filesystem=None):
+    """
+    Load yaml file through a compiled cache. The parsed content is stored as json
+    under cache_dir, named after the sha256 of the yaml source, so the yaml is
+    only parsed again when its content changes. Content that does not survive a
+    json round trip (e.g. dates or non-string keys) is never cached.
+    args:
+        yaml_file: yaml file to load
+        cache_dir: directory of the compiled json files, on the local file system
+        filesystem: FileSystem to read the yaml from, the local file system if None
+    """
+    filesystem = filesystem or LOCAL_FILESYSTEM
+    with filesystem.open(yaml_file, "rb") as infile:
+        source = infile.read()
+    cache_path = os.path.join(cache_dir, hashlib.sha256(source).hexdigest() + ".json")
+
+    try:
+        with open(cache_path, "r") as infile:
+            return json.load(infile)
+    except (OSError, ValueError):
+        pass
+
+    configs = yaml.load(source, Loader=YamlLoader)
+    try:
+        compiled = json.dumps(configs)
+        if json.loads(compiled) == configs:
+            os.makedirs(cache_dir, exist_ok=True)
+            tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w") as outfile:
+                outfile.write(compiled)
+            os.replace(tmp_path, cache_path)
+    except (TypeError, ValueError, OSError) as e:
+        log.warning("Not caching compiled %s: %s", yaml_file, e)
+
+    return configs
+
+
+def iter_csv_column(csv_path, column="Username", filesystem=None):
+    """
+    Stream the stripped values of a single column from a csv file.
+    A leading BOM, blank lines, blank values and extra columns are ignored.
+    args:
+        csv_path: path to the csv file
+        column: name of the column to read
+        filesystem: FileSystem to read from, the local file system if None
+    """
+    filesystem = filesystem or LOCAL_FILESYSTEM
+    with filesystem.open(csv_path, "r", newline="", encoding="utf-8-sig") as infile:
+        reader = csv.reader(infile)
+        header = next(reader, None)
+        if not header:
+            return
+        header = [name.strip() for name in header]
+        if column not in header:
+            return
+        index = header.index(column)
+        for row in reader:
+            if len(row) > index:
+                value = row[index].strip()
+                if value:
+                    yield value
+
+
+def load_usernames(csv_path, filesystem=None):
     """
-    Load pandas dataframe and return empty df if there is an error
+    Load the set of usernames from the Username column of a csv file
+    and return an empty set if there is an error
     args:
-        df_path: path to the csv file
+        csv_path: path to the csv file
+        filesystem: FileSystem to read from, the local file system if None
     """
-    df = pd.DataFrame()
+    usernames = set()
     try:
-        df = pd.read_csv(df_path)
-    except pd.errors.EmptyDataError as e:
-        print("EmptyDataError: No columns to parse from file")
+        usernames.update(iter_csv_column(csv_path, "Username", filesystem))
     except Exception as e:
-        print(f"An error occurred: {str(e)}")
+        log.warning("Failed to load the usernames of %s: %s", csv_path, e)
+        usernames = set()
+
+    return usernames
+
+
+class ConfigWrite:
+    """
+    Lines of python config appended to a config file by the post start hook.
+    The lines are rendered on the hub and written with a single command,
+    consecutive writes to the same file are merged by join_commands.
+    """
+
+    def __init__(self, config_path, lines):
+        self.config_path = config_path
+        self.lines = list(lines)
+
+    def __str__(self):
+        quoted_lines = " ".join(shlex.quote(line) for line in self.lines)
+        return f"printf '%s\\n' {quoted_lines} >> {shlex.quote(self.config_path)}"
 
-    return df
+    def __repr__(self):
+        return f"ConfigWrite({self.config_path!r}, {self.lines!r})"
 
 
-def get_directory(server_cfg, directory_key):
+def parse_echo_command(cmd):
+    """
+    Convert a simple 'echo <text> >> <config file>' command into a ConfigWrite.
+    Commands using expansions, globs, comments, other redirections or escape
+    sequences whose output may depend on the shell are returned unchanged.
+    args:
+        cmd: shell command
+    """
+    if not isinstance(cmd, str) or any(char in cmd for char in "$`|;&<*?[({~#\n"):
+        return cmd
+    # 'n>>' appends the output of file descriptor n, not the output of echo
+    if re.search(r"(^|\s)\d+>>", cmd):
+        return cmd
+    match = re.fullmatch(r"\s*echo\s+([^>]*\S)\s+>>\s*(/[\w./-]+)\s*", cmd)
+    if match is None:
+        return cmd
+    try:
+        tokens = shlex.split(match.group(1))
+    except ValueError:
+        return cmd
+    if not tokens or tokens[0].startswith("-"):
+        return cmd
+    line = " ".join(tokens)
+    # echo may interpret backslash escapes depending on the shell
+    if "\\" in line:
+        return cmd
+    return ConfigWrite(match.group(2), [line])
+
+
+def strip_legacy_escapes(code):
+    """
+    Remove the backslashes of the shell escapes (e.g. \\% or \\() that exam
+    kernel init code needed while it was written with an unquoted echo.
+    The values are now written literally.
+    args:
+        code: line of init code
+    """
+    return re.sub(r"\\([%()\[\]'\"])", r"\1", code)
+
+
+def join_commands(cmds):
+    """
+    Join post start commands with &&, consecutive config writes to the same
+    file are merged into a single write
+    args:
+        cmds: list of shell commands and ConfigWrite
+    """
+    merged_cmds = []
+    for cmd in cmds:
+        if (
+            isinstance(cmd, ConfigWrite)
+            and merged_cmds
+            and isinstance(merged_cmds[-1], ConfigWrite)
+            and merged_cmds[-1].config_path == cmd.config_path
+        ):
+            merged_cmds[-1] = ConfigWrite(
+                cmd.config_path, merged_cmds[-1].lines + cmd.lines
+            )
+        else:
+            merged_cmds.append(cmd)
+    return " && ".join(str(cmd) for cmd in merged_cmds)
+
+
+def get_directory(server_cfg, directory_key, filesystem=None):
     """
     Get directory path given config and directory key.
     Return the value if the dir exists otherwise None
     args:
         config: configuration
         directory_key: the key in the config that contains the dir path to check
+        filesystem: FileSystem of the directory, the local file system if None
     """
+    filesystem = filesystem or LOCAL_FILESYSTEM
     if check_consecutive_keys(server_cfg, directory_key):
         grader_user_dir = server_cfg[directory_key]
-        if os.path.isdir(grader_user_dir):
-            grader_user_dir = grader_user_dir
-            return grader_user_dir
+        try:
+            if stat.S_ISDIR(filesystem.stat(grader_user_dir).st_mode):
+                return grader_user_dir
+        except (OSError, ValueError):
+            pass
     return None
 
 
@@ -65,37 +231,21 @@ def load_server_cfg(config_file, server_name):
     return None
 
 
-def get_jupyterhub_users(server_cfg):
+def get_jupyterhub_users(server_cfg, filesystem=None, catalog=None):
     """
     Get JupyterHub users (allowed_users, blocked_users, and admin_users)
     args:
         server_cfg: server configuration
+        filesystem: FileSystem to read from if no catalog is given
+        catalog: CourseCatalog whose file cache is used, e.g. E2xHub.course_catalog
     """
-    jupyterhub_users = {"allowed_users": [], "blocked_users": [], "admin_users": []}
-    if "user_list_path" not in server_cfg:
-        return jupyterhub_users
-
-    user_list_path = Path(server_cfg["user_list_path"])
-    user_list_file_path = [
-        item
-        for item in user_list_path.iterdir()
-        if item.is_file()
-        and not item.name.startswith(".")
-        and ".csv" in item.name.lower()
-    ]
-    for user_file_path in user_list_file_path:
-        df = load_df(pd.read_csv(user_file_path))
-        if "Username" in df.columns:
-            user_list = list(df.Username.str.strip())
-
-            if "admin" in user_file_path.name.lower():
-                jupyterhub_users["admin_users"].extend(user_list)
-            elif "allowed_users" in user_file_path.name.lower():
-                jupyterhub_users["allowed_users"].extend(user_list)
-            elif "blocked_users" in user_file_path.name.lower():
-                jupyterhub_users["blocked_users"].extend(user_list)
-
-    return jupyterhub_users
+    # imported here as the user directory is built on top of the utils
+    from .catalog import CourseCatalog
+    from .user_directory import UserDirectory
+
+    if catalog is None:
+        catalog = CourseCatalog(filesystem=filesystem)
+    return UserDirectory(catalog).get_users(server_cfg)
 
 
 def check_consecutive_keys(config, *argv):
@@ -145,12 +295,95 @@ def configure_volume_mount(
     return volume_mount
 
 
-def add_allowed_users(c, server_cfg):
+def build_member_index(course_cfg_list):
+    """
+    Build an inverted index username -> set of (course_name, role, course_id)
+    args:
+        course_cfg_list: course config and user list from get_course_config_and_user
+    """
+    member_index = {}
+    for cname in course_cfg_list.keys():
+        for role in course_cfg_list[cname].keys():
+            for cid in course_cfg_list[cname][role]:
+                for username in course_cfg_list[cname][role][cid]["course_members"]:
+                    member_index.setdefault(username, set()).add((cname, role, cid))
+    return member_index
+
+
+def course_members_by_id(course_cfg_list):
+    """
+    Map (course_name, role, course_id) to the member collection of the course id
+    args:
+        course_cfg_list: course config and user list from get_course_config_and_user
+    """
+    return {
+        (cname, role, cid): course_cfg["course_members"]
+        for cname, roles in course_cfg_list.items()
+        for role, course_ids in roles.items()
+        for cid, course_cfg in course_ids.items()
+    }
+
+
+def update_member_index(member_index, indexed_members, course_cfg_list):
+    """
+    Member index of course_cfg_list derived from the index of a previous
+    version, only the member collections that are not the same objects as in
+    the previous version are diffed. The previous index is not modified.
+    Return the index and the course_members_by_id of course_cfg_list.
+    args:
+        member_index: index of the previous version from build_member_index
+        indexed_members: course_members_by_id of the previous version
+        course_cfg_list: course config and user list from get_course_config_and_user
+    """
+    members = course_members_by_id(course_cfg_list)
+    member_index = dict(member_index)
+    copied = set()
+    for key in indexed_members.keys() | members.keys():
+        old, new = indexed_members.get(key), members.get(key)
+        if old is new:
+            continue
+        old_members = set(old) if old is not None else set()
+        new_members = set(new) if new is not None else set()
+        for username in old_members ^ new_members:
+            if username not in copied:
+                member_index[username] = set(member_index.get(username, ()))
+                copied.add(username)
+            if username in new_members:
+                member_index[username].add(key)
+            else:
+                member_index[username].discard(key)
+    for username in copied:
+        if not member_index[username]:
+            del member_index[username]
+    return member_index, members
+
+
+def is_course_member(
+    username, course_cfg_list, course_name, role, course_id, member_index=None
+):
+    """
+    Check whether the user is registered in the given course id
+    args:
+        username: name of the user
+        course_cfg_list: course config and user list from get_course_config_and_user
+        course_name: name of the course
+        role: role of the user e.g. student, grader
+        course_id: course id e.g. MRC-Teaching-SS23
+        member_index: optional index from build_member_index
+    """
+    if member_index is not None:
+        return (course_name, role, course_id) in member_index.get(username, ())
+    course_cfg = course_cfg_list[course_name][role][course_id]
+    return username in course_cfg["course_members"]
+
+
+def add_allowed_users(c, server_cfg, catalog=None):
     """
     Add users to JupyterHub allowed users when the hub starts or restarted
     args:
         c: JupyterHub config
         users: set users to be added to JupyterHub
+        catalog: optional CourseCatalog, e.g. E2xHub.course_catalog
     """
     # add all users once (or when the hub is restarted)
     new_allowed_users = set()
@@ -159,112 +392,47 @@ def add_allowed_users(c, server_cfg):
     if "user_list_path" in server_cfg:
         auto_add_hub_users = server_cfg.get("auto_add_hub_users", False)
         if auto_add_hub_users:
-            jupyterhub_users = get_jupyterhub_users(server_cfg)
+            jupyterhub_users = get_jupyterhub_users(server_cfg, catalog=catalog)
             for user_key in jupyterhub_users.keys():
                 new_allowed_users |= set(jupyterhub_users[user_key])
 
+    # imported here as the rosters are built on top of the utils
+    from .roster import union_members
+
     # Add user in each course under nbgrader/courses/<course_name>/<role>/<course_id>
     # to the allowed list if the config permits
-    course_cfg_list = get_course_config_and_user(server_cfg)
+    course_cfg_list = get_course_config_and_user(server_cfg, catalog=catalog)
     nbgrader_cfg = get_nbgrader_cfg(server_cfg)
     auto_add_graders = nbgrader_cfg.get("auto_add_graders", False)
     auto_add_students = nbgrader_cfg.get("auto_add_students", False)
+    course_members = []
     for cname in course_cfg_list.keys():
         for role in course_cfg_list[cname].keys():
             if (role == "student" and auto_add_students) or (
                 role == "grader" and auto_add_graders
             ):
                 for cid in course_cfg_list[cname][role]:
-                    new_allowed_users |= set(
+                    course_members.append(
                         course_cfg_list[cname][role][cid]["course_members"]
                     )
+    new_allowed_users |= union_members(course_members)
 
     c.Authenticator.allowed_users.update(new_allowed_users)
 
 
-def get_course_config_and_user(server_cfg):
+@timed("get_course_config_and_user")
+def get_course_config_and_user(server_cfg, catalog=None, filesystem=None):
     """
     Get course config and user list
     args:
         server_cfg: server config dict
+        catalog: persistent CourseCatalog to reuse between calls, if not given
+        all course configs and user lists are read from disk
+        filesystem: FileSystem to read from if no catalog is given
     """
+    # imported here as the catalog itself is built on top of the utils
+    from .catalog import CourseCatalog
 
-    course_cfg_and_user = {}
-    if check_consecutive_keys(server_cfg, "nbgrader", "course_dir"):
-        course_list_path = Path(server_cfg["nbgrader"]["course_dir"])
-    else:
-        return course_cfg_and_user
-
-    course_directories = [
-        item
-        for item in course_list_path.iterdir()
-        if item.is_dir() and not item.name.startswith(".")
-    ]
-
-    for course_path in course_directories:
-        # loop through grader and student list
-        role_directories = [
-            item
-            for item in course_path.iterdir()
-            if item.is_dir()
-            and not item.name.startswith(".")
-            and ("grader" in item.name.lower() or "student" in item.name.lower())
-        ]
-
-        if not role_directories:
-            continue
-
-        course_cfg_and_user[course_path.name] = {}
-
-        for role_path in role_directories:
-            config_list_path = [
-                item
-                for item in role_path.iterdir()
-                if item.is_file()
-                and not item.name.startswith(".")
-                and ("yaml" in item.name.lower() or "yml" in item.name.lower())
-            ]
-            user_list_path = [
-                item
-                for item in role_path.iterdir()
-                if item.is_file()
-                and not item.name.startswith(".")
-                and "csv" in item.name.lower()
-            ]
-
-            if config_list_path:
-                # get users for each course from each semester, the name of user list file
-                # should represent the name of the course id for each semester
-                course_cfg_and_user[course_path.name][role_path.name] = {}
-                for cl in config_list_path:
-                    course_cfg_and_user[course_path.name][role_path.name][cl.stem] = {}
-                    # course config path
-                    course_cfg_and_user[course_path.name][role_path.name][cl.stem][
-                        "course_config_path"
-                    ] = cl
-
-                    # load config once, to speed up the spawner if later the cfg is needed
-                    course_config = load_yaml(cl)
-                    if course_config is None:
-                        course_config = {}
-                    course_cfg_and_user[course_path.name][role_path.name][cl.stem][
-                        "course_config"
-                    ] = course_config
-
-                    user_path = [
-                        ccpath for ccpath in user_list_path if cl.stem in ccpath.stem
-                    ]
-                    user_list = []
-                    if user_path:
-                        df = load_df(user_path[0])
-                        if "Username" in df.columns:
-                            user_list = list(df.Username.str.strip())
-
-                    course_cfg_and_user[course_path.name][role_path.name][cl.stem][
-                        "course_members"
-                    ] = user_list
-                    course_cfg_and_user[course_path.name][role_path.name][cl.stem][
-                        "course_members_path"
-                    ] = user_path
-
-    return course_cfg_and_user
+    if catalog is None:
+        catalog = CourseCatalog(filesystem=filesystem)
+    return catalog.get_course_config_and_user(server_cfg)
@@ -0,0 +1,88 @@
+"""
+Reduce the volume mounts of a pod without changing what the container sees.
+Every subPath mount is a separate bind mount at pod start, so duplicates and
+mounts already exposed by another mount are dropped. Mounts are only removed
+when that is provably lossless: the remaining mounts give the container the
+same files at the same paths with the same permissions.
+
+The mounts generated for the course exchanges, homes and shares differ in
+volume, subPath or permission, so nothing is removed from them. The pass
+only helps with layouts that mount the same directory twice, e.g. extra
+mounts of the server config repeating a generated one.
+"""
+
+import posixpath
+
+
+def _normalize(path):
+    return posixpath.normpath(path) if path else ""
+
+
+def _is_under(path, parent):
+    return path != parent and path.startswith(parent.rstrip("/") + "/")
+
+
+def _exposes(outer, inner, mounts):
+    """
+    Whether outer already shows the content of inner at inner's mount path
+    with the same permission, without another mount shadowing it in between
+    """
+    outer_path = _normalize(outer["mountPath"])
+    inner_path = _normalize(inner["mountPath"])
+    if (
+        outer["name"] != inner["name"]
+        or not _is_under(inner_path, outer_path)
+        or bool(outer.get("readOnly")) != bool(inner.get("readOnly"))
+    ):
+        return False
+    relative = posixpath.relpath(inner_path, outer_path)
+    expected_subpath = _normalize(posixpath.join(outer.get("subPath") or "", relative))
+    if expected_subpath != _normalize(inner.get("subPath") or ""):
+        return False
+    # a mount between outer and inner would hide outer's content at inner's path
+    for mount in mounts:
+        path = _normalize(mount["mountPath"])
+        if _is_under(path, outer_path) and (
+            path == inner_path or _is_under(inner_path, path)
+        ):
+            if mount is not inner:
+                return False
+    return True
+
+
+def plan_volume_mounts(volume_mounts):
+    """
+    Remove duplicate and redundant volume mounts. Return the remaining mounts,
+    in their original order, and the removed ones.
+    - mounts of the same volume, subPath, mountPath and permission are merged
+      into one, duplicates with different permissions are all kept
+    - a mount is dropped if a mount of the same volume and permission at a
+      parent mountPath already exposes the same subPath at its mountPath
+    args:
+        volume_mounts: list of kubernetes volume mount dicts
+    """
+    merged = []
+    removed = []
+    by_key = {}
+    for mount in volume_mounts:
+        key = (
+            mount["name"],
+            _normalize(mount["mountPath"]),
+            _normalize(mount.get("subPath") or ""),
+            bool(mount.get("readOnly")),
+        )
+        if key in by_key:
+            removed.append(mount)
+            continue
+        by_key[key] = mount
+        merged.append(mount)
+
+    planned = []
+    for mount in merged:
+        if any(
+            other is not mount and _exposes(other, mount, merged) for other in merged
+        ):
+            removed.append(mount)
+        else:
+            planned.append(mount)
+    return planned, removed
@@ -0,0 +1,62 @@
+import logging
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+import yaml
+
+CONFIG_FILE = Path(__file__).resolve().parent.parent / "config" / "config.yaml"
+
+
+def make_spawner(username, course_id_slug=None):
+    """
+    Spawner stand-in with the attributes used by E2xHub
+    """
+    return SimpleNamespace(
+        user=SimpleNamespace(name=username),
+        log=logging.getLogger("tests.spawner"),
+        user_options={"course_id_slug": course_id_slug} if course_id_slug else {},
+        image="notebook:latest",
+        image_pull_policy="IfNotPresent",
+        cpu_guarantee=0.001,
+        cpu_limit=2.0,
+        mem_guarantee=1000000000,
+        mem_limit=2000000000,
+        node_affinity_required=[],
+        lifecycle_hooks={},
+        volumes=[],
+        volume_mounts=[],
+        environment={},
+    )
+
+
+@pytest.fixture
+def server_cfg(tmp_path):
+    """
+    Server config of e2x_dev with two courses of a grader and two students
+    """
+    course_dir = tmp_path / "courses"
+    user_dir = tmp_path / "users"
+    user_dir.mkdir()
+    (user_dir / "admin_users.csv").write_text("Username\nadmin\n")
+    for course_name in ("Demo", "Intro"):
+        for role, members in (("grader", ["grader"]), ("student", ["s1", "s2"])):
+            role_dir = course_dir / course_name / role
+            role_dir.mkdir(parents=True)
+            course_id = f"{course_name}-SS21"
+            course_cfg = {
+                "image": f"{course_name.lower()}:latest",
+                "course_cmds": [f"echo {course_id}"],
+            }
+            (role_dir / f"{course_id}.yaml").write_text(yaml.safe_dump(course_cfg))
+            (role_dir / f"{course_id}.csv").write_text(
+                "Username\n" + "\n".join(members) + "\n"
+            )
+
+    with open(CONFIG_FILE) as infile:
+        server_cfg = yaml.safe_load(infile)["server"]["e2x_dev"]
+    server_cfg["nbgrader"]["course_dir"] = str(course_dir)
+    server_cfg["nbgrader"]["enabled"] = True
+    server_cfg["nbgrader"]["default_exchange"] = {"personalized_feedback": True}
+    server_cfg["user_list_path"] = str(user_dir)
+    return server_cfg
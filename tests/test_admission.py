@@ -0,0 +1,172 @@
+import asyncio
+
+import pytest
+
+from e2xhub import AdmissionRejected, SpawnAdmissionController
+from e2xhub.admission import TokenBucket
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def run(coroutine):
+    return asyncio.run(asyncio.wait_for(coroutine, 5))
+
+
+async def settle():
+    """
+    Let the queued spawns and the dispatcher run until they wait again
+    """
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def test_token_bucket_refills_up_to_burst():
+    clock = Clock()
+    bucket = TokenBucket(2, 3, clock)
+    for _ in range(3):
+        assert bucket.available()
+        bucket.take()
+    assert not bucket.available()
+    assert bucket.wait_time() == pytest.approx(0.5)
+
+    clock.now += 10
+    assert bucket.tokens < 1
+    assert bucket.available()
+    assert bucket.tokens == 3
+
+
+def test_token_bucket_without_limit():
+    bucket = TokenBucket(0, 1, Clock())
+    for _ in range(100):
+        assert bucket.available()
+        bucket.take()
+    assert bucket.wait_time() == 0.0
+
+
+def test_admits_within_burst_without_waiting():
+    async def admit_all():
+        controller = SpawnAdmissionController()
+        controller.configure({"rate": 0.001, "burst": 3})
+        waits = [await controller.admit(f"s{i}") for i in range(3)]
+        return controller, waits
+
+    controller, waits = run(admit_all())
+    assert waits == [0.0, 0.0, 0.0]
+    assert controller.metrics() == {
+        "admitted": 3,
+        "queued": 0,
+        "rejected": 0,
+        "queue_length": 0,
+    }
+
+
+def test_privileged_spawns_are_admitted_first():
+    async def admit_in_order():
+        controller = SpawnAdmissionController()
+        controller.configure({"rate": 50, "burst": 1})
+        await controller.admit("first")
+        admitted = []
+
+        async def admit(username, privileged=False):
+            await controller.admit(username, privileged=privileged)
+            admitted.append(username)
+
+        tasks = [asyncio.create_task(admit(f"s{i}")) for i in range(3)]
+        await settle()
+        tasks.append(asyncio.create_task(admit("grader", privileged=True)))
+        await asyncio.gather(*tasks)
+        return admitted
+
+    assert run(admit_in_order()) == ["grader", "s0", "s1", "s2"]
+
+
+def test_blocked_course_does_not_block_other_courses():
+    async def admit_courses():
+        controller = SpawnAdmissionController()
+        controller.configure(
+            {"course_rate": 1, "course_burst": 1, "courses": {"B": {"rate": 50}}}
+        )
+        await controller.admit("a0", course_id="A")
+        blocked = asyncio.create_task(controller.admit("a1", course_id="A"))
+        await settle()
+        # the spawn of course B is queued behind a1, but is not held up by it
+        await controller.admit("b0", course_id="B")
+        await controller.admit("b1", course_id="B")
+        assert not blocked.done()
+        assert controller.queue_position("a1") == 1
+        blocked.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await blocked
+        return controller
+
+    controller = run(admit_courses())
+    assert controller.queue_length == 0
+
+
+def test_full_queue_rejects_students_only():
+    async def fill_queue():
+        controller = SpawnAdmissionController()
+        controller.configure({"rate": 0.001, "burst": 1, "max_queue": 1})
+        await controller.admit("first")
+        waiting = asyncio.create_task(controller.admit("s0"))
+        await settle()
+
+        with pytest.raises(AdmissionRejected):
+            await controller.admit("s1")
+        grader = asyncio.create_task(controller.admit("grader", privileged=True))
+        await settle()
+        assert controller.queue_length == 2
+        assert controller.queue_position("grader") == 1
+
+        for task in (waiting, grader):
+            task.cancel()
+        await asyncio.gather(waiting, grader, return_exceptions=True)
+        return controller
+
+    controller = run(fill_queue())
+    assert controller.rejected == 1
+    assert controller.queue_length == 0
+
+
+def test_spawn_waiting_longer_than_max_wait_is_rejected():
+    async def wait_too_long():
+        controller = SpawnAdmissionController()
+        controller.configure({"rate": 0.001, "burst": 1, "max_wait": 0.05})
+        await controller.admit("first")
+        with pytest.raises(AdmissionRejected):
+            await controller.admit("s0")
+        return controller
+
+    controller = run(wait_too_long())
+    assert controller.rejected == 1
+    assert controller.queue_length == 0
+    assert controller.queue_position("s0") is None
+
+
+def test_cancelled_spawn_leaves_the_queue():
+    async def cancel_waiting():
+        controller = SpawnAdmissionController()
+        controller.configure({"rate": 20, "burst": 1})
+        await controller.admit("first")
+        positions = []
+        cancelled = asyncio.create_task(controller.admit("s0"))
+        waiting = asyncio.create_task(controller.admit("s1", report=positions.append))
+        await settle()
+        assert controller.queue_position("s1") == 2
+
+        cancelled.cancel()
+        await asyncio.gather(cancelled, return_exceptions=True)
+        assert controller.queue_position("s0") is None
+        await waiting
+        return controller, positions
+
+    controller, positions = run(cancel_waiting())
+    assert positions[:2] == [2, 1]
+    assert controller.admitted == 2
+    assert controller.queue_length == 0
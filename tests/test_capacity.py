@@ -0,0 +1,161 @@
+import random
+
+import pytest
+
+from e2xhub import E2xHub
+from e2xhub.capacity import (
+    NodePool,
+    _PoolNodes,
+    parse_cpu,
+    parse_quantity,
+    parse_spawner_bytes,
+    simulate,
+)
+
+GiB = 2**30
+GPU_TERMS = [{"matchExpressions": [{"key": "gpu", "operator": "In", "values": ["1"]}]}]
+
+
+def group(course_id_slug, pods, cpu, memory, node_selector_terms=None):
+    return {
+        "course_id_slug": course_id_slug,
+        "pods": pods,
+        "cpu": cpu,
+        "memory": memory,
+        "node_selector_terms": node_selector_terms or [],
+    }
+
+
+@pytest.mark.parametrize(
+    "parse, value, expected",
+    [
+        (parse_cpu, 0.5, 500),
+        (parse_cpu, "2", 2000),
+        (parse_cpu, "250m", 250),
+        (parse_cpu, None, 0),
+        (parse_quantity, "30Gi", 30 * GiB),
+        (parse_quantity, "32G", 32 * 10**9),
+        (parse_quantity, 1024, 1024),
+        (parse_spawner_bytes, "1G", GiB),
+        (parse_spawner_bytes, "0.5M", 2**19),
+        (parse_spawner_bytes, "", 0),
+    ],
+)
+def test_parse_resources(parse, value, expected):
+    assert parse(value) == expected
+
+
+def test_invalid_quantity():
+    with pytest.raises(ValueError):
+        parse_quantity("30 gigabytes")
+
+
+def test_node_count_of_pool():
+    pool = NodePool("small", {}, cpu=4000, memory=16 * GiB)
+    report = simulate([group("Demo+student+Demo-SS21", 10, 1000, GiB)], [pool])
+
+    assert report["pools"]["small"]["nodes"] == 3
+    assert report["pools"]["small"]["pods"] == 10
+    assert report["pools"]["small"]["cpu_requested"] == 10000
+    assert report["pools"]["small"]["cpu_headroom"] == 2000
+    assert report["placements"] == {"Demo+student+Demo-SS21": {"small": 10}}
+    assert report["unschedulable"] == []
+
+
+def test_smaller_pods_fill_opened_nodes():
+    pool = NodePool("small", {}, cpu=4000, memory=16 * GiB, reserved_cpu=1000)
+    groups = [
+        group("Demo+student+Demo-SS21", 4, 600, GiB),
+        group("Demo+grader+Demo-SS21", 3, 1200, 2 * GiB),
+    ]
+    report = simulate(groups, [pool])
+
+    # two graders per node, the students fill the headroom of both nodes
+    assert report["pools"]["small"]["nodes"] == 2
+    assert report["pools"]["small"]["cpu_headroom"] == 0
+    assert report["pools"]["small"]["memory_requested"] == 10 * GiB
+
+
+def test_pods_are_packed_across_pools():
+    gpu = NodePool("gpu", {"gpu": "1"}, cpu=8000, memory=32 * GiB, max_nodes=1)
+    small = NodePool("small", {}, cpu=4000, memory=16 * GiB, max_nodes=2)
+    large = NodePool("large", {}, cpu=16000, memory=64 * GiB)
+    groups = [
+        group("ML+student+ML-SS21", 4, 2000, 8 * GiB, GPU_TERMS),
+        group("Demo+student+Demo-SS21", 12, 1000, GiB),
+    ]
+    report = simulate(groups, [gpu, small, large])
+
+    assert report["placements"] == {
+        "ML+student+ML-SS21": {"gpu": 4},
+        # the gpu node is full, small is at max_nodes and overflows to large
+        "Demo+student+Demo-SS21": {"small": 8, "large": 4},
+    }
+    assert {name: pool["nodes"] for name, pool in report["pools"].items()} == {
+        "gpu": 1,
+        "small": 2,
+        "large": 1,
+    }
+    assert report["pools"]["large"]["cpu_headroom"] == 12000
+    assert report["unschedulable"] == []
+
+
+@pytest.mark.parametrize(
+    "pod_group, reason",
+    [
+        (
+            group("Big+student+Big-SS21", 2, 8000, GiB),
+            "the requests exceed the allocatable resources of a node",
+        ),
+        (
+            group("ML+student+ML-SS21", 2, 1000, GiB, GPU_TERMS),
+            "no node pool matches the node affinity",
+        ),
+        (
+            group("Demo+student+Demo-SS21", 6, 2000, GiB),
+            "the matching node pools are at max_nodes",
+        ),
+    ],
+)
+def test_unschedulable_pods(pod_group, reason):
+    pool = NodePool("small", {}, cpu=4000, memory=16 * GiB, max_nodes=2)
+    report = simulate([pod_group], [pool])
+
+    unschedulable = report["unschedulable"]
+    assert [entry["reason"] for entry in unschedulable] == [reason]
+    placed = sum(report["placements"].get(pod_group["course_id_slug"], {}).values())
+    assert placed + unschedulable[0]["pods"] == pod_group["pods"]
+
+
+def test_place_keeps_node_resources_consistent():
+    rng = random.Random(7)
+    pool = NodePool("pool", {}, cpu=4000, memory=16 * GiB, max_pods=10)
+    nodes = _PoolNodes(pool)
+    cpu_requested = memory_requested = pods = 0
+    for _ in range(200):
+        pod_group = group(
+            "", 0, rng.choice([0, 100, 500, 1500]), rng.randint(0, 6) * GiB
+        )
+        count = rng.randint(1, 30)
+        placed = nodes.place(pod_group, count)
+        assert placed == count
+        cpu_requested += pod_group["cpu"] * placed
+        memory_requested += pod_group["memory"] * placed
+        pods += placed
+
+    for cpu, memory, free_pods, count in nodes.states:
+        assert cpu >= 0 and memory >= 0 and free_pods >= 0 and count > 0
+    cpu_free, memory_free, pods_free = nodes.free()
+    assert cpu_free == pool.cpu * nodes.nodes - cpu_requested
+    assert memory_free == pool.memory * nodes.nodes - memory_requested
+    assert pods_free == pool.max_pods * nodes.nodes - pods
+
+
+def test_simulate_capacity_of_sample_config(server_cfg):
+    pool = NodePool("user", {}, cpu=4000, memory=8 * GiB)
+    report = E2xHub().simulate_capacity(server_cfg, [pool])
+
+    # two graders with 2G and four students with 1G fill one node
+    assert report["pods"] == 6
+    assert report["pools"]["user"]["nodes"] == 1
+    assert report["pools"]["user"]["memory_headroom"] == 0
@@ -0,0 +1,200 @@
+import pytest
+
+from e2xhub import CountingFileSystem, CourseCatalog, E2xHub, MemoryFileSystem
+from e2xhub import catalog as catalog_module
+from e2xhub.utils import build_member_index
+
+from .conftest import make_spawner
+
+
+def test_catalog_scans_in_pool_of_its_own(server_cfg):
+    e2xhub = E2xHub(scan_workers=1)
+    assert e2xhub.course_catalog.executor is not None
+    assert e2xhub.course_catalog.executor is not e2xhub.scan_executor
+
+    # a cold catalog loaded from the only worker of the scan executor
+    future = e2xhub.scan_executor.submit(
+        e2xhub.configure_profile_list, make_spawner("s1"), server_cfg
+    )
+    profile_list = future.result(timeout=10)
+    assert {profile["slug"] for profile in profile_list} >= {
+        "Demo+student",
+        "Intro+student",
+    }
+
+
+def test_catalog_scans_in_caller_without_parallel_scan(server_cfg):
+    e2xhub = E2xHub(parallel_scan=False)
+    assert e2xhub.course_catalog.executor is None
+    assert e2xhub.configure_profile_list(make_spawner("s1"), server_cfg)
+
+
+COURSE_FILES = {
+    f"/courses/{course_name}/{role}/{course_name}-SS21.{suffix}": content
+    for course_name in ("Demo", "Intro")
+    for role, members in (("grader", "grader"), ("student", "s1\ns2"))
+    for suffix, content in (
+        ("yaml", f"image: {course_name.lower()}:latest\n"),
+        ("csv", f"Username\n{members}\n"),
+    )
+}
+SERVER_CFG = {"nbgrader": {"course_dir": "/courses"}}
+
+
+@pytest.fixture
+def filesystem():
+    return CountingFileSystem(MemoryFileSystem(COURSE_FILES))
+
+
+def test_unchanged_catalog_reads_no_file(filesystem):
+    catalog = CourseCatalog(filesystem=filesystem)
+    course_cfg_list = catalog.get_course_config_and_user(SERVER_CFG)
+    assert filesystem.counts["open"] == 8
+
+    with filesystem.measure("scan") as calls:
+        assert catalog.get_course_config_and_user(SERVER_CFG) is course_cfg_list
+    assert calls["open"] == 0
+    assert catalog.version == 1
+    assert catalog.hits == 8
+
+
+def test_changed_roster_rescans_only_its_course(filesystem):
+    catalog = CourseCatalog(filesystem=filesystem)
+    before = catalog.get_course_config_and_user(SERVER_CFG)
+
+    roster = "/courses/Demo/student/Demo-SS21.csv"
+    filesystem.filesystem.write_file(roster, "Username\ns1\ns2\ns3\n")
+    with filesystem.measure("scan") as calls:
+        after = catalog.get_course_config_and_user(SERVER_CFG)
+
+    assert calls["open"] == 1
+    assert catalog.misses == 9
+    assert catalog.version == 2
+    assert after is not before
+    assert after["Demo"]["student"]["Demo-SS21"]["course_members"] == {
+        "s1",
+        "s2",
+        "s3",
+    }
+    # the unchanged files are served from the cache
+    for course_name, role in (("Demo", "grader"), ("Intro", "student")):
+        course_id = f"{course_name}-SS21"
+        for key in ("course_config", "course_members"):
+            assert (
+                after[course_name][role][course_id][key]
+                is before[course_name][role][course_id][key]
+            )
+
+
+def test_removed_course_is_dropped(filesystem):
+    catalog = CourseCatalog(filesystem=filesystem)
+    catalog.get_course_config_and_user(SERVER_CFG)
+
+    filesystem.filesystem.remove("/courses/Intro")
+    course_cfg_list = catalog.get_course_config_and_user(SERVER_CFG)
+    assert sorted(course_cfg_list) == ["Demo"]
+    assert not any("Intro" in path for path in catalog._files)
+
+
+def test_member_index_is_updated_incrementally(filesystem, monkeypatch):
+    catalog = CourseCatalog(filesystem=filesystem)
+    before = catalog.get_course_config_and_user(SERVER_CFG)
+    member_index = catalog.get_member_index(before)
+    assert member_index == build_member_index(before)
+    assert catalog.get_member_index(before) is member_index
+
+    def full_build(course_cfg_list):
+        raise AssertionError("the index of the previous version is updated")
+
+    monkeypatch.setattr(catalog_module, "build_member_index", full_build)
+    filesystem.filesystem.write_file(
+        "/courses/Intro/student/Intro-SS21.csv", "Username\ns2\ns3\n"
+    )
+    after = catalog.get_course_config_and_user(SERVER_CFG)
+    updated_index = catalog.get_member_index(after)
+
+    monkeypatch.undo()
+    assert updated_index == build_member_index(after)
+    assert ("Intro", "student", "Intro-SS21") not in updated_index["s1"]
+    assert updated_index["s3"] == {("Intro", "student", "Intro-SS21")}
+    # the index of the previous version is left as it was
+    assert member_index == build_member_index(before)
+
+
+def test_snapshot_restores_catalog_without_reading_files(filesystem, tmp_path):
+    snapshot_file = str(tmp_path / "catalog.pickle")
+    catalog = CourseCatalog(
+        filesystem=filesystem, snapshot_file=snapshot_file, snapshot_delay=3600
+    )
+    course_cfg_list = catalog.get_course_config_and_user(SERVER_CFG)
+    member_index = catalog.get_member_index(course_cfg_list)
+    catalog.flush_snapshot()
+
+    filesystem.reset()
+    restored = CourseCatalog(filesystem=filesystem, snapshot_file=snapshot_file)
+    restored_cfg_list = restored.get_course_config_and_user(SERVER_CFG)
+
+    assert filesystem.counts["open"] == 0
+    assert restored_cfg_list == course_cfg_list
+    assert restored.get_member_index(restored_cfg_list) == member_index
+    # only the fingerprints are compared, the restored structure is kept
+    assert restored.version == 1
+    assert restored.hits == 8
+
+
+@pytest.mark.parametrize("content", [b"", b"not a pickle", b"\x80\x05N."])
+def test_corrupt_snapshot_falls_back_to_full_scan(filesystem, tmp_path, content):
+    snapshot_file = tmp_path / "catalog.pickle"
+    snapshot_file.write_bytes(content)
+
+    catalog = CourseCatalog(filesystem=filesystem, snapshot_file=str(snapshot_file))
+    assert catalog.version == 0
+    course_cfg_list = catalog.get_course_config_and_user(SERVER_CFG)
+
+    assert filesystem.counts["open"] == 8
+    assert sorted(course_cfg_list) == ["Demo", "Intro"]
+
+
+def test_get_course_reads_only_the_selected_course(filesystem):
+    catalog = CourseCatalog(filesystem=filesystem)
+
+    with filesystem.measure("get_course") as calls:
+        course = catalog.get_course(SERVER_CFG, "Demo", "student", "Demo-SS21")
+    assert calls == {"stat": 2, "scandir": 0, "open": 2}
+    course_cfg = course["Demo"]["student"]["Demo-SS21"]
+    assert course_cfg["course_config"] == {"image": "demo:latest"}
+    assert course_cfg["course_members"] == {"s1", "s2"}
+
+    # the full scan reuses the files loaded for the course
+    with filesystem.measure("scan") as calls:
+        catalog.get_course_config_and_user(SERVER_CFG)
+    assert calls["open"] == 6
+
+
+def test_get_course_falls_back_to_csv_containing_the_course_id(filesystem):
+    memory = filesystem.filesystem
+    memory.remove("/courses/Demo/student/Demo-SS21.csv")
+    memory.write_file("/courses/Demo/student/Demo-SS21-exam.csv", "Username\ns3\n")
+    catalog = CourseCatalog(filesystem=filesystem)
+
+    course = catalog.get_course(SERVER_CFG, "Demo", "student", "Demo-SS21")
+    course_cfg = course["Demo"]["student"]["Demo-SS21"]
+    assert course_cfg["course_members"] == {"s3"}
+    assert [str(path) for path in course_cfg["course_members_path"]] == [
+        "/courses/Demo/student/Demo-SS21-exam.csv"
+    ]
+
+
+@pytest.mark.parametrize(
+    "course_name, role, course_id",
+    [
+        ("Demo", "student", "Demo-WS21"),
+        ("Demo", "tutor", "Demo-SS21"),
+        ("..", "student", "Demo-SS21"),
+        ("Demo", "student", "../grader/Demo-SS21"),
+    ],
+)
+def test_get_course_of_unknown_course(filesystem, course_name, role, course_id):
+    catalog = CourseCatalog(filesystem=filesystem)
+
+    assert catalog.get_course(SERVER_CFG, course_name, role, course_id) == {}
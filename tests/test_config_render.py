@@ -0,0 +1,156 @@
+import copy
+import subprocess
+
+import pytest
+from traitlets.config import Config
+
+from e2xhub import E2xHub
+from e2xhub.utils import ConfigWrite, join_commands, parse_echo_command
+
+from .conftest import make_spawner
+
+
+def legacy_exam_kernel_commands(exam_kernel_cfg, config_path):
+    """
+    The exam kernel commands as rendered before the config was written on the hub
+    """
+    cmds = [
+        f"echo from textwrap import dedent >> {config_path}",
+        f"echo c = get_config\\(\\) >> {config_path}",
+    ]
+    if "allowed_imports" in exam_kernel_cfg:
+        joint_ai = "\\["
+        for allowed_import in exam_kernel_cfg["allowed_imports"]:
+            joint_ai = joint_ai + "\\'{}\\',".format(allowed_import)
+        cmds.append(
+            f"echo c.ExamKernel.allowed_imports = {joint_ai}\\] >> {config_path}"
+        )
+    if "init_code" in exam_kernel_cfg:
+        joint_ic = "\\'\\'\\'\\\\n"
+        for ic in exam_kernel_cfg["init_code"]:
+            joint_ic = joint_ic + "{} \\\\n".format(ic)
+        joint_ic = joint_ic + "\\'\\'\\'"
+        cmds.append(f"echo c.ExamKernel.init_code = {joint_ic} >> {config_path}")
+    if "allowed_magics" in exam_kernel_cfg:
+        joint_am = "\\["
+        for allowed_magic in exam_kernel_cfg["allowed_magics"]:
+            joint_am = joint_am + "\\'{}\\',".format(allowed_magic)
+        cmds.append(
+            f"echo c.ExamKernel.allowed_magics = {joint_am}\\] >> {config_path}"
+        )
+    return cmds
+
+
+def run_post_start(command):
+    subprocess.run(["/bin/sh", "-c", command], check=True)
+
+
+def load_config(path):
+    """
+    Execute a written config file the way traitlets loads it
+    """
+    config = Config()
+    with open(path) as infile:
+        exec(infile.read(), {"c": config, "get_config": lambda: config})
+    return config
+
+
+@pytest.fixture
+def config_paths(tmp_path):
+    return {
+        "nbgrader_config_path": str(tmp_path / "nbgrader_config.py"),
+        "ipython_config_path": str(tmp_path / "ipython_config.py"),
+    }
+
+
+def test_exam_kernel_config_matches_legacy_commands(server_cfg, config_paths):
+    ipython_config_path = config_paths["ipython_config_path"]
+    legacy_cfg = copy.deepcopy(server_cfg["exam_kernel"])
+    legacy_cfg["init_code"] = [
+        "\\%matplotlib inline" if ic == "%matplotlib inline" else ic
+        for ic in legacy_cfg["init_code"]
+    ]
+    run_post_start(
+        " && ".join(legacy_exam_kernel_commands(legacy_cfg, ipython_config_path))
+    )
+    expected = load_config(ipython_config_path)
+
+    e2xhub = E2xHub(**config_paths)
+    for exam_kernel_cfg in (server_cfg["exam_kernel"], legacy_cfg):
+        cmds = e2xhub.parse_exam_kernel_cfg(make_spawner("s1"), exam_kernel_cfg)
+        assert len(cmds) == 1
+        open(ipython_config_path, "w").close()
+        run_post_start(join_commands(cmds))
+        assert load_config(ipython_config_path) == expected
+    assert "%matplotlib inline" in expected.ExamKernel.init_code
+
+
+def test_echo_commands_match_running_them(server_cfg, config_paths, tmp_path):
+    config_dir = str(tmp_path)
+    commands = [
+        cmd.replace("/etc/jupyter", config_dir)
+        for cmd in server_cfg["commands"] + server_cfg["nbgrader"]["grader_cmds"]
+        if cmd.startswith("echo")
+    ]
+    nbgrader_config_path = config_paths["nbgrader_config_path"]
+
+    run_post_start(" && ".join(commands))
+    jupyter_config_path = tmp_path / "jupyter_notebook_config.py"
+    expected = load_config(nbgrader_config_path)
+    expected_jupyter = jupyter_config_path.read_text()
+
+    nbgrader_config = tmp_path / "nbgrader_config.py"
+    nbgrader_config.unlink()
+    jupyter_config_path.unlink()
+    rendered = [parse_echo_command(cmd) for cmd in commands]
+    assert any(isinstance(cmd, ConfigWrite) for cmd in rendered)
+    run_post_start(join_commands(rendered))
+    assert load_config(nbgrader_config_path) == expected
+    assert jupyter_config_path.read_text() == expected_jupyter
+
+
+def test_nbgrader_config_of_grader(server_cfg, config_paths):
+    e2xhub = E2xHub(**config_paths)
+    nbgrader_cfg = dict(server_cfg["nbgrader"], grader_cmds=[])
+    course_cfg = {
+        "course_exchange": {"personalized_inbound": True, "personalized_outbound": True}
+    }
+    cmds, _ = e2xhub.configure_nbgrader(
+        make_spawner("grader"),
+        nbgrader_cfg,
+        course_cfg,
+        "Demo-SS21",
+        "/home/jovyan/courses/Demo/Demo-SS21",
+        [],
+        0,
+        student=False,
+    )
+    run_post_start(join_commands(cmds))
+
+    config = load_config(config_paths["nbgrader_config_path"])
+    assert config.CourseDirectory.course_id == "Demo-SS21"
+    assert config.CourseDirectory.root == "/home/jovyan/courses/Demo/Demo-SS21"
+    assert config.Exchange.personalized_inbound is True
+    assert config.Exchange.personalized_outbound is True
+    assert config.Exchange.personalized_feedback is False
+
+
+@pytest.mark.parametrize(
+    "cmd",
+    [
+        "echo foo 2>> /etc/jupyter/nbgrader_config.py",
+        "echo foo 2>>/etc/jupyter/nbgrader_config.py",
+        "echo foo 1>> /etc/jupyter/nbgrader_config.py",
+        "echo $HOME >> /etc/jupyter/nbgrader_config.py",
+        "echo -n foo >> /etc/jupyter/nbgrader_config.py",
+        "echo foo\\\\n >> /etc/jupyter/nbgrader_config.py",
+    ],
+)
+def test_parse_echo_command_keeps_other_commands(cmd):
+    assert parse_echo_command(cmd) == cmd
+
+
+def test_parse_echo_command_keeps_trailing_number():
+    cmd = parse_echo_command("echo c.A.b = 2 >> /etc/jupyter/nbgrader_config.py")
+    assert cmd.lines == ["c.A.b = 2"]
+    assert cmd.config_path == "/etc/jupyter/nbgrader_config.py"
@@ -0,0 +1,93 @@
+import time
+
+import pytest
+import yaml
+
+from e2xhub import ServerConfigStore
+
+
+def write_config(config_file, image):
+    config = {"server": {"e2x_dev": {"mode": "teaching", "image": image}}}
+    config_file.write_text(yaml.safe_dump(config))
+
+
+@pytest.fixture
+def config_file(tmp_path):
+    config_file = tmp_path / "config.yaml"
+    write_config(config_file, "notebook:latest")
+    return config_file
+
+
+def test_config_is_parsed_once_until_the_file_changes(config_file):
+    store = ServerConfigStore(str(config_file))
+
+    server_cfg = store.get("e2x_dev")
+    assert server_cfg["image"] == "notebook:latest"
+    assert store.get("e2x_dev") is server_cfg
+    assert store.get("missing") is None
+    assert store.reloads == 1
+
+    write_config(config_file, "notebook:3.1")
+    assert store.get("e2x_dev")["image"] == "notebook:3.1"
+    assert store.reloads == 2
+    assert store.version == 2
+
+
+@pytest.mark.parametrize(
+    "content", ["server: [e2x_dev\n  mode: teaching", "", "# all commented out\n"]
+)
+def test_broken_config_keeps_last_good_config(config_file, content):
+    store = ServerConfigStore(str(config_file))
+    server_cfg = store.get("e2x_dev")
+
+    config_file.write_text(content)
+    assert not store.refresh()
+    assert store.get("e2x_dev") is server_cfg
+    assert store.errors == 1
+    assert store.version == 1
+
+    # the broken file is not parsed again until it changes
+    assert not store.refresh()
+    assert store.errors == 1
+
+    write_config(config_file, "notebook:3.1")
+    assert store.get("e2x_dev")["image"] == "notebook:3.1"
+
+
+def test_missing_config_keeps_last_good_config(config_file):
+    store = ServerConfigStore(str(config_file))
+    server_cfg = store.get("e2x_dev")
+
+    config_file.unlink()
+    assert store.get("e2x_dev") is server_cfg
+    assert store.errors == 0
+
+
+def test_without_config_file_there_is_no_config(tmp_path):
+    store = ServerConfigStore(str(tmp_path / "config.yaml"))
+
+    assert store.get("e2x_dev") is None
+    assert store.version == 0
+
+
+def test_watcher_reloads_changed_config(config_file):
+    store = ServerConfigStore(str(config_file))
+    store.start_watcher(interval=0.01)
+    try:
+        assert store.watching
+        # parsed before start_watcher returns
+        assert store.version == 1
+        assert store.get("e2x_dev")["image"] == "notebook:latest"
+
+        write_config(config_file, "notebook:3.1")
+        deadline = time.monotonic() + 5
+        while store.version < 2 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert store.get("e2x_dev")["image"] == "notebook:3.1"
+    finally:
+        store.stop_watcher()
+    assert not store.watching
+
+    # without the watcher get() refreshes by itself again
+    write_config(config_file, "notebook:latest")
+    assert store.get("e2x_dev")["image"] == "notebook:latest"
@@ -0,0 +1,201 @@
+import asyncio
+
+import pytest
+
+from e2xhub import CourseConfigPublisher, E2xHub, InMemoryConfigMapClient
+
+from .conftest import make_spawner
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class FailingClient(InMemoryConfigMapClient):
+    def __init__(self, failures):
+        super().__init__()
+        self.failures = failures
+
+    def create_config_map(self, name, data, labels=None):
+        if self.failures:
+            self.failures -= 1
+            raise RuntimeError("API unavailable")
+        super().create_config_map(name, data, labels)
+
+
+@pytest.fixture
+def clock():
+    return Clock()
+
+
+@pytest.fixture
+def client(clock):
+    return InMemoryConfigMapClient(clock=clock)
+
+
+def test_publish_creates_labelled_config_map(client):
+    publisher = CourseConfigPublisher(client)
+    name = publisher.publish({"post_start.sh": "echo a"})
+
+    assert publisher.wait(name)
+    assert client.creates == 1
+    assert client.config_maps[name]["data"] == {"post_start.sh": "echo a"}
+    assert client.config_maps[name]["labels"] == publisher.labels
+
+
+def test_publish_reuses_same_content(client):
+    publisher = CourseConfigPublisher(client)
+    name = publisher.publish({"post_start.sh": "echo a"})
+    publisher.wait(name)
+
+    assert publisher.publish({"post_start.sh": "echo a"}) == name
+    assert client.creates == 1
+    assert client.lists == 1
+
+
+def test_publish_new_content_creates_new_config_map(client):
+    publisher = CourseConfigPublisher(client)
+    old_name = publisher.publish({"post_start.sh": "echo a"})
+    publisher.assign(("Demo+student+Demo-SS21", None), old_name)
+    new_name = publisher.publish({"post_start.sh": "echo b"})
+    publisher.assign(("Demo+student+Demo-SS21", None), new_name)
+
+    assert new_name != old_name
+    assert publisher.wait(new_name)
+    assert publisher.lookup(("Demo+student+Demo-SS21", None)) == new_name
+    assert set(client.config_maps) == {old_name, new_name}
+
+
+def test_restart_lists_instead_of_publishing_again(client):
+    name = CourseConfigPublisher(client).publish({"post_start.sh": "echo a"})
+    CourseConfigPublisher(client).wait(name)
+
+    publisher = CourseConfigPublisher(client)
+    assert publisher.publish({"post_start.sh": "echo a"}) == name
+    assert publisher.wait(name)
+    assert client.creates == 1
+
+
+def test_wait_retries_failed_creation():
+    client = FailingClient(failures=1)
+    publisher = CourseConfigPublisher(client)
+    name = publisher.publish({"post_start.sh": "echo a"})
+
+    assert publisher.wait(name)
+    assert name in client.config_maps
+
+
+def test_prune_deletes_unused_config_maps(client, clock):
+    publisher = CourseConfigPublisher(client, max_age=100, clock=clock)
+    used = publisher.publish({"post_start.sh": "echo a"})
+    unused = publisher.publish({"post_start.sh": "echo b"})
+    publisher.assign(("Demo+student+Demo-SS21", None), used)
+    publisher.wait(used)
+    publisher.wait(unused)
+
+    clock.now += 50
+    assert publisher.prune() == []
+    clock.now += 100
+    assert publisher.prune() == [unused]
+    assert set(client.config_maps) == {used}
+
+    # published again once it is needed again
+    assert publisher.publish({"post_start.sh": "echo b"}) == unused
+    assert publisher.wait(unused)
+    assert unused in client.config_maps
+
+
+def test_prune_keeps_config_maps_of_previous_hub_for_max_age(client, clock):
+    name = CourseConfigPublisher(client).publish({"post_start.sh": "echo a"})
+    CourseConfigPublisher(client).wait(name)
+    clock.now += 1000
+
+    publisher = CourseConfigPublisher(client, max_age=100, clock=clock)
+    assert publisher.prune() == []
+    clock.now += 100
+    assert publisher.prune() == [name]
+
+
+def test_prune_due_runs_in_background(client, clock):
+    publisher = CourseConfigPublisher(
+        client, max_age=10, prune_interval=60, clock=clock
+    )
+    assert publisher.prune_due() is None
+    clock.now += 60
+    future = publisher.prune_due()
+    assert future is not None
+    future.result()
+    assert publisher.prune_due() is None
+
+
+def test_hub_mounts_published_config_map(server_cfg, client):
+    publisher = CourseConfigPublisher(client)
+    e2xhub = E2xHub(course_config_publisher=publisher)
+    course_id_slug = "Demo+student+Demo-SS21"
+
+    profile_list = e2xhub.configure_profile_list(make_spawner("s1"), server_cfg)
+    choices = [
+        choice
+        for profile in profile_list
+        for choice in profile.get("profile_options", {})
+        .get("course_id_slug", {})
+        .get("choices", {})
+        .values()
+    ]
+    assert choices
+    command = choices[0]["kubespawner_override"]["lifecycle_hooks"]["postStart"]
+    assert command["exec"]["command"][-1].endswith("/post_start.sh")
+
+    spawner = make_spawner("s1", course_id_slug)
+    e2xhub.configure_pre_spawn_hook(spawner, server_cfg)
+    name = publisher.lookup((course_id_slug, None))
+    assert {"name": "e2xhub-course-config", "configMap": {"name": name}} in (
+        spawner.volumes
+    )
+    assert name in client.config_maps
+
+
+def test_hub_publishes_after_restart_on_spawn(server_cfg, client):
+    course_id_slug = "Demo+student+Demo-SS21"
+    e2xhub = E2xHub(course_config_publisher=CourseConfigPublisher(client))
+    e2xhub.configure_profile_list(make_spawner("s1"), server_cfg)
+
+    # the profiles were not rendered since the restart
+    publisher = CourseConfigPublisher(client)
+    e2xhub = E2xHub(course_config_publisher=publisher)
+    spawner = make_spawner("s1", course_id_slug)
+    asyncio.run(e2xhub.async_configure_pre_spawn_hook(spawner, server_cfg))
+
+    name = publisher.lookup((course_id_slug, None))
+    assert name in client.config_maps
+    assert any(volume.get("configMap") == {"name": name} for volume in spawner.volumes)
+
+
+@pytest.mark.parametrize("scan_workers, spawns", [(1, 1), (4, 20)])
+def test_cold_hub_spawns_do_not_wait_on_their_own_executor(
+    server_cfg, client, scan_workers, spawns
+):
+    # the profiles are rendered for the ConfigMaps while the catalog is cold
+    publisher = CourseConfigPublisher(client)
+    e2xhub = E2xHub(scan_workers=scan_workers, course_config_publisher=publisher)
+    course_id_slug = "Demo+student+Demo-SS21"
+    spawners = [make_spawner(f"s{i % 2 + 1}", course_id_slug) for i in range(spawns)]
+
+    async def spawn_all():
+        hooks = [
+            e2xhub.async_configure_pre_spawn_hook(spawner, server_cfg)
+            for spawner in spawners
+        ]
+        await asyncio.wait_for(asyncio.gather(*hooks), 10)
+
+    asyncio.run(spawn_all())
+    name = publisher.lookup((course_id_slug, None))
+    assert name in client.config_maps
+    for spawner in spawners:
+        assert {"name": "e2xhub-course-config", "configMap": {"name": name}} in (
+            spawner.volumes
+        )
@@ -0,0 +1,162 @@
+import asyncio
+
+import pytest
+
+from e2xhub import CountingFileSystem, E2xHub, MemoryFileSystem
+from e2xhub.filesystem import FileSystem
+from e2xhub.utils import get_directory
+
+from .conftest import make_spawner
+
+
+def test_filesystem_is_abstract():
+    with pytest.raises(TypeError):
+        FileSystem()
+
+    class StatOnly(FileSystem):
+        def stat(self, path):
+            return None
+
+    with pytest.raises(TypeError):
+        StatOnly()
+
+
+def test_memory_filesystem_files_and_directories():
+    filesystem = MemoryFileSystem({"/courses/Demo/student/Demo-SS21.csv": "a"})
+    filesystem.makedirs("/courses/Demo/grader")
+
+    entries = filesystem.scandir("/courses/Demo")
+    assert [entry.name for entry in entries] == ["grader", "student"]
+    assert all(entry.is_dir() and not entry.is_file() for entry in entries)
+    (entry,) = filesystem.scandir("/courses/Demo/student")
+    assert entry.is_file()
+    assert entry.path == "/courses/Demo/student/Demo-SS21.csv"
+
+    with filesystem.open(entry.path) as infile:
+        assert infile.read() == "a"
+    with filesystem.open(entry.path, "rb") as infile:
+        assert infile.read() == b"a"
+
+
+def test_memory_filesystem_write_changes_fingerprint():
+    filesystem = MemoryFileSystem()
+    filesystem.write_file("/users/admin_users.csv", "Username\nadmin\n")
+    before = filesystem.stat("/users/admin_users.csv")
+    filesystem.write_file("/users/admin_users.csv", "Username\nadmin\n")
+    after = filesystem.stat("/users/admin_users.csv")
+
+    assert after.st_ino == before.st_ino
+    assert after.st_size == before.st_size
+    assert after.st_mtime_ns > before.st_mtime_ns
+
+
+def test_memory_filesystem_errors():
+    filesystem = MemoryFileSystem({"/users/admin_users.csv": ""})
+
+    with pytest.raises(FileNotFoundError):
+        filesystem.stat("/users/missing.csv")
+    with pytest.raises(FileNotFoundError):
+        filesystem.scandir("/missing")
+    with pytest.raises(NotADirectoryError):
+        filesystem.scandir("/users/admin_users.csv")
+    with pytest.raises(IsADirectoryError):
+        filesystem.open("/users")
+    with pytest.raises(ValueError):
+        filesystem.open("/users/admin_users.csv", "w")
+
+
+def test_memory_filesystem_remove_tree():
+    filesystem = MemoryFileSystem(
+        {"/courses/Demo/student/a.csv": "", "/courses/Intro/student/b.csv": ""}
+    )
+    filesystem.remove("/courses/Demo")
+
+    assert [entry.name for entry in filesystem.scandir("/courses")] == ["Intro"]
+    with pytest.raises(FileNotFoundError):
+        filesystem.stat("/courses/Demo/student/a.csv")
+
+
+def test_get_directory_uses_filesystem():
+    filesystem = CountingFileSystem(MemoryFileSystem({"/users/admin_users.csv": ""}))
+    server_cfg = {"user_list_path": "/users", "admin_list": "/users/admin_users.csv"}
+
+    assert get_directory(server_cfg, "user_list_path", filesystem) == "/users"
+    assert get_directory(server_cfg, "admin_list", filesystem) is None
+    assert (
+        get_directory({"user_list_path": "/missing"}, "user_list_path", filesystem)
+        is None
+    )
+    assert get_directory({}, "user_list_path", filesystem) is None
+    assert filesystem.counts == {"stat": 3, "scandir": 0, "open": 0}
+
+
+def test_counting_filesystem_counts_calls():
+    filesystem = CountingFileSystem(MemoryFileSystem({"/users/admin_users.csv": ""}))
+
+    with filesystem.measure("scan") as calls:
+        for entry in filesystem.scandir("/users"):
+            entry.is_file()
+            entry.stat()
+        filesystem.open("/users/admin_users.csv").close()
+
+    assert calls == {"stat": 1, "scandir": 1, "open": 1}
+    assert filesystem.operations["scan"] == calls
+    filesystem.reset()
+    assert filesystem.snapshot() == {"stat": 0, "scandir": 0, "open": 0}
+
+
+# file system calls allowed for the test courses once the catalog is warm:
+# a stat of each of the 8 course files and a listing of the course
+# directory, the 2 courses and their 4 role directories
+PROFILE_LIST_BUDGET = {"stat": 8, "scandir": 7, "open": 0}
+# the course config and member list of the selected course, and the admin
+# user list and its directory
+PRE_SPAWN_BUDGET = {"stat": 3, "scandir": 1, "open": 0}
+
+
+def within_budget(calls, budget):
+    return all(calls[operation] <= limit for operation, limit in budget.items())
+
+
+def test_profile_list_stat_budget(server_cfg):
+    filesystem = CountingFileSystem()
+    e2xhub = E2xHub(filesystem=filesystem)
+    e2xhub.configure_profile_list(make_spawner("s1"), server_cfg)
+
+    with filesystem.measure("profile_list") as calls:
+        e2xhub.configure_profile_list(make_spawner("s1"), server_cfg)
+    assert within_budget(calls, PROFILE_LIST_BUDGET), calls
+
+    with filesystem.measure("async_profile_list") as calls:
+        asyncio.run(e2xhub.async_configure_profile_list(make_spawner("s2"), server_cfg))
+    assert within_budget(calls, PROFILE_LIST_BUDGET), calls
+
+
+@pytest.mark.parametrize(
+    "username, course_id_slug",
+    [("s1", "Demo+student+Demo-SS21"), ("grader", "Demo+grader+Demo-SS21")],
+)
+def test_pre_spawn_stat_budget(server_cfg, username, course_id_slug):
+    filesystem = CountingFileSystem()
+    e2xhub = E2xHub(filesystem=filesystem)
+
+    # a cold pre-spawn only reads the selected course and the user lists
+    with filesystem.measure("cold_pre_spawn") as calls:
+        e2xhub.configure_pre_spawn_hook(
+            make_spawner(username, course_id_slug), server_cfg
+        )
+    assert calls["open"] <= 3, calls
+
+    with filesystem.measure("pre_spawn") as calls:
+        e2xhub.configure_pre_spawn_hook(
+            make_spawner(username, course_id_slug), server_cfg
+        )
+    assert within_budget(calls, PRE_SPAWN_BUDGET), calls
+
+    with filesystem.measure("async_pre_spawn") as calls:
+        asyncio.run(
+            e2xhub.async_configure_pre_spawn_hook(
+                make_spawner(username, course_id_slug), server_cfg
+            )
+        )
+    assert within_budget(calls, PRE_SPAWN_BUDGET), calls
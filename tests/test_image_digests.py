@@ -0,0 +1,152 @@
+from concurrent.futures import Future
+
+import pytest
+
+from e2xhub import E2xHub, FakeRegistryClient, ImageDigestResolver
+from e2xhub.image_digests import DOCKER_HUB_REGISTRY, parse_image, pinned_image
+
+from .conftest import make_spawner
+
+IMAGE = "ghcr.io/digiklausur/notebook:latest"
+
+
+class InlineExecutor:
+    """
+    Executor running the submitted functions right away
+    """
+
+    def __init__(self):
+        self.submitted = 0
+
+    def submit(self, fn, *args):
+        self.submitted += 1
+        future = Future()
+        future.set_result(fn(*args))
+        return future
+
+
+@pytest.fixture
+def registry():
+    return FakeRegistryClient()
+
+
+@pytest.mark.parametrize(
+    "image, expected",
+    [
+        (IMAGE, ("ghcr.io", "digiklausur/notebook", "latest", None)),
+        ("ubuntu", (DOCKER_HUB_REGISTRY, "library/ubuntu", "latest", None)),
+        ("jupyter/base:3.1", (DOCKER_HUB_REGISTRY, "jupyter/base", "3.1", None)),
+        ("localhost:5000/nb", ("localhost:5000", "nb", "latest", None)),
+        ("nb@sha256:ab", (DOCKER_HUB_REGISTRY, "library/nb", None, "sha256:ab")),
+    ],
+)
+def test_parse_image(image, expected):
+    assert parse_image(image) == expected
+
+
+def test_pinned_image():
+    assert pinned_image(IMAGE, "sha256:ab") == "ghcr.io/digiklausur/notebook@sha256:ab"
+    pinned = pinned_image("localhost:5000/nb", "sha256:ab")
+    assert pinned == "localhost:5000/nb@sha256:ab"
+
+
+def test_pin_resolves_unknown_images_in_background(registry):
+    digest = registry.push(IMAGE)
+    executor = InlineExecutor()
+    resolver = ImageDigestResolver(registry, executor=executor)
+
+    # rendered unpinned until the background resolution finished
+    assert resolver.pin(IMAGE, "Always") == (IMAGE, "Always")
+    assert executor.submitted == 1
+    assert resolver.version == 1
+
+    pinned = pinned_image(IMAGE, digest)
+    assert resolver.pin(IMAGE, "Always") == (pinned, "IfNotPresent")
+    assert resolver.pin(pinned, "Always") == (pinned, "IfNotPresent")
+    assert registry.resolves == 1
+
+
+@pytest.mark.parametrize("image", [None, "", {"name": "notebook", "tag": "latest"}])
+def test_pin_keeps_images_that_are_no_tag_reference(registry, image):
+    executor = InlineExecutor()
+    resolver = ImageDigestResolver(registry, executor=executor)
+
+    assert resolver.pin(image, "Always") == (image, "Always")
+    assert executor.submitted == 0
+
+
+def test_unresolvable_image_stays_unpinned(registry):
+    resolver = ImageDigestResolver(registry, executor=InlineExecutor())
+
+    assert resolver.pin(IMAGE, "Always") == (IMAGE, "Always")
+    assert resolver.pin(IMAGE, "Always") == (IMAGE, "Always")
+    assert resolver.failures == 1
+
+
+def test_refresh_picks_up_new_digest(registry):
+    registry.push(IMAGE)
+    resolver = ImageDigestResolver(registry, refresh_interval=3600)
+    assert resolver.resolve([IMAGE])
+    assert not resolver.refresh()
+
+    digest = registry.push(IMAGE, "new notebook")
+    assert resolver.refresh(force=True)
+    assert resolver.digest(IMAGE) == digest
+    assert resolver.version == 2
+
+
+def test_refresh_keeps_last_digest_on_failure(registry):
+    digest = registry.push(IMAGE)
+    resolver = ImageDigestResolver(registry, refresh_interval=0)
+    resolver.resolve([IMAGE])
+
+    del registry.digests[IMAGE]
+    assert not resolver.refresh()
+    assert resolver.digest(IMAGE) == digest
+    assert resolver.failures == 1
+
+
+def test_refresh_due_runs_in_background(registry):
+    registry.push(IMAGE)
+    executor = InlineExecutor()
+    resolver = ImageDigestResolver(registry, refresh_interval=3600, executor=executor)
+    resolver.resolve([IMAGE])
+    assert resolver.refresh_due() is None
+
+    resolver.refresh_interval = 0
+    digest = registry.push(IMAGE, "new notebook")
+    resolver.refresh_due().result()
+    assert executor.submitted == 1
+    assert resolver.digest(IMAGE) == digest
+
+
+def test_hub_renders_pinned_images(server_cfg, registry):
+    images = ["demo:latest", "intro:latest"]
+    for image in images:
+        registry.push(image)
+    resolver = ImageDigestResolver(
+        registry, refresh_interval=3600, executor=InlineExecutor()
+    )
+    e2xhub = E2xHub(image_digest_resolver=resolver)
+
+    def choice_images():
+        profile_list = e2xhub.configure_profile_list(make_spawner("s1"), server_cfg)
+        return sorted(
+            choice["kubespawner_override"]["image"]
+            for profile in profile_list
+            for choice in profile.get("profile_options", {})
+            .get("course_id_slug", {})
+            .get("choices", {})
+            .values()
+        )
+
+    # rendered unpinned while the course images are resolved in the background
+    assert choice_images() == images
+    assert choice_images() == [
+        pinned_image(image, resolver.digest(image)) for image in images
+    ]
+
+    # a new digest of a tag drops the cached profiles
+    digest = registry.push("demo:latest", "new demo")
+    assert resolver.refresh(force=True)
+    assert choice_images()[0] == pinned_image("demo:latest", digest)
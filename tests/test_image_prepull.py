@@ -0,0 +1,108 @@
+import pytest
+
+from e2xhub import E2xHub
+from e2xhub.image_prepull import (
+    collect_course_images,
+    image_reference,
+    node_selector_terms,
+    plan_image_prepull,
+    prepull_manifests,
+)
+
+SERVER_IMAGE = "ghcr.io/digiklausur/docker-stacks/notebook:latest"
+GPU_TERM = {"matchExpressions": [{"key": "gpu", "operator": "In", "values": ["1"]}]}
+
+
+@pytest.mark.parametrize(
+    "image, expected",
+    [
+        ("notebook:latest", "notebook:latest"),
+        ({"name": "notebook", "tag": "3.1", "pullPolicy": "Always"}, "notebook:3.1"),
+        ({"name": "notebook"}, "notebook"),
+        ({"tag": "latest"}, None),
+        ("", None),
+        (None, None),
+    ],
+)
+def test_image_reference(image, expected):
+    assert image_reference(image) == expected
+
+
+def test_node_selector_terms_flattens_nested_terms():
+    assert node_selector_terms([[]]) == []
+    assert node_selector_terms(None) == []
+    assert node_selector_terms([[GPU_TERM], {}]) == [GPU_TERM]
+
+
+def test_collect_course_images(server_cfg):
+    images = collect_course_images(E2xHub(), server_cfg)
+
+    assert [pair["image"] for pair in images] == ["demo:latest", "intro:latest"]
+    demo = images[0]
+    # graders and students of the course id share the image
+    assert demo["users"] == 3
+    assert demo["courses"] == {"Demo+grader+Demo-SS21": 1, "Demo+student+Demo-SS21": 2}
+    assert demo["node_selector_terms"] == []
+
+
+def test_collect_course_images_uses_server_image_dict(server_cfg, tmp_path):
+    # a course without an image of its own uses the image of the server config
+    course_file = tmp_path / "courses" / "Intro" / "student" / "Intro-SS21.yaml"
+    course_file.write_text("course_cmds: []\n")
+    assert isinstance(server_cfg["image"], dict)
+
+    images = collect_course_images(E2xHub(), server_cfg)
+    server_image = next(pair for pair in images if pair["image"] == SERVER_IMAGE)
+    assert server_image["courses"] == {"Intro+student+Intro-SS21": 2}
+    assert server_image["image_pull_policies"] == ["Always"]
+
+
+def test_prepull_manifests_group_images_by_node_affinity():
+    images = [
+        {
+            "image": "demo:latest",
+            "image_pull_policies": ["Always"],
+            "node_selector_terms": [],
+            "courses": {"Demo+student+Demo-SS21": 2},
+            "users": 2,
+        },
+        {
+            "image": "intro:latest",
+            "image_pull_policies": ["IfNotPresent"],
+            "node_selector_terms": [],
+            "courses": {"Intro+student+Intro-SS21": 5},
+            "users": 5,
+        },
+        {
+            "image": "gpu:latest",
+            "image_pull_policies": [],
+            "node_selector_terms": [GPU_TERM],
+            "courses": {"Gpu+student+Gpu-SS21": 1},
+            "users": 1,
+        },
+    ]
+    manifests = prepull_manifests(images, namespace="jhub")
+
+    assert len(manifests) == 2
+    any_node, gpu = manifests
+    assert all(manifest["metadata"]["namespace"] == "jhub" for manifest in manifests)
+    pod_spec = any_node["spec"]["template"]["spec"]
+    assert "affinity" not in pod_spec
+    # images with the most users are pulled first
+    assert [
+        (container["image"], container["imagePullPolicy"])
+        for container in pod_spec["initContainers"]
+    ] == [("intro:latest", "IfNotPresent"), ("demo:latest", "Always")]
+    affinity = gpu["spec"]["template"]["spec"]["affinity"]["nodeAffinity"]
+    terms = affinity["requiredDuringSchedulingIgnoredDuringExecution"]
+    assert terms["nodeSelectorTerms"] == [GPU_TERM]
+
+
+def test_plan_image_prepull_with_sample_config(server_cfg):
+    images, manifests = plan_image_prepull(E2xHub(), server_cfg)
+
+    assert len(manifests) == 1
+    init_containers = manifests[0]["spec"]["template"]["spec"]["initContainers"]
+    assert [container["image"] for container in init_containers] == [
+        pair["image"] for pair in images
+    ]
@@ -0,0 +1,86 @@
+import os
+import random
+
+from e2xhub import CourseCatalog
+from e2xhub.utils import (
+    build_member_index,
+    course_members_by_id,
+    update_member_index,
+)
+
+
+def make_course_cfg_list(rng, n_courses=5, n_users=30):
+    return {
+        f"Course{c}": {
+            role: {
+                f"Course{c}-S{s}": {
+                    "course_members": set(rng.sample(range(n_users), 8)),
+                }
+                for s in range(2)
+            }
+            for role in ("grader", "student")
+        }
+        for c in range(n_courses)
+    }
+
+
+def test_update_member_index_matches_full_build():
+    rng = random.Random(0)
+    course_cfg_list = make_course_cfg_list(rng)
+    member_index = build_member_index(course_cfg_list)
+    indexed_members = course_members_by_id(course_cfg_list)
+
+    for _ in range(50):
+        previous_index = {key: set(value) for key, value in member_index.items()}
+        changed = {
+            cname: {role: dict(course_ids) for role, course_ids in roles.items()}
+            for cname, roles in course_cfg_list.items()
+        }
+        cname = rng.choice(sorted(changed))
+        role = rng.choice(sorted(changed[cname]))
+        cid = rng.choice(sorted(changed[cname][role]) or ["Added-S0"])
+        if rng.random() < 0.2:
+            changed[cname][role].pop(cid, None)
+        else:
+            changed[cname][role][cid] = {
+                "course_members": set(rng.sample(range(30), rng.randint(0, 10)))
+            }
+        if rng.random() < 0.2:
+            changed[f"New{rng.randint(0, 3)}"] = {
+                "student": {"New-S0": {"course_members": {rng.randint(0, 40)}}}
+            }
+
+        new_index, indexed_members = update_member_index(
+            member_index, indexed_members, changed
+        )
+        assert new_index == build_member_index(changed)
+        # the index of the previous version is shared and stays unchanged
+        assert member_index == previous_index
+        member_index, course_cfg_list = new_index, changed
+
+
+def test_catalog_updates_member_index_per_version(server_cfg):
+    catalog = CourseCatalog()
+    course_cfg_list = catalog.get_course_config_and_user(server_cfg)
+    member_index = catalog.get_member_index(course_cfg_list)
+    assert catalog.get_member_index(course_cfg_list) is member_index
+    assert member_index["s1"] == {
+        ("Demo", "student", "Demo-SS21"),
+        ("Intro", "student", "Intro-SS21"),
+    }
+
+    roster = os.path.join(
+        server_cfg["nbgrader"]["course_dir"], "Demo", "student", "Demo-SS21.csv"
+    )
+    with open(roster, "w") as outfile:
+        outfile.write("Username\ns2\ns3\n")
+    os.utime(roster, ns=(0, 1))
+    course_cfg_list = catalog.get_course_config_and_user(server_cfg)
+    updated = catalog.get_member_index(course_cfg_list)
+
+    assert updated == build_member_index(course_cfg_list)
+    assert updated["s1"] == {("Intro", "student", "Intro-SS21")}
+    assert member_index["s1"] == {
+        ("Demo", "student", "Demo-SS21"),
+        ("Intro", "student", "Intro-SS21"),
+    }
@@ -0,0 +1,56 @@
+from e2xhub import E2xHub
+
+from .conftest import make_spawner
+
+
+def semester_choices(profile_list):
+    return [
+        choice
+        for profile in profile_list
+        for choice in profile.get("profile_options", {})
+        .get("course_id_slug", {})
+        .get("choices", {})
+        .values()
+    ]
+
+
+def modify_overrides(profile_list):
+    """
+    Modify the profiles the way kubespawner does for the selected profile
+    """
+    for profile in profile_list:
+        profile["modified"] = True
+        profile.setdefault("kubespawner_override", {})["image"] = "modified"
+    for choice in semester_choices(profile_list):
+        choice["modified"] = True
+        override = choice["kubespawner_override"]
+        override["image"] = "modified"
+        override["lifecycle_hooks"]["postStart"]["exec"]["command"].append("x")
+
+
+def test_profiles_of_users_do_not_share_fragments(server_cfg):
+    e2xhub = E2xHub()
+    modify_overrides(e2xhub.configure_profile_list(make_spawner("s1"), server_cfg))
+
+    profile_list = e2xhub.configure_profile_list(make_spawner("s2"), server_cfg)
+    assert all("modified" not in profile for profile in profile_list)
+    choices = semester_choices(profile_list)
+    assert choices
+    for choice in choices:
+        override = choice["kubespawner_override"]
+        assert "modified" not in choice
+        assert override["image"] != "modified"
+        assert override["lifecycle_hooks"]["postStart"]["exec"]["command"][-1] != "x"
+
+
+def test_cached_profile_list_is_not_modified(server_cfg):
+    e2xhub = E2xHub()
+    spawner = make_spawner("s1")
+    expected = e2xhub.configure_profile_list(spawner, server_cfg)
+    spawner.lifecycle_hooks["postStart"] = "modified"
+    modify_overrides(e2xhub.configure_profile_list(make_spawner("s1"), server_cfg))
+
+    spawner = make_spawner("s1")
+    assert e2xhub.configure_profile_list(spawner, server_cfg) == expected
+    assert spawner.lifecycle_hooks.get("postStart") != "modified"
+    assert e2xhub.profile_cache.hits == 2
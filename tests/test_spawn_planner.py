@@ -0,0 +1,152 @@
+import asyncio
+import copy
+import os
+
+import pytest
+
+from e2xhub import E2xHub, spawn_planner
+from e2xhub.spawn_planner import apply_spawn_plan, course_members_requests
+from e2xhub.utils import get_course_config_and_user
+
+from .conftest import make_spawner
+
+STUDENT = "Demo+student+Demo-SS21"
+
+
+def pre_spawn(e2xhub, server_cfg, username, course_id_slug, **kwargs):
+    spawner = make_spawner(username, course_id_slug)
+    e2xhub.configure_pre_spawn_hook(spawner, server_cfg, **kwargs)
+    return spawner
+
+
+@pytest.fixture
+def planned_hub(server_cfg):
+    e2xhub = E2xHub()
+    course_cfg_list = get_course_config_and_user(
+        server_cfg, catalog=e2xhub.course_catalog
+    )
+    requests = course_members_requests(course_cfg_list, STUDENT)
+    assert requests == [("s1", STUDENT), ("s2", STUDENT)]
+    e2xhub.plan_pre_spawn(server_cfg, requests + [("admin", "Default")])
+    return e2xhub
+
+
+def test_plan_pre_spawn_matches_pre_spawn_hook(server_cfg, planned_hub):
+    for username, course_id_slug in [("s1", STUDENT), ("admin", "Default")]:
+        plan = planned_hub.lookup_spawn_plan(username, course_id_slug, server_cfg)
+        assert plan is not None
+        spawner = make_spawner(username, course_id_slug)
+        apply_spawn_plan(spawner, plan)
+
+        expected = pre_spawn(
+            E2xHub(), server_cfg, username, course_id_slug, use_spawn_plan=False
+        )
+        assert spawner.volumes == expected.volumes
+        assert spawner.volume_mounts == expected.volume_mounts
+        assert spawner.environment == expected.environment
+
+    # lifecycle hooks of the course choice as kubespawner applies them
+    profile_list = E2xHub().configure_profile_list(make_spawner("s1"), server_cfg)
+    choices = {}
+    for profile in profile_list:
+        choices.update(
+            profile.get("profile_options", {}).get("course_id_slug", {}).get("choices")
+            or {}
+        )
+    override = choices[STUDENT]["kubespawner_override"]
+    plan = planned_hub.lookup_spawn_plan("s1", STUDENT, server_cfg)
+    assert plan["lifecycle_hooks"] == override["lifecycle_hooks"]
+
+
+def test_apply_spawn_plan_replaces_volumes_of_previous_spawn():
+    plan = {
+        "volumes": [{"name": "course-config", "configMap": {"name": "new"}}],
+        "volume_mounts": [{"name": "disk2", "mountPath": "/home/s1"}],
+        "environment": {"NBGRADER_COURSE_ID": "Demo-SS21"},
+        "lifecycle_hooks": {},
+    }
+    spawner = make_spawner("s1", STUDENT)
+    spawner.volumes = [
+        {"name": "disk2", "persistentVolumeClaim": {"claimName": "disk2"}},
+        {"name": "course-config", "configMap": {"name": "old"}},
+    ]
+    spawner.lifecycle_hooks = {"postStart": "kept"}
+
+    apply_spawn_plan(spawner, plan)
+
+    assert spawner.volumes == [
+        {"name": "disk2", "persistentVolumeClaim": {"claimName": "disk2"}},
+        {"name": "course-config", "configMap": {"name": "new"}},
+    ]
+    assert spawner.volume_mounts == plan["volume_mounts"]
+    assert spawner.environment == plan["environment"]
+    # empty parts of the plan keep what the spawner has
+    assert spawner.lifecycle_hooks == {"postStart": "kept"}
+    # the plan is not shared with the spawner
+    spawner.volume_mounts[0]["readOnly"] = True
+    assert "readOnly" not in plan["volume_mounts"][0]
+
+
+def test_plan_of_changed_course_files_is_stale(server_cfg, planned_hub, tmp_path):
+    roster = tmp_path / "courses" / "Demo" / "student" / "Demo-SS21.csv"
+    roster.write_text("Username\ns1\ns2\ns3\n")
+
+    assert planned_hub.lookup_spawn_plan("s1", STUDENT, server_cfg) is None
+    # the plans of other course choices stay valid
+    assert planned_hub.lookup_spawn_plan("admin", "Default", server_cfg) is not None
+
+
+def test_plan_of_changed_server_config_is_stale(server_cfg, planned_hub):
+    reloaded_cfg = copy.deepcopy(server_cfg)
+    assert planned_hub.lookup_spawn_plan("s1", STUDENT, reloaded_cfg) is not None
+
+    changed_cfg = copy.deepcopy(server_cfg)
+    changed_cfg["nbgrader"]["default_exchange"] = {"personalized_feedback": False}
+    assert planned_hub.lookup_spawn_plan("s1", STUDENT, changed_cfg) is None
+
+
+def test_plan_of_changed_admin_status_is_stale(server_cfg, planned_hub, tmp_path):
+    (tmp_path / "users" / "admin_users.csv").write_text("Username\nadmin\ns1\n")
+
+    assert planned_hub.lookup_spawn_plan("s1", STUDENT, server_cfg) is None
+
+
+def test_expired_plan_is_not_used(server_cfg, planned_hub):
+    plan = planned_hub.lookup_spawn_plan("s1", STUDENT, server_cfg)
+    plan["expires"] = 0
+
+    assert planned_hub.lookup_spawn_plan("s1", STUDENT, server_cfg) is None
+
+
+def test_server_fingerprint_is_computed_once(server_cfg, planned_hub, monkeypatch):
+    calls = []
+    fingerprint = spawn_planner.server_fingerprint
+
+    def counting_fingerprint(cfg):
+        calls.append(cfg)
+        return fingerprint(cfg)
+
+    monkeypatch.setattr(spawn_planner, "server_fingerprint", counting_fingerprint)
+    for _ in range(3):
+        assert planned_hub.lookup_spawn_plan("s1", STUDENT, server_cfg)
+        assert planned_hub.lookup_spawn_plan("s2", STUDENT, server_cfg)
+    # planned with the same server config object
+    assert calls == []
+
+    reloaded_cfg = copy.deepcopy(server_cfg)
+    for _ in range(3):
+        assert planned_hub.lookup_spawn_plan("s1", STUDENT, reloaded_cfg)
+    assert calls == [reloaded_cfg]
+
+
+def test_async_pre_spawn_hook_applies_plan(server_cfg, planned_hub):
+    def plan_is_used(*args, **kwargs):
+        raise AssertionError("the course catalog is not needed")
+
+    planned_hub.course_catalog.get_course = plan_is_used
+    spawner = make_spawner("s1", STUDENT)
+    asyncio.run(planned_hub.async_configure_pre_spawn_hook(spawner, server_cfg))
+
+    plan = planned_hub.lookup_spawn_plan("s1", STUDENT, server_cfg)
+    assert spawner.volume_mounts == plan["volume_mounts"]
+    assert os.path.basename(spawner.volume_mounts[0]["mountPath"]) == "s1"
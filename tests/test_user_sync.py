@@ -0,0 +1,69 @@
+import asyncio
+import threading
+import time
+from types import SimpleNamespace
+
+from e2xhub import AllowedUsersSync, E2xHub
+
+
+class RecordingSet(set):
+    """
+    Set recording the threads it is changed from
+    """
+
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.threads = set()
+
+    def add(self, value):
+        self.threads.add(threading.get_ident())
+        super().add(value)
+
+    def discard(self, value):
+        self.threads.add(threading.get_ident())
+        super().discard(value)
+
+
+def make_authenticator():
+    return SimpleNamespace(
+        allowed_users=RecordingSet({"static"}),
+        admin_users=RecordingSet(),
+        blocked_users=RecordingSet(),
+    )
+
+
+def test_sync_applies_changed_rosters(server_cfg):
+    server_cfg["nbgrader"]["auto_add_students"] = True
+    authenticator = make_authenticator()
+    sync = AllowedUsersSync(E2xHub().course_catalog, target=authenticator)
+
+    sync.sync(server_cfg)
+    assert authenticator.allowed_users == {"static", "s1", "s2"}
+
+    roster = f"{server_cfg['nbgrader']['course_dir']}/Demo/student/Demo-SS21.csv"
+    with open(roster, "w") as outfile:
+        outfile.write("Username\ns1\ns3\n")
+    delta = sync.sync(server_cfg)
+    assert delta["allowed_users"] == {"added": {"s3"}, "removed": set()}
+    assert authenticator.allowed_users == {"static", "s1", "s2", "s3"}
+
+
+def test_watcher_applies_changes_on_the_loop(server_cfg):
+    server_cfg["nbgrader"]["auto_add_students"] = True
+    authenticator = make_authenticator()
+    sync = AllowedUsersSync(E2xHub().course_catalog, target=authenticator)
+
+    async def watch():
+        sync.start_watcher(lambda: server_cfg, interval=0.01)
+        try:
+            deadline = time.monotonic() + 5
+            while "s2" not in authenticator.allowed_users:
+                assert time.monotonic() < deadline
+                await asyncio.sleep(0.01)
+        finally:
+            sync.stop_watcher()
+        return threading.get_ident()
+
+    loop_thread = asyncio.run(watch())
+    assert authenticator.allowed_users == {"static", "s1", "s2"}
+    assert authenticator.allowed_users.threads == {loop_thread}
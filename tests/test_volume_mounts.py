@@ -0,0 +1,103 @@
+import copy
+
+import pytest
+
+from e2xhub import E2xHub
+from e2xhub.volume_mounts import plan_volume_mounts
+
+from .conftest import make_spawner
+
+HOME = {"name": "disk2", "mountPath": "/home/s1", "subPath": "homes/s1"}
+SHARES = {
+    "name": "disk3",
+    "mountPath": "/srv/shares",
+    "subPath": "shares",
+    "readOnly": True,
+}
+
+
+def mount(mount_path, sub_path, read_only=False, name="disk3"):
+    return {
+        "name": name,
+        "mountPath": mount_path,
+        "subPath": sub_path,
+        "readOnly": read_only,
+    }
+
+
+def test_exact_duplicate_is_removed():
+    planned, removed = plan_volume_mounts([HOME, SHARES, dict(HOME)])
+
+    assert planned == [HOME, SHARES]
+    assert removed == [HOME]
+
+
+def test_duplicates_with_different_permissions_are_kept():
+    writable = mount("/srv/shares", "shares")
+    volume_mounts = [writable, SHARES]
+
+    planned, removed = plan_volume_mounts(copy.deepcopy(volume_mounts))
+
+    assert planned == volume_mounts
+    assert removed == []
+    assert [m["readOnly"] for m in planned] == [False, True]
+
+
+def test_child_exposed_by_parent_is_removed():
+    child = mount("/srv/shares/Demo", "shares/Demo", read_only=True)
+    planned, removed = plan_volume_mounts([SHARES, child])
+
+    assert planned == [SHARES]
+    assert removed == [child]
+
+
+@pytest.mark.parametrize(
+    "child",
+    [
+        # another permission than the parent
+        mount("/srv/shares/Demo", "shares/Demo"),
+        # another directory of the volume than the parent shows there
+        mount("/srv/shares/Demo", "courses/Demo", read_only=True),
+        # another volume
+        mount("/srv/shares/Demo", "shares/Demo", read_only=True, name="disk2"),
+    ],
+)
+def test_child_not_exposed_by_parent_is_kept(child):
+    planned, removed = plan_volume_mounts([SHARES, copy.deepcopy(child)])
+
+    assert planned == [SHARES, child]
+    assert removed == []
+
+
+def test_child_shadowed_by_other_mount_is_kept():
+    shadow = mount("/srv/shares/Demo", "other", name="disk2")
+    child = mount("/srv/shares/Demo/data", "shares/Demo/data", read_only=True)
+    volume_mounts = [SHARES, shadow, child]
+
+    planned, removed = plan_volume_mounts(copy.deepcopy(volume_mounts))
+
+    assert planned == volume_mounts
+    assert removed == []
+
+
+@pytest.mark.parametrize(
+    "username, course_id_slug",
+    [
+        ("s1", "Demo+student+Demo-SS21"),
+        ("grader", "Demo+grader+Demo-SS21"),
+        ("admin", "Default"),
+    ],
+)
+def test_generated_mounts_are_not_reduced(server_cfg, username, course_id_slug):
+    assert not E2xHub().optimize_volume_mounts
+
+    def volume_mounts(optimize_volume_mounts):
+        spawner = make_spawner(username, course_id_slug)
+        E2xHub(optimize_volume_mounts=optimize_volume_mounts).configure_pre_spawn_hook(
+            spawner, server_cfg
+        )
+        return spawner.volume_mounts
+
+    before = volume_mounts(False)
+    assert volume_mounts(True) == before
+    assert plan_volume_mounts(copy.deepcopy(before)) == (before, [])